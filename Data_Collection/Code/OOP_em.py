@@ -1,35 +1,202 @@
 """
 Please import EyeTrackerDataCollector class from this script.
 This class is used to collect eye tracking data using Tobii Pro SDK.
+Set EYETRACKER_BACKEND=simulated (or pass backend=OOP_simulated_tracker) to collect from a simulated eye tracker.
 """
-import tobii_research as tr
 from datetime import datetime
 import pandas as pd
 import time
 import threading
 import os
+if os.environ.get('EYETRACKER_BACKEND') == 'simulated':
+    import OOP_simulated_tracker as tr
+else:
+    try:
+        import tobii_research as tr
+    except ImportError:
+        tr = None
+from OOP_ring_buffer import GazeRingBuffer, gaze_record, local_time_ns
+from OOP_gaze_format import GazeSessionWriter, GAZE_SUFFIX
+from OOP_metrics import CollectorMetrics
 
 class EyeTrackerDataCollector:
-    def __init__(self):
+    # Buffered recording parameters
+    BUFFER_CAPACITY = 65536  # about 55 s of samples at 1200 Hz
+    FLUSH_SIZE = 4096  # wake the writer when this many samples are waiting
+    FLUSH_INTERVAL = 0.5  # seconds, upper bound between two flushes
+    METRICS_DIR = './Data_Collection/Data/Raw/Metrics/'
+
+    def __init__(self, buffered=True, file_format='csv', backend=None, online_classifier=None, connect=True):
         now = datetime.now()
-        self.file_path = now.strftime('./Data_Collection/Data/Raw/EM/%Y%m%d%H%M.csv')
+        # file_format='gaze' writes the binary columnar session format (see OOP_gaze_format.py), buffered mode only
+        if file_format == 'gaze' and not buffered:
+            raise ValueError("The gaze file format is only supported in buffered mode.")
+        self.file_format = file_format
+        suffix = GAZE_SUFFIX if file_format == 'gaze' else '.csv'
+        self.file_path = now.strftime(f'./Data_Collection/Data/Raw/EM/%Y%m%d%H%M{suffix}')
+        self.metrics_path = os.path.join(self.METRICS_DIR, now.strftime('%Y%m%d%H%M.json'))
+        self.metrics = None
         self.start_time = None  # Initialize start_time
         self.recording_duration = 5
-        self.my_eyetracker = self.initialize_eye_tracker()
+        # buffered=True: the callback only pushes into a ring buffer and a writer thread flushes it in batches
+        # buffered=False: the callback appends every sample to the csv file itself
+        self.buffered = buffered
+        self.buffer = None
+        self.writer_thread = None
+        self.stop_writing = threading.Event()
+        self.header_written = False
+        self.session_writer = None
+        # Optional OnlineEyeMovement (EM_Analysis/Code/OOP_online_ivt.py) that labels the samples during the session
+        self.online_classifier = online_classifier
+        # Module providing find_all_eyetrackers() and EYETRACKER_GAZE_DATA, tobii_research by default
+        self.tr = backend or tr
+        # connect=False creates a collector that only writes samples, e.g. the writer process of collect_isolated.py
+        self.my_eyetracker = None
+        if connect:
+            if self.tr is None:
+                raise ImportError("tobii_research is not installed. Set EYETRACKER_BACKEND=simulated to use a simulated eye tracker.")
+            self.my_eyetracker = self.initialize_eye_tracker()
 
     def initialize_eye_tracker(self):
-        found_eyetrackers = tr.find_all_eyetrackers()
+        found_eyetrackers = self.tr.find_all_eyetrackers()
         if found_eyetrackers:
             return found_eyetrackers[0]
         else:
             raise Exception("No eye trackers found.")
 
     def start_collecting(self):
-        self.my_eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback, as_dictionary=True)
-        self.start_time = datetime.now() 
+        self.metrics = CollectorMetrics()
+        if not self.buffered:
+            self.my_eyetracker.subscribe_to(self.tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback, as_dictionary=True)
+            self.start_time = datetime.now() 
+            time.sleep(self.recording_duration)
+            self.my_eyetracker.unsubscribe_from(self.tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback)
+            if self.online_classifier is not None:
+                self.online_classifier.finish()
+            self.save_metrics()
+            return
+
+        self.buffer = GazeRingBuffer(self.BUFFER_CAPACITY, self.FLUSH_SIZE)
+        if self.file_format == 'gaze':
+            self.session_writer = GazeSessionWriter(self.file_path)
+        self.stop_writing.clear()
+        self.writer_thread = threading.Thread(target=self.write_buffered_data)
+        self.writer_thread.start()
+        self.my_eyetracker.subscribe_to(self.tr.EYETRACKER_GAZE_DATA, self.buffered_gaze_data_callback, as_dictionary=True)
+        self.start_time = datetime.now()
         time.sleep(self.recording_duration)
+        self.my_eyetracker.unsubscribe_from(self.tr.EYETRACKER_GAZE_DATA, self.buffered_gaze_data_callback)
+
+        # Stop the writer after the last flush
+        self.stop_writing.set()
+        self.buffer.ready.set()
+        self.writer_thread.join()
+        if self.session_writer is not None:
+            self.session_writer.close()
+        if self.online_classifier is not None:
+            self.online_classifier.finish()
+        self.print_buffer_stats()
+        self.save_metrics()
+
+    def record_to_buffer(self, buffer, stop_event):
+        # Tracker process of collect_isolated.py: the callback only pushes into a SharedRingBuffer until stop_event is set
+        self.metrics = CollectorMetrics(print_status=False)
+        self.buffer = buffer
+        self.my_eyetracker.subscribe_to(self.tr.EYETRACKER_GAZE_DATA, self.buffered_gaze_data_callback, as_dictionary=True)
+        self.start_time = datetime.now()
+        stop_event.wait()
+        self.my_eyetracker.unsubscribe_from(self.tr.EYETRACKER_GAZE_DATA, self.buffered_gaze_data_callback)
+        self.print_buffer_stats()
+        self.save_metrics()
+
+    def write_from_buffer(self, buffer, stop_event):
+        # Writer process of collect_isolated.py: write what another process pushes into a SharedRingBuffer until stop_event is set
+        self.metrics = CollectorMetrics(print_status=False)
+        self.buffer = buffer
+        if self.file_format == 'gaze':
+            self.session_writer = GazeSessionWriter(self.file_path)
+        while not stop_event.wait(self.FLUSH_INTERVAL):
+            self.flush_buffer()
+        self.flush_buffer()
+        if self.session_writer is not None:
+            self.session_writer.close()
+        if self.online_classifier is not None:
+            self.online_classifier.finish()
+        # The sample metrics are saved by the tracker process, only the flush metrics are known here
+        os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+        self.metrics.dump_json(self.metrics_path.replace('.json', '_writer.json'))
+
+    def buffered_gaze_data_callback(self, gaze_data):
+        # Runs on the SDK callback thread, so keep it to a single copy into the ring buffer and a few counters
+        start = time.perf_counter_ns()
+        timestamp = local_time_ns()
+        self.buffer.push(gaze_record(timestamp, gaze_data))
+        self.metrics.record_sample(timestamp, time.perf_counter_ns() - start,
+                                   gaze_data["left_gaze_point_validity"], gaze_data["right_gaze_point_validity"])
+
+    def write_buffered_data(self):
+        while not self.stop_writing.is_set():
+            # Wake up when enough samples are waiting, but never wait longer than FLUSH_INTERVAL
+            self.buffer.ready.wait(self.FLUSH_INTERVAL)
+            self.flush_buffer()
+            self.metrics.maybe_print_status()
+        self.flush_buffer()
+
+    def flush_buffer(self):
+        start = time.perf_counter_ns()
+        batch = self.buffer.drain()
+        if len(batch) == 0:
+            return
+        self.write_batch(batch)
+        # The backlog is the number of samples that were waiting when the writer woke up
+        self.metrics.record_flush(time.perf_counter_ns() - start, len(batch))
+
+    def write_batch(self, batch):
+        # Classify on the writer thread, so the SDK callback thread is not slowed down
+        if self.online_classifier is not None:
+            self.online_classifier.push_batch(batch)
+        if self.session_writer is not None:
+            self.session_writer.append(batch)
+            self.session_writer.flush()
+            return
+        df = self.records_to_dataframe(batch)
+        if not self.header_written:
+            # A second recording in the same minute appends to the file of the first one, which has its header
+            self.header_written = os.path.exists(self.file_path) and os.path.getsize(self.file_path) > 0
+        with open(self.file_path, 'a') as file:
+            df.to_csv(file, header=not self.header_written, index=False, lineterminator='\n')
+        self.header_written = True
+
+    def records_to_dataframe(self, batch):
+        # Build the same columns as append_data_to_file, with the gaze points written as "(x, y)"
+        def to_point(xs, ys):
+            return [f"({x!r}, {y!r})" for x, y in zip(xs.tolist(), ys.tolist())]
+
+        return pd.DataFrame({
+            "timestamp": pd.to_datetime(batch['timestamp'] // 1000, unit='us'),
+            "left_gaze_point_on_display_area": to_point(batch['left_gaze_x'], batch['left_gaze_y']),
+            "left_gaze_point_validity": batch['left_gaze_point_validity'],
+            "right_gaze_point_on_display_area": to_point(batch['right_gaze_x'], batch['right_gaze_y']),
+            "right_gaze_point_validity": batch['right_gaze_point_validity'],
+            "left_pupil_diameter": batch['left_pupil_diameter'],
+            "left_pupil_validity": batch['left_pupil_validity'],
+            "right_pupil_diameter": batch['right_pupil_diameter'],
+            "right_pupil_validity": batch['right_pupil_validity']
+        })
+
+    def save_metrics(self):
+        print(self.metrics.status_line())
+        os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+        extra = {"buffer": self.buffer.stats()} if self.buffered else {}
+        self.metrics.dump_json(self.metrics_path, extra)
+
+    def print_buffer_stats(self):
+        stats = self.buffer.stats()
+        print(f"Ring buffer: {stats['pushed']} samples recorded, {stats['dropped']} dropped, "
+              f"high-water mark {stats['high_water_mark']}/{stats['capacity']}.")
 
     def gaze_data_callback(self, gaze_data):
+        start = time.perf_counter_ns()
         gaze_dict = {
             "timestamp": datetime.now(),
             "left_gaze_point_on_display_area": gaze_data["left_gaze_point_on_display_area"],
@@ -42,7 +209,15 @@ class EyeTrackerDataCollector:
             "right_pupil_validity": gaze_data["right_pupil_validity"]
         }
         self.append_data_to_file(gaze_dict)
-        self.print_duration()
+        timestamp = local_time_ns()
+        if self.online_classifier is not None:
+            self.online_classifier.push(timestamp,
+                                        gaze_dict["left_gaze_point_validity"], gaze_dict["left_gaze_point_on_display_area"],
+                                        gaze_dict["right_gaze_point_validity"], gaze_dict["right_gaze_point_on_display_area"])
+        self.metrics.record_sample(timestamp, time.perf_counter_ns() - start,
+                                   gaze_dict["left_gaze_point_validity"], gaze_dict["right_gaze_point_validity"])
+        # At most one status line per second instead of one print per sample
+        self.metrics.maybe_print_status()
 
     def append_data_to_file(self, data):
         df = pd.DataFrame([data])
@@ -53,13 +228,6 @@ class EyeTrackerDataCollector:
         with open(self.file_path, 'a') as file:
             df.to_csv(file, header=not file_exists, index=False, lineterminator='\n')
 
-    def print_duration(self):
-        if self.start_time:
-            duration = (datetime.now() - self.start_time).total_seconds()
-            print(f"Eye tracker has been working for {duration:.2f} seconds.")
-        else:
-            print("Eye tracker has not started.")
-
 
 # Main thread
 if __name__ == "__main__":
@@ -0,0 +1,374 @@
+"""
+Please import GazeSession and GazeSessionWriter classes from this script.
+This is the native binary session format for gaze data (Raw/EM, Synced and Processed).
+
+A session is a directory YYYYMMDDHHMM.gaze containing meta.json and one raw binary file per column.
+Every column has a fixed numpy dtype, so the readers open them zero-copy with numpy.memmap:
+    timestamp                  int64    local wall clock in nanoseconds (same clock as datetime.now())
+    {left,right}_gaze_x/_y     float32  gaze point on display area, NaN if missing
+    *_validity                 uint8    0 missing, 1 valid, 2 interpolated
+    *_pupil_diameter           float32
+Text columns (stimuli, IVT_state, ...) are stored as categorical codes, -1 means missing.
+
+The Processed files can also be written as one Parquet file YYYYMMDDHHMM.parquet with the same typed columns
+(write_parquet and ParquetSession, needs pyarrow), with one row group per stimulus epoch.
+
+Run this script to convert the existing csv archives (Raw/EM and Synced unless files or folders are given):
+    python Data_Collection/Code/OOP_gaze_format.py [csv files or folders]
+Processed is left out by default: a .gaze next to its .csv would be one more copy of the same session for the analyses,
+and preprocess.py writes the Processed sessions in the format of their Synced input (or Parquet with --format).
+"""
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+GAZE_SUFFIX = '.gaze'
+PARQUET_SUFFIX = '.parquet'
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+RAW_COLUMNS = {
+    'timestamp': 'int64',
+    'left_gaze_x': 'float32',
+    'left_gaze_y': 'float32',
+    'left_gaze_point_validity': 'uint8',
+    'right_gaze_x': 'float32',
+    'right_gaze_y': 'float32',
+    'right_gaze_point_validity': 'uint8',
+    'left_pupil_diameter': 'float32',
+    'left_pupil_validity': 'uint8',
+    'right_pupil_diameter': 'float32',
+    'right_pupil_validity': 'uint8',
+}
+
+# csv columns holding "(x, y)" points and the prefix of the two float columns they are split into
+POINT_COLUMNS = {
+    'left_gaze_point_on_display_area': 'left_gaze',
+    'right_gaze_point_on_display_area': 'right_gaze',
+    'IVT_fixation_centroid': 'IVT_fixation_centroid',
+    'IDT_fixation_centroid': 'IDT_fixation_centroid',
+    'IVVT_fixation_centroid': 'IVVT_fixation_centroid',
+    'IVDT_fixation_centroid': 'IVDT_fixation_centroid',
+    'fixation_center': 'fixation_center',
+}
+
+CSV_ARCHIVE_DIRS = [
+    './Data_Collection/Data/Raw/EM/',
+    './Data_Collection/Data/Synced/',
+]
+
+
+def is_session(path):
+    return str(path).endswith(GAZE_SUFFIX)
+
+
+def is_parquet(path):
+    return str(path).endswith(PARQUET_SUFFIX)
+
+
+def session_name(file_name):
+    # '202312042245.csv' and '202312042245.gaze' are the same session
+    return os.path.splitext(os.path.basename(os.path.normpath(file_name)))[0]
+
+
+def parse_point_column(values):
+    """Split a column of "(x, y)" strings into two float arrays, NaN where the point is missing."""
+    text = pd.Series(values, dtype=object).astype(str)
+    # Points written from numpy scalars look like "(np.float64(0.68), np.float64(0.25))"
+    parts = text.str.replace(r'np\.float\d+|[()]', '', regex=True).str.split(',', n=1, expand=True)
+    if parts.shape[1] < 2:
+        parts[1] = None
+    return _to_float(parts[0]), _to_float(parts[1])
+
+
+def _to_float(text):
+    # numpy's float conversion rounds exactly like float(), pd.to_numeric can be one ulp off
+    text = text.str.strip().replace({'None': 'nan', '': 'nan'}).fillna('nan')
+    try:
+        return text.to_numpy(dtype=object).astype('float64')
+    except ValueError:
+        return pd.to_numeric(text, errors='coerce').to_numpy(dtype='float64')
+
+
+def timestamps_to_ns(values):
+    # "2023-12-04 22:45:20.944291" -> int64 nanoseconds on the same local clock
+    return pd.to_datetime(pd.Series(values), format='ISO8601').to_numpy(dtype='datetime64[ns]').view('int64')
+
+
+class GazeSessionWriter:
+    """
+    Append-only writer, used by the collector to write batches while recording.
+    An existing session at path (a second recording in the same minute) is continued after its last complete row,
+    or replaced with resume=False.
+    """
+
+    def __init__(self, path, columns=RAW_COLUMNS, attrs=None, resume=True):
+        self.path = path
+        self.columns = dict(columns)
+        self.attrs = dict(attrs or {})
+        self.categories = {}
+        self.n_rows = 0
+        if resume and os.path.exists(os.path.join(self.path, META_FILE)):
+            self._resume()
+        os.makedirs(self.path, exist_ok=True)
+        self._write_meta()
+        mode = 'ab' if resume else 'wb'
+        self.files = {name: open(os.path.join(self.path, f'{name}.bin'), mode) for name in self.columns}
+
+    def _resume(self):
+        session = GazeSession(self.path)
+        if (set(session.columns) != set(self.columns)
+                or any(np.dtype(session.columns[name]) != np.dtype(dtype) for name, dtype in self.columns.items())):
+            raise ValueError(f"ERROR in GazeSessionWriter: '{self.path}' exists with other columns.")
+        self.attrs = {**session.attrs, **self.attrs}
+        self.categories = session.categories
+        # Cut the columns to the same length, a session stopped while recording can end with a partial batch
+        self.n_rows = len(session)
+        for name, dtype in self.columns.items():
+            os.truncate(session._column_path(name), self.n_rows * np.dtype(dtype).itemsize)
+
+    def _write_meta(self, categories=None):
+        meta = {
+            'version': FORMAT_VERSION,
+            'n_rows': self.n_rows,
+            'columns': self.columns,
+            'categories': categories or self.categories,
+            'attrs': self.attrs,
+        }
+        with open(os.path.join(self.path, META_FILE), 'w') as file:
+            json.dump(meta, file, indent=1)
+
+    def append(self, batch):
+        # batch is a numpy structured array (e.g. from GazeRingBuffer.drain) or a dict of arrays
+        for name, dtype in self.columns.items():
+            self.files[name].write(np.ascontiguousarray(batch[name], dtype=dtype).tobytes())
+        self.n_rows += len(batch[next(iter(self.columns))])
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close(self, categories=None):
+        for file in self.files.values():
+            file.close()
+        self._write_meta(categories)
+
+
+def write_session(path, columns, attrs=None):
+    """
+    Write a whole session at once. columns is a dict of name -> array;
+    object arrays (text such as stimulus names or eye states) are stored as categorical codes.
+    """
+    dtypes, categories, encoded = {}, {}, {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype == object or values.dtype.kind in 'US':
+            codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+            labels = [str(label) for label in uniques]
+            values = codes.astype('int8' if len(labels) < 128 else 'int16')
+            categories[name] = labels
+        elif values.dtype == np.float64:
+            values = values.astype('float32')
+        dtypes[name] = values.dtype.str
+        encoded[name] = values
+
+    writer = GazeSessionWriter(path, dtypes, attrs, resume=False)
+    writer.append(encoded)
+    writer.close(categories)
+
+
+class GazeSession:
+    """Read-only view of a session, every column is a numpy.memmap over its file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(self.path, META_FILE)) as file:
+            self.meta = json.load(file)
+        self.columns = self.meta['columns']
+        self.categories = self.meta.get('categories', {})
+        self.attrs = self.meta.get('attrs', {})
+        # Use the shortest column so that a session cut off while recording can still be read
+        self.n_rows = min(
+            os.path.getsize(self._column_path(name)) // np.dtype(dtype).itemsize
+            for name, dtype in self.columns.items()
+        )
+        self._cache = {}
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            dtype = np.dtype(self.columns[name])
+            if self.n_rows == 0:
+                self._cache[name] = np.empty(0, dtype=dtype)
+            else:
+                self._cache[name] = np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(self.n_rows,))
+        return self._cache[name]
+
+    def code(self, name, label):
+        # Categorical code of a label, -1 if the label never occurs in this session
+        labels = self.categories.get(name, [])
+        return labels.index(label) if label in labels else -1
+
+    def labels(self, name):
+        # Decode a categorical column to an object array, None where missing
+        lookup = np.array(self.categories[name] + [None], dtype=object)
+        return lookup[self[name]]
+
+    def points(self, prefix):
+        return self[f'{prefix}_x'], self[f'{prefix}_y']
+
+    def to_dataframe(self):
+        data = {}
+        for name in self.columns:
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(np.asarray(self[name]), self.categories[name])
+            else:
+                data[name] = self[name]
+        return pd.DataFrame(data, copy=False)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is not installed. Install it to write and read .parquet sessions.")
+    return pyarrow, pyarrow.parquet
+
+
+def write_parquet(path, columns, attrs=None, group_by='stimuli'):
+    """
+    Write a whole session as one Parquet file, with the same column types as write_session:
+    text columns are dictionary encoded (pandas reads them as Categorical), attrs are kept in the file metadata,
+    and every run of rows with the same group_by value is one row group, so one stimulus is read on its own.
+    """
+    pa, pq = _import_pyarrow()
+    arrays = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype == object or values.dtype.kind in 'US':
+            arrays[name] = pa.array(pd.Categorical(values))
+        elif values.dtype == np.float64:
+            arrays[name] = pa.array(values.astype('float32'))
+        else:
+            arrays[name] = pa.array(values)
+    table = pa.table(arrays)
+
+    # One row group per run of equal group_by values, missing values included
+    n_rows = len(table)
+    values = pd.Series(np.asarray(columns[group_by], dtype=object) if group_by in columns else [None] * n_rows, dtype=object)
+    codes, _ = pd.factorize(values)
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1]))) if n_rows else np.array([0])
+    ends = np.append(starts[1:], n_rows)
+    groups = [None if pd.isna(value) else str(value) for value in values.iloc[starts]] if n_rows else [None]
+    meta = {'version': FORMAT_VERSION, 'attrs': dict(attrs or {}), 'group_by': group_by, 'groups': groups}
+    table = table.replace_schema_metadata({META_FILE: json.dumps(meta)})
+    with pq.ParquetWriter(path, table.schema) as writer:
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            writer.write_table(table.slice(start, end - start), row_group_size=max(end - start, 1))
+
+
+class ParquetSession:
+    """Reader of a session written by write_parquet, that reads only the columns and row groups it is asked for."""
+
+    def __init__(self, path):
+        _, pq = _import_pyarrow()
+        self.path = path
+        self.file = pq.ParquetFile(path)
+        self.meta = json.loads(self.file.schema_arrow.metadata[META_FILE.encode()])
+        self.attrs = self.meta['attrs']
+        # group_by value (e.g. the stimulus) of every row group
+        self.groups = self.meta['groups']
+        self.columns = self.file.schema_arrow.names
+        self.n_rows = self.file.metadata.num_rows
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def read(self, columns=None, group=None):
+        """DataFrame of these columns (all by default), only the rows of the row groups of this group_by value if given."""
+        if group is None:
+            table = self.file.read(columns=columns)
+        else:
+            table = self.file.read_row_groups([i for i, value in enumerate(self.groups) if value == group], columns=columns)
+        return table.to_pandas()
+
+    def read_rows(self, start, end, columns=None):
+        # Rows [start, end), only the row groups that hold them are read
+        sizes = [self.file.metadata.row_group(i).num_rows for i in range(self.file.num_row_groups)]
+        bounds = np.cumsum([0] + sizes)
+        groups = [i for i in range(len(sizes)) if bounds[i] < end and bounds[i + 1] > start]
+        if not groups:
+            return self.file.schema_arrow.empty_table().select(columns or self.columns).to_pandas()
+        table = self.file.read_row_groups(groups, columns=columns)
+        return table.slice(start - bounds[groups[0]], end - start).to_pandas()
+
+    def points(self, prefix, group=None):
+        df = self.read([f'{prefix}_x', f'{prefix}_y'], group)
+        return df[f'{prefix}_x'].to_numpy(), df[f'{prefix}_y'].to_numpy()
+
+
+def csv_to_columns(df):
+    # Split a legacy csv DataFrame into typed columns for write_session, plus per-session constants
+    columns, attrs = {}, {}
+    for name in df.columns:
+        values = df[name]
+        if name == 'timestamp':
+            columns[name] = timestamps_to_ns(values)
+        elif name in POINT_COLUMNS:
+            x, y = parse_point_column(values)
+            columns[f'{POINT_COLUMNS[name]}_x'], columns[f'{POINT_COLUMNS[name]}_y'] = x, y
+        elif name.endswith('_validity'):
+            columns[name] = values.fillna(0).to_numpy(dtype='uint8')
+        elif name == 'eye_to_use':
+            attrs[name] = str(values.iloc[0]) if len(values) else None
+        elif pd.api.types.is_numeric_dtype(values):
+            columns[name] = values.to_numpy()
+        else:
+            columns[name] = values.to_numpy(dtype=object)
+    return columns, attrs
+
+
+def convert_csv_to_session(csv_path, session_path=None):
+    if session_path is None:
+        session_path = os.path.splitext(csv_path)[0] + GAZE_SUFFIX
+    df = pd.read_csv(csv_path)
+    columns, attrs = csv_to_columns(df)
+    write_session(session_path, columns, attrs)
+    return session_path
+
+
+def convert_archive(paths=CSV_ARCHIVE_DIRS):
+    csv_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            csv_files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith('.csv'))
+        else:
+            csv_files.append(path)
+
+    for csv_path in csv_files:
+        session_path = os.path.splitext(csv_path)[0] + GAZE_SUFFIX
+        if os.path.exists(session_path):
+            continue
+        print(f"Now converting file: {csv_path}")
+        convert_csv_to_session(csv_path, session_path)
+        csv_size = os.path.getsize(csv_path)
+        gaze_size = sum(os.path.getsize(os.path.join(session_path, f)) for f in os.listdir(session_path))
+        print(f"{csv_size / 1e6:.2f} MB -> {gaze_size / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    convert_archive(sys.argv[1:] or CSV_ARCHIVE_DIRS)
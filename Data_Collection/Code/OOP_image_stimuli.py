@@ -17,14 +17,19 @@ import pandas as pd
 import numpy as np
 from screeninfo import get_monitors
 import time
+from OOP_stimulus_cache import StimulusPrefetcher, load_frame
+from OOP_trial_scheduler import TrialScheduler
 
 class StimuliExperiment:
     FIXATION_CROSS_DURATION = 1
     STIMULUS_DURATION = 3
     GREY_DURATION = 1
     TARGET_SIZE = (1920, 1080)
+    PREFETCH_DEPTH = 3  # number of stimuli decoded ahead of the one on screen
+    INSTRUCTION_WAIT_MS = 50  # cv2.waitKey timeout on the instruction screen
+    TIMING_DIR = './Data_Collection/Data/Raw/Metrics/'
 
-    def __init__(self):
+    def __init__(self, event_sink=None):
         self.screen_width = get_monitors()[0].width
         self.screen_height = get_monitors()[0].height
         self.full_screen = (self.screen_width, self.screen_height)
@@ -35,8 +40,12 @@ class StimuliExperiment:
         self.key_presses = []
 
         self.data_lock = threading.Lock()
+        # Optional event_sink(timestamp, image_name=None, phase=None, key=None) receiving every logged event,
+        # collect_isolated.py uses it to pass the events to the writer process, which then saves the stimuli file
+        self.event_sink = event_sink
         now = datetime.now()
         self.file_path = now.strftime('./Data_Collection/Data/Raw/Stimuli/%Y%m%d%H%M.csv')
+        self.timing_path = os.path.join(self.TIMING_DIR, now.strftime('%Y%m%d%H%M_timing.json'))
         
     def show_start_instruction(self):
         # Create an image with the text "Press Enter to start the experiment"
@@ -48,94 +57,105 @@ class StimuliExperiment:
 
         # Initialize countdown time (3 seconds)
         countdown_time = 3
-        start_time = time.time()
+        start_time = time.perf_counter()
+        shown_time = None
 
         while True:
             # Calculate remaining time
-            elapsed_time = time.time() - start_time
+            elapsed_time = time.perf_counter() - start_time
             remaining_time = max(0, countdown_time - int(elapsed_time))
 
-            # Update and show the instruction image with remaining time
-            instruction_img_updated = instruction_img.copy()
-            cv2.putText(instruction_img_updated, f"Press Enter to start the experiment in {remaining_time}s", 
-                        (100, self.screen_height // 2), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 
-                        1, 
-                        (255, 255, 255), 
-                        2, 
-                        cv2.LINE_AA)
-            cv2.imshow('Stimulus', instruction_img_updated)
-
-            # Check for Enter key press after countdown
-            if cv2.waitKey(1) & 0xFF == 13 and elapsed_time > countdown_time:  # 13 is the Enter Key
+            # Render the instruction image only when the remaining time changes
+            if remaining_time != shown_time:
+                instruction_img_updated = instruction_img.copy()
+                cv2.putText(instruction_img_updated, f"Press Enter to start the experiment in {remaining_time}s", 
+                            (100, self.screen_height // 2), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 
+                            1, 
+                            (255, 255, 255), 
+                            2, 
+                            cv2.LINE_AA)
+                cv2.imshow('Stimulus', instruction_img_updated)
+                shown_time = remaining_time
+
+            # Check for Enter key press after countdown, waitKey blocks instead of spinning
+            if cv2.waitKey(self.INSTRUCTION_WAIT_MS) & 0xFF == 13 and elapsed_time > countdown_time:  # 13 is the Enter Key
                 break
 
         cv2.destroyAllWindows()
 
-    def wait_or_break(self, duration):
-        start_time = datetime.now()
-        while (datetime.now() - start_time).total_seconds() < duration:
-            if not self.is_recording:
-                return False
-            cv2.waitKey(1)
-        return True
-
     def display_stimuli_and_record(self):
-        fixation_img = cv2.imread('Data_Collection/Img/Instructions/fixation.png')
-        fixation_img = cv2.resize(fixation_img, self.full_screen)
-        grey_img = cv2.imread('Data_Collection/Img/Instructions/grey.png')
-        grey_img = cv2.resize(grey_img, self.full_screen)
+        # Every frame is decoded and resized to the screen before it is needed, imshow only blits it
+        fixation_img = load_frame('Data_Collection/Img/Instructions/fixation.png', self.full_screen)
+        grey_img = load_frame('Data_Collection/Img/Instructions/grey.png', self.full_screen)
         image_folder = 'Data_Collection/Img/Animals/'
         image_files = os.listdir(image_folder)
         random.shuffle(image_files)
+        prefetcher = StimulusPrefetcher([os.path.join(image_folder, f) for f in image_files],
+                                        self.full_screen, depth=self.PREFETCH_DEPTH)
 
         screen = np.zeros((self.screen_height, self.screen_width, 3), dtype=np.uint8)
 
         cv2.namedWindow('Stimulus', cv2.WND_PROP_FULLSCREEN)
         cv2.setWindowProperty('Stimulus', cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
 
+        # All phases are planned on one timeline, the logged timestamps are the measured onsets
+        scheduler = TrialScheduler('Stimulus', should_continue=lambda: self.is_recording)
 
-        for selected_image in image_files:
+        for image_path, img in prefetcher:
             with self.data_lock:
                 if not self.is_recording:
                     break
-
-            image_path = os.path.join(image_folder, selected_image)
-            img = cv2.imread(image_path)
+            # The timeline starts once the first frame is decoded, so the decoding does not eat into the first cross
+            if scheduler.deadline is None:
+                scheduler.start()
 
             if img is None:
                 print(f"Failed to load image from {image_path}")
                 continue
+            selected_image = os.path.basename(image_path)
+
+            # Log the onset of every phase, integrate.py labels the EM samples with these intervals
+            phases = [('Cross', fixation_img, self.FIXATION_CROSS_DURATION),
+                      ('Image', img, self.STIMULUS_DURATION),
+                      ('Grey', grey_img, self.GREY_DURATION)]
+            for phase, frame, duration in phases:
+                onset = scheduler.present(frame, duration, phase)
+                if onset is None:
+                    break
+                self.log_phase(selected_image, phase, onset)
+            # Close the trial at its planned end, or now if the experiment was aborted
+            self.log_phase(selected_image, 'End', scheduler.finish())
 
-            img = cv2.resize(img, self.full_screen)
-
-            show_time = datetime.now()
-            self.image_display_info.append({"timestamp": show_time, "image_name": selected_image})
-
-            cv2.imshow('Stimulus', fixation_img)
-            self.wait_or_break(self.FIXATION_CROSS_DURATION)
-
-            cv2.imshow('Stimulus', img)
-            self.wait_or_break(self.STIMULUS_DURATION)
-
-            cv2.imshow('Stimulus', grey_img)
-            self.wait_or_break(self.GREY_DURATION)
-
+        prefetcher.close()
         cv2.destroyAllWindows()
 
+        scheduler.print_stats()
+        os.makedirs(self.TIMING_DIR, exist_ok=True)
+        scheduler.save_stats(self.timing_path)
+
         combined_data = pd.DataFrame(self.image_display_info)
         combined_data['key'] = None
         combined_data.set_index('timestamp', inplace=True)
         return combined_data
 
+    def log_phase(self, image_name, phase, timestamp=None):
+        timestamp = datetime.now() if timestamp is None else timestamp
+        self.image_display_info.append({"timestamp": timestamp, "image_name": image_name, "phase": phase})
+        if self.event_sink is not None:
+            self.event_sink(timestamp, image_name=image_name, phase=phase)
+
     def on_press(self, key):
         try:
             key_char = key.char
         except AttributeError:
             key_char = str(key)
 
+        timestamp = datetime.now()
         with self.data_lock:
-            self.key_presses.append({"timestamp": datetime.now(), "key": key_char})
+            self.key_presses.append({"timestamp": timestamp, "key": key_char})
+        if self.event_sink is not None:
+            self.event_sink(timestamp, key=key_char)
 
         if key == keyboard.Key.esc:
             self.is_recording = False
@@ -153,8 +173,9 @@ class StimuliExperiment:
         key_df = pd.DataFrame(self.key_presses)
         key_df.set_index('timestamp', inplace=True)
 
-        result_df = pd.concat([combined_data, key_df], axis=0).sort_index().reset_index()
-        result_df.to_csv(self.file_path, index=False)
+        if self.event_sink is None:
+            result_df = pd.concat([combined_data, key_df], axis=0).sort_index().reset_index()
+            result_df.to_csv(self.file_path, index=False)
 
         thread_keyboard.join()
 
@@ -0,0 +1,145 @@
+"""
+Please import CollectorMetrics class from this script.
+This class collects timing and quality metrics of an eye tracking session with low overhead:
+callback wall time and inter-sample interval histograms, validity rate per eye and writer backlog.
+Recording a sample is a few integer updates; the status line is printed at most once per STATUS_INTERVAL
+and never from the SDK callback thread in buffered mode.
+"""
+import json
+import time
+from bisect import bisect_right
+
+# Histogram bin edges in microseconds, roughly logarithmic
+HISTOGRAM_EDGES_US = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 1000000]
+
+
+class Histogram:
+    def __init__(self, edges=HISTOGRAM_EDGES_US):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, value):
+        self.counts[bisect_right(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        # Upper edge of the bin containing the q-th percentile
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.edges[idx] if idx < len(self.edges) else self.maximum
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_us": self.mean(),
+            "max_us": self.maximum,
+            "p50_us": self.percentile(50),
+            "p99_us": self.percentile(99),
+            "edges_us": self.edges,
+            "counts": self.counts,
+        }
+
+
+class CollectorMetrics:
+    STATUS_INTERVAL = 1.0  # seconds between two status lines
+
+    def __init__(self, print_status=True):
+        self.print_status = print_status
+        self.callback_time = Histogram()
+        self.interval = Histogram()
+        self.previous_timestamp = None
+        # Welford's running variance of the inter-sample interval, for the jitter
+        self.interval_mean = 0.0
+        self.interval_m2 = 0.0
+        self.samples = 0
+        self.valid = {'left': 0, 'right': 0}
+        self.flushes = 0
+        self.flush_time = Histogram()
+        self.backlog = 0
+        self.max_backlog = 0
+        self.start_time = time.perf_counter()
+        self.next_status = self.start_time + self.STATUS_INTERVAL
+        self.last_status_time = self.start_time
+        self.last_status_samples = 0
+
+    def record_sample(self, timestamp_ns, callback_ns, left_validity, right_validity):
+        self.samples += 1
+        self.valid['left'] += left_validity
+        self.valid['right'] += right_validity
+        self.callback_time.add(callback_ns / 1000)
+        if self.previous_timestamp is not None:
+            interval = (timestamp_ns - self.previous_timestamp) / 1000
+            self.interval.add(interval)
+            delta = interval - self.interval_mean
+            self.interval_mean += delta / self.interval.count
+            self.interval_m2 += delta * (interval - self.interval_mean)
+        self.previous_timestamp = timestamp_ns
+
+    def record_flush(self, duration_ns, backlog):
+        self.flushes += 1
+        self.flush_time.add(duration_ns / 1000)
+        self.backlog = backlog
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+
+    def jitter_us(self):
+        # Standard deviation of the inter-sample interval
+        return (self.interval_m2 / (self.interval.count - 1)) ** 0.5 if self.interval.count > 1 else 0.0
+
+    def validity_rate(self, eye):
+        return self.valid[eye] / self.samples if self.samples else 0.0
+
+    def status_line(self, now=None):
+        now = time.perf_counter() if now is None else now
+        elapsed = now - self.start_time
+        rate = (self.samples - self.last_status_samples) / max(now - self.last_status_time, 1e-9)
+        return (f"Eye tracker has been working for {elapsed:.1f} s | {rate:.0f} Hz | "
+                f"callback p50 {self.callback_time.percentile(50):.0f} us, max {self.callback_time.maximum:.0f} us | "
+                f"interval {self.interval_mean / 1000:.2f} ms, jitter {self.jitter_us() / 1000:.2f} ms | "
+                f"valid L {self.validity_rate('left'):.0%} R {self.validity_rate('right'):.0%} | "
+                f"backlog {self.backlog}")
+
+    def maybe_print_status(self):
+        # Cheap enough to call on every sample: one clock read unless a status line is due
+        now = time.perf_counter()
+        if not self.print_status or now < self.next_status:
+            return
+        print(self.status_line(now))
+        self.last_status_samples = self.samples
+        self.last_status_time = now
+        self.next_status = now + self.STATUS_INTERVAL
+
+    def snapshot(self):
+        return {
+            "duration_s": time.perf_counter() - self.start_time,
+            "samples": self.samples,
+            "callback_time": self.callback_time.to_dict(),
+            "interval": self.interval.to_dict(),
+            "interval_jitter_us": self.jitter_us(),
+            "validity_rate": {eye: self.validity_rate(eye) for eye in self.valid},
+            "flushes": self.flushes,
+            "flush_time": self.flush_time.to_dict(),
+            "backlog": self.backlog,
+            "max_backlog": self.max_backlog,
+        }
+
+    def dump_json(self, path, extra=None):
+        data = self.snapshot()
+        data.update(extra or {})
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=1)
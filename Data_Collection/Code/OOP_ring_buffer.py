@@ -0,0 +1,100 @@
+"""
+Please import GazeRingBuffer class from this script.
+This class is a preallocated in-memory ring buffer for gaze samples.
+The tracker callback only pushes one record into it, and a writer thread drains it in large batches.
+"""
+import threading
+import time
+from datetime import datetime
+import numpy as np
+
+# One record per gaze sample, the same information as one row of Raw/EM csv file
+GAZE_DTYPE = np.dtype([
+    ('timestamp', 'int64'),  # local wall clock in nanoseconds, see local_time_ns()
+    ('left_gaze_x', 'float64'),
+    ('left_gaze_y', 'float64'),
+    ('left_gaze_point_validity', 'uint8'),
+    ('right_gaze_x', 'float64'),
+    ('right_gaze_y', 'float64'),
+    ('right_gaze_point_validity', 'uint8'),
+    ('left_pupil_diameter', 'float64'),
+    ('left_pupil_validity', 'uint8'),
+    ('right_pupil_diameter', 'float64'),
+    ('right_pupil_validity', 'uint8'),
+])
+
+# Offset between the UTC epoch and the local wall clock, computed once
+_UTC_OFFSET_NS = int(datetime.now().astimezone().utcoffset().total_seconds() * 10**9)
+
+
+def local_time_ns():
+    # Same clock as datetime.now(), but as int64 nanoseconds so it can be stored in a numpy array
+    return time.time_ns() + _UTC_OFFSET_NS
+
+
+def gaze_record(timestamp, gaze_data):
+    # Convert a gaze dictionary from tobii_research into a tuple matching GAZE_DTYPE
+    left_x, left_y = gaze_data["left_gaze_point_on_display_area"]
+    right_x, right_y = gaze_data["right_gaze_point_on_display_area"]
+    return (timestamp,
+            left_x, left_y, gaze_data["left_gaze_point_validity"],
+            right_x, right_y, gaze_data["right_gaze_point_validity"],
+            gaze_data["left_pupil_diameter"], gaze_data["left_pupil_validity"],
+            gaze_data["right_pupil_diameter"], gaze_data["right_pupil_validity"])
+
+
+class GazeRingBuffer:
+    def __init__(self, capacity=65536, flush_size=4096):
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.records = np.zeros(capacity, dtype=GAZE_DTYPE)
+        self.head = 0  # next slot to write
+        self.count = 0  # number of records waiting to be drained
+        self.lock = threading.Lock()
+        # Set when flush_size records are waiting, so the writer does not have to wait for the full interval
+        self.ready = threading.Event()
+
+        # Statistics used to size the buffer for each tracker
+        self.high_water_mark = 0
+        self.dropped = 0
+        self.pushed = 0
+
+    def push(self, record):
+        with self.lock:
+            if self.count == self.capacity:
+                # Buffer is full: the writer is too slow, drop the newest sample and count it
+                self.dropped += 1
+                return False
+            self.records[self.head] = record
+            self.head = (self.head + 1) % self.capacity
+            self.count += 1
+            self.pushed += 1
+            if self.count > self.high_water_mark:
+                self.high_water_mark = self.count
+            if self.count >= self.flush_size:
+                self.ready.set()
+        return True
+
+    def drain(self):
+        # Copy out every waiting record in arrival order and empty the buffer
+        with self.lock:
+            tail = (self.head - self.count) % self.capacity
+            if tail + self.count <= self.capacity:
+                batch = self.records[tail:tail + self.count].copy()
+            else:
+                batch = np.concatenate((self.records[tail:], self.records[:self.head]))
+            self.count = 0
+            self.ready.clear()
+        return batch
+
+    def backlog(self):
+        return self.count
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "pushed": self.pushed,
+            "dropped": self.dropped,
+            "high_water_mark": self.high_water_mark,
+            "backlog": self.count,
+        }
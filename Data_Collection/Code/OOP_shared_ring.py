@@ -0,0 +1,96 @@
+"""
+Please import SharedRingBuffer class from this script.
+This class is a single-producer single-consumer ring buffer of numpy records in shared memory (multiprocessing.shared_memory),
+so gaze samples and presentation events can be passed between processes without a pipe or pickling.
+The producer only writes the head counter and the consumer only writes the tail counter. Both are monotonic int64
+counts, the slot of a record is count % capacity. The counters are read and written under a multiprocessing.Lock,
+which orders the memory accesses on every CPU (ARM and POWER reorder plain stores, x86-64 does not):
+a record is stored before its head is published, and copied out before its tail is published,
+so the consumer never reads a record that is still being written and the producer never overwrites one being read.
+The records themselves are copied outside the lock, which is only held for a few counter updates.
+It has the same push/drain/backlog/stats interface as GazeRingBuffer.
+"""
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+
+# Header slots (int64). The head slots are written by the producer, the tail slot by the consumer,
+# and they are on separate cache lines so the two processes do not invalidate each other's line on every sample
+HEAD, DROPPED, HIGH_WATER_MARK = 0, 1, 2
+TAIL = 8
+HEADER_SLOTS = 16
+
+
+class SharedRingBuffer:
+    def __init__(self, dtype, capacity=65536, name=None, lock=None):
+        # name=None creates a new shared memory block and its lock, otherwise the block and lock of another process are attached
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.owner = name is None
+        self.lock = multiprocessing.Lock() if lock is None else lock
+        header_size = HEADER_SLOTS * 8
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_size + capacity * self.dtype.itemsize)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray((HEADER_SLOTS,), dtype='int64', buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,), dtype=self.dtype, buffer=self.shm.buf, offset=header_size)
+        if self.owner:
+            self.header[:] = 0
+
+    def __reduce__(self):
+        # A buffer passed to a multiprocessing.Process is attached to the same block in the child
+        return (SharedRingBuffer, (self.dtype, self.capacity, self.shm.name, self.lock))
+
+    def push(self, record):
+        # Producer side only
+        with self.lock:
+            head = int(self.header[HEAD])
+            count = head - int(self.header[TAIL])
+            if count >= self.capacity:
+                # Buffer is full: the consumer is too slow, drop the newest record and count it
+                self.header[DROPPED] += 1
+                return False
+        self.records[head % self.capacity] = record
+        with self.lock:
+            self.header[HEAD] = head + 1  # publish the record
+            if count + 1 > self.header[HIGH_WATER_MARK]:
+                self.header[HIGH_WATER_MARK] = count + 1
+        return True
+
+    def drain(self):
+        # Consumer side only: copy out every waiting record in arrival order, then free the slots
+        with self.lock:
+            tail = int(self.header[TAIL])
+            count = int(self.header[HEAD]) - tail
+        start = tail % self.capacity
+        if start + count <= self.capacity:
+            batch = self.records[start:start + count].copy()
+        else:
+            batch = np.concatenate((self.records[start:], self.records[:start + count - self.capacity]))
+        with self.lock:
+            self.header[TAIL] = tail + count  # free the slots
+        return batch
+
+    def backlog(self):
+        with self.lock:
+            return int(self.header[HEAD] - self.header[TAIL])
+
+    def stats(self):
+        with self.lock:
+            pushed, dropped, high_water_mark = (int(v) for v in self.header[[HEAD, DROPPED, HIGH_WATER_MARK]])
+        return {
+            "capacity": self.capacity,
+            "pushed": pushed,
+            "dropped": dropped,
+            "high_water_mark": high_water_mark,
+            "backlog": self.backlog(),
+        }
+
+    def close(self):
+        # The numpy views must be released before the shared memory can be closed
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
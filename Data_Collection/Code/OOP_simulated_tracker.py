@@ -0,0 +1,206 @@
+"""
+Drop-in replacement for the parts of tobii_research used by EyeTrackerDataCollector.
+It is used to run the collection path without a device (CI, analysis machines, load tests):
+    import OOP_simulated_tracker as tr
+    eyetracker = tr.find_all_eyetrackers()[0]
+    eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, callback, as_dictionary=True)
+
+Or set EYETRACKER_BACKEND=simulated before running collect.py.
+
+The simulated eye tracker emits gaze dictionaries at the configured rate (60-1200 Hz) from its own thread,
+with fixations, saccades between them, blinks (both eyes missing) and short dropouts of one eye.
+Like the real device it only buffers a short time: samples the callback cannot take within MAX_LATENCY are lost.
+"""
+import threading
+import time
+import math
+import random
+
+EYETRACKER_GAZE_DATA = "eyetracker_gaze_data"
+DEFAULT_FREQUENCY = 60  # Hz
+
+NAN_POINT = (math.nan, math.nan)
+
+
+class GazeGenerator:
+    """Synthetic gaze with fixation/saccade structure, blinks and dropouts, sampled at a fixed time step."""
+    FIXATION_DURATION = (0.15, 0.5)  # seconds
+    FIXATION_JITTER = 0.002  # standard deviation on display area
+    SACCADE_DURATION = (0.02, 0.06)  # seconds
+    BLINK_RATE = 0.3  # blinks per second
+    BLINK_DURATION = (0.1, 0.25)  # seconds
+    DROPOUT_RATE = 2.0  # single-eye dropouts per second
+    DROPOUT_DURATION = (0.005, 0.03)  # seconds
+    PUPIL_DIAMETER = 3.5  # mm
+
+    def __init__(self, frequency, seed=None):
+        self.dt = 1 / frequency
+        self.random = random.Random(seed)
+        self.t = 0.0
+        self.position = (0.5, 0.5)
+        self.target = self.position
+        self.saccade_start = self.position
+        self.state = 'Fixation'
+        self.state_end = self._duration(self.FIXATION_DURATION)
+        self.saccade_start_time = 0.0
+        self.blink_end = -1.0
+        self.dropout_end = {'left': -1.0, 'right': -1.0}
+
+    def _duration(self, bounds):
+        return self.t + self.random.uniform(*bounds)
+
+    def _new_target(self):
+        return (self.random.uniform(0.05, 0.95), self.random.uniform(0.05, 0.95))
+
+    def _update_position(self):
+        if self.t >= self.state_end:
+            if self.state == 'Fixation':
+                self.state = 'Saccade'
+                self.saccade_start = self.position
+                self.saccade_start_time = self.t
+                self.target = self._new_target()
+                self.state_end = self._duration(self.SACCADE_DURATION)
+            else:
+                self.state = 'Fixation'
+                self.position = self.target
+                self.state_end = self._duration(self.FIXATION_DURATION)
+
+        if self.state == 'Saccade':
+            ratio = min(1.0, (self.t - self.saccade_start_time) / (self.state_end - self.saccade_start_time))
+            (x1, y1), (x2, y2) = self.saccade_start, self.target
+            self.position = (x1 + ratio * (x2 - x1), y1 + ratio * (y2 - y1))
+            return self.position
+        jitter = self.FIXATION_JITTER
+        return (self.position[0] + self.random.gauss(0, jitter), self.position[1] + self.random.gauss(0, jitter))
+
+    def _eye(self, eye, point, blinking):
+        if blinking or self.t < self.dropout_end[eye]:
+            return NAN_POINT, 0, math.nan, 0
+        offset = 0.01 if eye == 'left' else -0.01
+        pupil = self.PUPIL_DIAMETER + self.random.gauss(0, 0.05)
+        return (point[0] + offset, point[1]), 1, pupil, 1
+
+    def next_sample(self, system_time_stamp):
+        point = self._update_position()
+
+        # Start blinks and single-eye dropouts as Poisson processes
+        if self.t >= self.blink_end and self.random.random() < self.BLINK_RATE * self.dt:
+            self.blink_end = self._duration(self.BLINK_DURATION)
+        for eye in ('left', 'right'):
+            if self.t >= self.dropout_end[eye] and self.random.random() < self.DROPOUT_RATE / 2 * self.dt:
+                self.dropout_end[eye] = self._duration(self.DROPOUT_DURATION)
+        blinking = self.t < self.blink_end
+
+        left_point, left_validity, left_pupil, left_pupil_validity = self._eye('left', point, blinking)
+        right_point, right_validity, right_pupil, right_pupil_validity = self._eye('right', point, blinking)
+        self.t += self.dt
+        return {
+            "device_time_stamp": int(self.t * 1e6),
+            "system_time_stamp": system_time_stamp,
+            "left_gaze_point_on_display_area": left_point,
+            "left_gaze_point_validity": left_validity,
+            "right_gaze_point_on_display_area": right_point,
+            "right_gaze_point_validity": right_validity,
+            "left_pupil_diameter": left_pupil,
+            "left_pupil_validity": left_pupil_validity,
+            "right_pupil_diameter": right_pupil,
+            "right_pupil_validity": right_pupil_validity,
+        }
+
+
+class SimulatedEyeTracker:
+    MAX_LATENCY = 0.5  # seconds, samples older than this when the callback is free again are dropped
+
+    def __init__(self, frequency=DEFAULT_FREQUENCY, seed=None, record_timing=False):
+        self.address = "simulated://0"
+        self.model = "Simulated Eye Tracker"
+        self.device_name = "Simulated"
+        self.serial_number = "SIM-0000"
+        self.frequency = frequency
+        self.seed = seed
+        # record_timing=True keeps the duration of every callback call and how late it was delivered
+        self.record_timing = record_timing
+        self.callbacks = []
+        self.thread = None
+        self.running = threading.Event()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.emitted = 0
+        self.lost = 0
+        # Samples that were due but not delivered yet when the last callback unsubscribed
+        self.pending = 0
+        self.callback_durations = []
+        self.delivery_delays = []
+
+    def get_all_gaze_output_frequencies(self):
+        return (60.0, 120.0, 250.0, 300.0, 600.0, 1200.0)
+
+    def get_gaze_output_frequency(self):
+        return float(self.frequency)
+
+    def set_gaze_output_frequency(self, frequency):
+        self.frequency = frequency
+
+    def subscribe_to(self, stream, callback, as_dictionary=False):
+        # Only gaze data as dictionaries is simulated, as_dictionary is accepted for compatibility
+        if stream != EYETRACKER_GAZE_DATA:
+            raise ValueError(f"Stream {stream} is not simulated.")
+        self.callbacks.append(callback)
+        if self.thread is None:
+            self.running.set()
+            self.thread = threading.Thread(target=self._emit_loop, daemon=True)
+            self.thread.start()
+
+    def unsubscribe_from(self, stream, callback=None):
+        if callback is None:
+            self.callbacks.clear()
+        elif callback in self.callbacks:
+            self.callbacks.remove(callback)
+        if not self.callbacks and self.thread is not None:
+            self.running.clear()
+            self.thread.join()
+            self.thread = None
+
+    def _emit_loop(self):
+        generator = GazeGenerator(self.frequency, self.seed)
+        period = 1 / self.frequency
+        start = time.perf_counter()
+        sample_idx = 0
+        while self.running.is_set():
+            due = start + sample_idx * period
+            now = time.perf_counter()
+            if now < due:
+                time.sleep(due - now)
+                now = time.perf_counter()
+
+            # The device keeps only MAX_LATENCY of samples while the callback is busy
+            late = now - due
+            if late > self.MAX_LATENCY:
+                skipped = int((late - self.MAX_LATENCY) / period) + 1
+                for _ in range(skipped):
+                    generator.next_sample(0)
+                self.lost += skipped
+                sample_idx += skipped
+                continue
+
+            gaze_data = generator.next_sample(int(time.time() * 1e6))
+            callbacks = list(self.callbacks)
+            for callback in callbacks:
+                callback(gaze_data)
+            if callbacks:
+                self.emitted += 1
+            sample_idx += 1
+            if self.record_timing:
+                self.callback_durations.append(time.perf_counter() - now)
+                self.delivery_delays.append(late)
+        self.pending = max(int((time.perf_counter() - start) / period) + 1 - sample_idx, 0)
+
+
+# Module-level defaults used by find_all_eyetrackers(), e.g. set them before creating the collector
+FREQUENCY = DEFAULT_FREQUENCY
+SEED = None
+
+
+def find_all_eyetrackers():
+    return [SimulatedEyeTracker(FREQUENCY, SEED)]
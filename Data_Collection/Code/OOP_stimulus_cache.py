@@ -0,0 +1,94 @@
+"""
+Please import StimulusPrefetcher class and load_frame function from this script.
+Stimulus images are decoded and resized to the screen resolution once, and kept in a persistent on-disk cache
+(one .npy file per source image and display size), so a presentation loop only has to show a prepared buffer.
+StimulusPrefetcher prepares the next few frames on a worker thread while the current trial is on screen.
+"""
+import os
+import queue
+import hashlib
+import threading
+import numpy as np
+import cv2
+
+CACHE_DIR = './Data_Collection/Img/.cache/'
+
+
+def cache_path(image_path, size, cache_dir=CACHE_DIR):
+    # The key changes whenever the source file or the display size changes
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{size[0]}x{size[1]}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(cache_dir, f"{size[0]}x{size[1]}", f"{stem}_{digest}.npy")
+
+
+def load_frame(image_path, size, cache_dir=CACHE_DIR, mmap=False):
+    """
+    Return the image at image_path resized to size (width, height) as a BGR uint8 array, or None if it cannot be read.
+    mmap=True returns a read-only memory-mapped array, which several processes can share.
+    """
+    if not os.path.isfile(image_path):
+        return None
+    frame_path = cache_path(image_path, size, cache_dir)
+    if os.path.exists(frame_path):
+        try:
+            return np.load(frame_path, mmap_mode='r' if mmap else None)
+        except (ValueError, OSError):
+            pass  # damaged cache file, decode the source again
+
+    img = cv2.imread(image_path)
+    if img is None:
+        return None
+    if (img.shape[1], img.shape[0]) != tuple(size):
+        img = cv2.resize(img, tuple(size))
+
+    # Write to a temporary file first so that readers never see a half-written frame
+    os.makedirs(os.path.dirname(frame_path), exist_ok=True)
+    tmp_path = f"{frame_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        np.save(file, img)
+    os.replace(tmp_path, frame_path)
+    return np.load(frame_path, mmap_mode='r') if mmap else img
+
+
+class StimulusPrefetcher:
+    def __init__(self, image_paths, size, depth=3, cache_dir=CACHE_DIR):
+        self.image_paths = list(image_paths)
+        self.size = size
+        self.cache_dir = cache_dir
+        # At most depth frames are prepared ahead of the one on screen
+        self.frames = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self._prepare_frames, daemon=True)
+        self.worker.start()
+
+    def _prepare_frames(self):
+        for image_path in self.image_paths:
+            try:
+                frame = load_frame(image_path, self.size, self.cache_dir)
+            except Exception as error:
+                # Handed to __iter__, which raises it in the presentation loop instead of waiting forever
+                frame = error
+            while not self.stopped.is_set():
+                try:
+                    self.frames.put((image_path, frame), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if self.stopped.is_set() or isinstance(frame, Exception):
+                return
+
+    def __iter__(self):
+        # Yield (image_path, frame) in the original order, frame is None if the image could not be read;
+        # an error of the worker is raised here, at the frame it failed on
+        for _ in self.image_paths:
+            image_path, frame = self.frames.get()
+            if isinstance(frame, Exception):
+                self.close()
+                raise frame
+            yield image_path, frame
+
+    def close(self):
+        self.stopped.set()
+        self.worker.join()
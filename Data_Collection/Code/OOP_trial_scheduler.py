@@ -0,0 +1,99 @@
+"""
+Please import TrialScheduler class from this script.
+This class presents the phases of the trials (cross, image, grey) against one perf_counter timeline.
+Instead of spinning on datetime.now(), it waits in cv2.waitKey chunks until just before a deadline and sleeps the rest,
+so the presentation leaves the CPU to the eye tracker callback.
+The actual onset of every phase is measured after the frame is shown and converted to the local wall clock,
+and the overshoot (onset - deadline) is kept for the timing statistics of the session.
+The deadlines stay on the planned timeline, so a phase shown late is shortened by its overshoot;
+a warning is printed when that is more than SHORTENED_WARNING, and the stats count those phases.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+import cv2
+
+
+class TrialScheduler:
+    POLL_INTERVAL = 0.05  # seconds, longest cv2.waitKey while waiting, also how often an abort is noticed
+    SLEEP_MARGIN = 0.003  # seconds before a deadline, slept with time.sleep instead of cv2.waitKey
+    SHORTENED_WARNING = 1 / 60  # seconds, one frame of a 60 Hz display
+
+    def __init__(self, window_name='Stimulus', should_continue=None):
+        self.window_name = window_name
+        # should_continue() returning False aborts the waiting, e.g. Esc was pressed
+        self.should_continue = should_continue or (lambda: True)
+        self.anchor_perf = None
+        self.anchor_datetime = None
+        self.deadline = None
+        self.overshoots = {}
+
+    def start(self):
+        # perf_counter is monotonic but has no date, the anchor maps it to the wall clock of the other logs
+        self.anchor_datetime = datetime.now()
+        self.anchor_perf = time.perf_counter()
+        self.deadline = self.anchor_perf
+
+    def to_datetime(self, perf_time):
+        return self.anchor_datetime + timedelta(seconds=perf_time - self.anchor_perf)
+
+    def wait_until(self, deadline):
+        # Return False as soon as the experiment is aborted
+        while True:
+            if not self.should_continue():
+                return False
+            remaining = deadline - time.perf_counter()
+            if remaining <= self.SLEEP_MARGIN:
+                break
+            cv2.waitKey(max(1, int(min(remaining - self.SLEEP_MARGIN, self.POLL_INTERVAL) * 1000)))
+        remaining = deadline - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def present(self, frame, duration, phase):
+        """
+        Show frame at the next deadline and plan the following one duration seconds later.
+        Return the measured onset as a datetime, or None if the experiment was aborted.
+        """
+        if not self.wait_until(self.deadline):
+            return None
+        cv2.imshow(self.window_name, frame)
+        cv2.waitKey(1)  # the window is only repainted while events are processed
+        onset = time.perf_counter()
+        overshoot = onset - self.deadline
+        self.overshoots.setdefault(phase, []).append(overshoot)
+        if overshoot > self.SHORTENED_WARNING:
+            print(f"Warning: {phase} shown {overshoot * 1000:.1f} ms late, it is {min(overshoot, duration) * 1000:.1f} ms "
+                  f"shorter than planned to keep the timeline")
+        # Deadlines follow the planned timeline, so a late onset does not delay the rest of the session
+        self.deadline += duration
+        return self.to_datetime(onset)
+
+    def finish(self):
+        # Wait for the end of the last planned phase
+        if not self.wait_until(self.deadline):
+            return None
+        return self.to_datetime(time.perf_counter())
+
+    def stats(self):
+        def summarize(values):
+            return {
+                "count": len(values),
+                "mean_overshoot_ms": sum(values) / len(values) * 1000 if values else 0.0,
+                "max_overshoot_ms": max(values) * 1000 if values else 0.0,
+                "shortened": sum(value > self.SHORTENED_WARNING for value in values),
+            }
+        all_values = [value for values in self.overshoots.values() for value in values]
+        result = summarize(all_values)
+        result["phases"] = {phase: summarize(values) for phase, values in self.overshoots.items()}
+        return result
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Phase onsets: {stats['count']}, overshoot mean {stats['mean_overshoot_ms']:.2f} ms, "
+              f"max {stats['max_overshoot_ms']:.2f} ms, {stats['shortened']} phases shortened")
+
+    def save_stats(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.stats(), file, indent=1)
@@ -2,13 +2,23 @@
 Step 1.
 This code is used to run the eye tracker and stimuli experiment simultaneously and collect data from both.
 """
+import os
+import sys
 import threading
+from collections import Counter
 from OOP_em import EyeTrackerDataCollector
 from OOP_image_stimuli import StimuliExperiment
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'EM_Analysis', 'Code'))
+from OOP_online_ivt import OnlineEyeMovement
+
 def run_eye_tracker():
-    collector = EyeTrackerDataCollector()
+    # Label the eye states during the session, preprocess.py still produces the Processed files afterwards
+    classifier = OnlineEyeMovement(keep_samples=False)
+    collector = EyeTrackerDataCollector(online_classifier=classifier)
     collector.start_collecting()
+    event_counts = Counter(event['type'] for event in classifier.events)
+    print(f"Online eye states ({classifier.eye_to_use} eye): {dict(event_counts)}")
 
 def run_stimuli_experiment():
     experiment = StimuliExperiment()
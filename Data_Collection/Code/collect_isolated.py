@@ -0,0 +1,125 @@
+"""
+Step 1 (process-isolated).
+This code runs the same session as collect.py, but the eye tracker subscription, the stimulus presenter and the disk writer
+run in three processes, so OpenCV rendering, the keyboard listener and pandas never hold the GIL of the gaze callback.
+    tracker process    only pushes every gaze sample into a shared memory ring buffer
+    presenter process  shows the stimuli and pushes the phase onsets and key presses into a second ring buffer
+    writer process     drains both buffers, writes the Raw/EM and Raw/Stimuli files and runs the online classifier
+All timestamps are local wall clock nanoseconds (OOP_ring_buffer.local_time_ns), the same clock in every process.
+
+Usage:
+    python Data_Collection/Code/collect_isolated.py [--format csv|gaze]
+"""
+import os
+import sys
+import argparse
+import threading
+import multiprocessing
+from collections import Counter
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from OOP_em import EyeTrackerDataCollector
+from OOP_ring_buffer import GAZE_DTYPE
+from OOP_shared_ring import SharedRingBuffer
+from OOP_gaze_format import GAZE_SUFFIX
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'EM_Analysis', 'Code'))
+from OOP_online_ivt import OnlineEyeMovement
+
+# One record per logged phase onset or key press
+EVENT_DTYPE = np.dtype([
+    ('timestamp', 'int64'),  # local wall clock in nanoseconds
+    ('image_name', 'U64'),
+    ('phase', 'U8'),
+    ('key', 'U32'),
+])
+EVENT_CAPACITY = 8192
+EVENT_DRAIN_INTERVAL = 0.5  # seconds
+
+
+def run_tracker(gaze_ring, stop_event, session):
+    collector = EyeTrackerDataCollector()
+    collector.metrics_path = os.path.join(collector.METRICS_DIR, f'{session}.json')
+    collector.record_to_buffer(gaze_ring, stop_event)
+
+
+def run_presenter(event_ring, session):
+    # Only the presenter process opens windows and listens to the keyboard
+    from OOP_image_stimuli import StimuliExperiment
+    lock = threading.Lock()
+
+    def push_event(timestamp, image_name=None, phase=None, key=None):
+        # Phases and key presses are logged from two threads of this process, the ring buffer has a single producer
+        with lock:
+            event_ring.push((np.datetime64(timestamp, 'ns').astype('int64'), image_name or '', phase or '', key or ''))
+
+    experiment = StimuliExperiment(event_sink=push_event)
+    experiment.timing_path = os.path.join(experiment.TIMING_DIR, f'{session}_timing.json')
+    experiment.run()
+
+
+def run_writer(gaze_ring, event_ring, stop_event, session, file_format):
+    classifier = OnlineEyeMovement(keep_samples=False)
+    collector = EyeTrackerDataCollector(file_format=file_format, online_classifier=classifier, connect=False)
+    suffix = GAZE_SUFFIX if file_format == 'gaze' else '.csv'
+    collector.file_path = os.path.join(os.path.dirname(collector.file_path), session + suffix)
+    collector.metrics_path = os.path.join(collector.METRICS_DIR, f'{session}.json')
+
+    # Presentation events are few, they are collected on a second thread and saved at the end
+    events = []
+    def drain_events():
+        while not stop_event.wait(EVENT_DRAIN_INTERVAL):
+            events.append(event_ring.drain())
+        events.append(event_ring.drain())
+    event_thread = threading.Thread(target=drain_events)
+    event_thread.start()
+    collector.write_from_buffer(gaze_ring, stop_event)
+    event_thread.join()
+
+    save_events(np.concatenate(events), f'./Data_Collection/Data/Raw/Stimuli/{session}.csv')
+    print(f"Event buffer: {event_ring.stats()['dropped']} events dropped.")
+    event_counts = Counter(event['type'] for event in classifier.events)
+    print(f"Online eye states ({classifier.eye_to_use} eye): {dict(event_counts)}")
+
+
+def save_events(events, file_path):
+    # Same columns as StimuliExperiment.run: timestamp, image_name, phase, key
+    df = pd.DataFrame({
+        "timestamp": pd.to_datetime(events['timestamp'] // 1000, unit='us'),
+        "image_name": events['image_name'],
+        "phase": events['phase'],
+        "key": events['key'],
+    }).replace('', None)
+    df.sort_values('timestamp', kind='stable').to_csv(file_path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a session with the tracker, presenter and writer in separate processes.")
+    parser.add_argument('--format', default='csv', choices=['csv', 'gaze'])
+    args = parser.parse_args()
+
+    # Every process uses this session name, so the files match even if the processes start in different minutes
+    session = datetime.now().strftime('%Y%m%d%H%M')
+    gaze_ring = SharedRingBuffer(GAZE_DTYPE, EyeTrackerDataCollector.BUFFER_CAPACITY)
+    event_ring = SharedRingBuffer(EVENT_DTYPE, EVENT_CAPACITY)
+    stop_tracker = multiprocessing.Event()
+    stop_writer = multiprocessing.Event()
+
+    tracker = multiprocessing.Process(target=run_tracker, args=(gaze_ring, stop_tracker, session))
+    writer = multiprocessing.Process(target=run_writer, args=(gaze_ring, event_ring, stop_writer, session, args.format))
+    presenter = multiprocessing.Process(target=run_presenter, args=(event_ring, session))
+    try:
+        tracker.start()
+        writer.start()
+        presenter.start()
+        # The session ends with the last stimulus or when Esc is pressed
+        presenter.join()
+    finally:
+        stop_tracker.set()
+        tracker.join()
+        # Stop the writer only after the tracker has unsubscribed, so the last samples are written
+        stop_writer.set()
+        writer.join()
+        gaze_ring.close()
+        event_ring.close()
@@ -1,89 +1,107 @@
 """
-Issue 1209:
-Since the EM data collected on 1204 is not adequate, I will neglect the 1st visual stimuli.
-Therefore, please remove the regarding unnecessary code afterwards.
-
 Step 2.
 Please run this code after step 1.
 This code will integrate the eye tracking data and the image stimuli data based on the timestamp.
+Every EM sample is labelled with the phase that was on screen (Cross, image name or Grey)
+by joining its timestamp against the logged onset of every phase.
+Trials whose fixation cross started before the eye tracker (e.g. the 1st stimulus on 1204) are left unlabelled.
 The result will be saved in the Data_Collection/Data/Synced folder.
 """
 import os
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from OOP_gaze_format import GazeSession, write_session, is_session, session_name, timestamps_to_ns, GAZE_SUFFIX
 
 class DataIntegration:
     EM_DATA_DIR = './Data_Collection/Data/Raw/EM/'
     STIMULI_DATA_DIR = './Data_Collection/Data/Raw/Stimuli/'
     TARGET_DIR = './Data_Collection/Data/Synced/'
-    FIXATION_CROSS_FRAME = 60
-    IMAGE_FRAME = 180 
-    GREY_FRAME = 60
+    # Phase durations in seconds, same as StimuliExperiment.
+    # Only used for older stimuli logs that recorded the image row alone, right before the fixation cross.
+    FIXATION_CROSS_DURATION = 1
+    STIMULUS_DURATION = 3
+    GREY_DURATION = 1
+    PHASES = ['Cross', 'Image', 'Grey', 'End']
 
     def __init__(self, file_name):
         # Create full file paths
         self.file_name = file_name
         self.em_data_path = os.path.join(DataIntegration.EM_DATA_DIR, file_name)
-        self.stimuli_data_path = os.path.join(DataIntegration.STIMULI_DATA_DIR, file_name)
-        self.em_data = pd.read_csv(self.em_data_path)
+        self.stimuli_data_path = os.path.join(DataIntegration.STIMULI_DATA_DIR, session_name(file_name) + '.csv')
+        # EM data is either a csv file or a binary session opened with numpy.memmap
+        if is_session(file_name):
+            self.em_session = GazeSession(self.em_data_path)
+            self.em_data = self.em_session.to_dataframe()
+            self.em_timestamp = np.asarray(self.em_session['timestamp'])
+        else:
+            self.em_session = None
+            self.em_data = pd.read_csv(self.em_data_path)
+            # Convert the timestamps to int64 nanoseconds once
+            self.em_timestamp = timestamps_to_ns(self.em_data['timestamp'])
         self.stimuli_data = pd.read_csv(self.stimuli_data_path)
-        self.stimuli = []
+        self.stimuli = None
+        self.target_dir = DataIntegration.TARGET_DIR
+
+    def extract_phase_onsets(self):
+        # Extract the onset of every phase (Cross, Image, Grey, End) from stimuli data
+        if 'phase' in self.stimuli_data.columns:
+            rows = self.stimuli_data[self.stimuli_data['phase'].notna()]
+            onsets = timestamps_to_ns(rows['timestamp'])
+            phases = rows['phase'].to_numpy(dtype=object)
+            images = rows['image_name'].to_numpy(dtype=object)
+        else:
+            # Older logs: one row per image, the phases follow at the nominal durations
+            rows = self.stimuli_data[self.stimuli_data['image_name'].astype(str).str.endswith('.jpg')]
+            durations = [DataIntegration.FIXATION_CROSS_DURATION, DataIntegration.STIMULUS_DURATION, DataIntegration.GREY_DURATION]
+            offsets = (np.cumsum([0] + durations) * 10**9).astype('int64')
+            onsets = (timestamps_to_ns(rows['timestamp'])[:, None] + offsets[None, :]).ravel()
+            phases = np.tile(np.array(DataIntegration.PHASES, dtype=object), len(rows))
+            images = np.repeat(rows['image_name'].to_numpy(dtype=object), len(DataIntegration.PHASES))
+
+        order = np.argsort(onsets, kind='stable')
+        self.onsets, self.phases, self.images = onsets[order], phases[order], images[order]
+
+    def label_em_samples(self):
+        # Every phase lasts until the next logged onset; 'End' rows only close the grey phase of a trial
+        onsets, phases = self.onsets, self.phases
+        ends = np.append(onsets[1:], np.iinfo(np.int64).max)
+        labels = np.where(phases == 'Image', self.images, phases)
+
+        # Trials that started before the eye tracker have no fixation cross data, so skip them
+        trial_id = np.cumsum(phases == 'Cross')
+        early_trials = trial_id[(phases == 'Cross') & (onsets < self.em_timestamp[0])] if len(self.em_timestamp) else []
+        keep = (phases != 'End') & ~np.isin(trial_id, early_trials)
+        starts, ends, labels = onsets[keep], ends[keep], labels[keep]
+
+        # Interval join: find the last phase that started at or before each sample
+        idx = np.searchsorted(starts, self.em_timestamp, side='right') - 1
+        inside = idx >= 0
+        inside[inside] = self.em_timestamp[inside] < ends[idx[inside]]
+        self.stimuli = np.full(len(self.em_timestamp), None, dtype=object)
+        self.stimuli[inside] = labels[idx[inside]]
 
-    def extract_image_timestamp(self):
-        # Extract image timestamp from stimuli data
-        self.img_timestamp = []
-        for idx, row in self.stimuli_data.iterrows():
-            if str(row['image_name']).endswith('.jpg'):
-                self.img_timestamp.append((row['image_name'], row['timestamp']))
-    
-    # Find the timestamp that is closest to the stimulus onset, use liear search O(N+M)
-    def find_closest_em_timestamp(self):
-        # find the closest timestamp in em_data corresponding to the stimulus onset
-        idx = 0
-        
-        # ************* Remove this code afterwards: Start *************
-        self.img_timestamp.pop(0)
-        for image_name, timestamp in self.img_timestamp:
-            print(image_name, timestamp)
-        # ************* Remove this code afterwards: End *************
-        
-        for image_name, timestamp in self.img_timestamp:
-            target_datetime = datetime.fromisoformat(timestamp).timestamp()
-            min_diff = 10**16
-            while idx < self.em_data.shape[0] and min_diff > abs(datetime.fromisoformat(self.em_data['timestamp'][idx]).timestamp() - target_datetime):
-                min_diff = abs(datetime.fromisoformat(self.em_data['timestamp'][idx]).timestamp() - target_datetime)
-                idx += 1
-                self.stimuli.append(None)
-            
-            # Roll back one step to get the closest timestamp
-            idx -= 1
-            if self.stimuli: self.stimuli.pop()
-            # If the closest timestamp is found, append it to the stimuli list, 300 frames in total
-            self.stimuli.extend(['Cross']*DataIntegration.FIXATION_CROSS_FRAME)
-            self.stimuli.extend([image_name] * DataIntegration.IMAGE_FRAME)
-            self.stimuli.extend(['Grey']*DataIntegration.GREY_FRAME)
-            idx += DataIntegration.FIXATION_CROSS_FRAME + DataIntegration.IMAGE_FRAME + DataIntegration.GREY_FRAME
-            
-        # If the stimuli is less than the em_data, append None to the stimuli list
-        if len(self.stimuli) < self.em_data.shape[0]:
-            self.stimuli.extend([None]*(self.em_data.shape[0] - len(self.stimuli)))
-        self.em_data['stimuli'] = self.stimuli
-    
     def save_data(self):
-        self.em_data.to_csv(os.path.join(DataIntegration.TARGET_DIR, self.file_name) , index=False)
-    
+        if self.em_session is not None:
+            columns = {name: self.em_session[name] for name in self.em_session.columns}
+            columns['stimuli'] = self.stimuli
+            write_session(os.path.join(self.target_dir, self.file_name), columns, self.em_session.attrs)
+            return
+        self.em_data['stimuli'] = self.stimuli
+        self.em_data.to_csv(os.path.join(self.target_dir, self.file_name) , index=False)
+
     def run(self):
-        self.extract_image_timestamp()
-        self.find_closest_em_timestamp()
+        self.extract_phase_onsets()
+        self.label_em_samples()
         self.save_data()
-        
-        
+
+
 def get_matched_files():
-    files_em = os.listdir(DataIntegration.EM_DATA_DIR)
-    files_stimuli = os.listdir(DataIntegration.STIMULI_DATA_DIR)
-    files_target = os.listdir(DataIntegration.TARGET_DIR)
+    # Sessions are matched by name, so that both .csv and .gaze EM recordings are picked up
+    files_em = {session_name(f): f for f in sorted(os.listdir(DataIntegration.EM_DATA_DIR)) if f.endswith(('.csv', GAZE_SUFFIX))}
+    files_stimuli = {session_name(f) for f in os.listdir(DataIntegration.STIMULI_DATA_DIR) if f.endswith('.csv')}
+    files_target = {session_name(f) for f in os.listdir(DataIntegration.TARGET_DIR)}
     # return the files that are in both em_data and stimuli_data but not in target, which means they are not processed yet
-    return list(set(files_em) & set(files_stimuli) - set(files_target))
+    return [files_em[name] for name in (files_em.keys() & files_stimuli) - files_target]
 
 
 if __name__ == "__main__":
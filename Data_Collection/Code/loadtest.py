@@ -0,0 +1,104 @@
+"""
+Load test for EyeTrackerDataCollector using the simulated eye tracker (no device needed).
+For every sampling rate and recording mode it reports the callback latency, the sustained throughput
+and how many samples were lost, either by the device (callback too slow, including the samples it still held
+when the collector stopped) or by a full ring buffer.
+
+Usage:
+    python Data_Collection/Code/loadtest.py --rates 60 300 600 1200 --duration 10 --modes buffered unbuffered
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+import OOP_simulated_tracker as sim
+from OOP_em import EyeTrackerDataCollector
+from OOP_gaze_format import GazeSession
+
+
+def count_rows(file_path):
+    if os.path.isdir(file_path):
+        return len(GazeSession(file_path))
+    if not os.path.exists(file_path):
+        return 0
+    with open(file_path) as file:
+        return max(sum(1 for _ in file) - 1, 0)  # minus the header
+
+
+def run_load_test(rate, duration, mode, file_format, output_dir):
+    sim.FREQUENCY = rate
+    buffered = mode == 'buffered'
+    collector = EyeTrackerDataCollector(buffered=buffered, file_format=file_format, backend=sim)
+    collector.my_eyetracker.record_timing = True
+    collector.recording_duration = duration
+    suffix = '.gaze' if file_format == 'gaze' else '.csv'
+    collector.file_path = os.path.join(output_dir, f'{rate}Hz_{mode}{suffix}')
+    collector.metrics_path = os.path.join(output_dir, f'{rate}Hz_{mode}_metrics.json')
+
+    # Status lines are not part of the measurement
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        collector.start_collecting()
+
+    tracker = collector.my_eyetracker
+    callback_ms = np.array(tracker.callback_durations) * 1000
+    written = count_rows(collector.file_path)
+    dropped_by_buffer = collector.buffer.stats()['dropped'] if buffered else 0
+    return {
+        "rate": rate,
+        "mode": mode,
+        "format": file_format,
+        "expected": int(rate * duration),
+        "emitted": tracker.emitted,
+        "written": written,
+        "throughput": written / duration,
+        "lost_by_device": tracker.lost,
+        "pending_at_stop": tracker.pending,
+        "dropped_by_buffer": dropped_by_buffer,
+        # Every sample that was due and not written: lost by the device, still queued at the end, or dropped by the collector
+        "lost_total": tracker.lost + tracker.pending + tracker.emitted - written,
+        "callback_p50_ms": float(np.percentile(callback_ms, 50)) if len(callback_ms) else None,
+        "callback_p99_ms": float(np.percentile(callback_ms, 99)) if len(callback_ms) else None,
+        "callback_max_ms": float(callback_ms.max()) if len(callback_ms) else None,
+        "max_delivery_delay_ms": float(max(tracker.delivery_delays, default=0) * 1000),
+        "interval_jitter_ms": collector.metrics.jitter_us() / 1000,
+        "buffer_high_water_mark": collector.buffer.stats()['high_water_mark'] if buffered else None,
+    }
+
+
+def print_report(results):
+    header = "{:>6} {:>10} {:>8} {:>8} {:>10} {:>6} {:>8} {:>8} {:>8}".format(
+        "rate", "mode", "written", "lost", "samples/s", "hwm", "p50 ms", "p99 ms", "max ms")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print("{:>6} {:>10} {:>8} {:>8} {:>10.1f} {:>6} {:>8.3f} {:>8.3f} {:>8.3f}".format(
+            r["rate"], r["mode"], r["written"], r["lost_total"], r["throughput"],
+            r["buffer_high_water_mark"] if r["buffer_high_water_mark"] is not None else "-",
+            r["callback_p50_ms"] or 0, r["callback_p99_ms"] or 0, r["callback_max_ms"] or 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test EyeTrackerDataCollector with a simulated eye tracker.")
+    parser.add_argument('--rates', type=int, nargs='+', default=[60, 120, 300, 600, 1200])
+    parser.add_argument('--duration', type=float, default=10, help="seconds per run")
+    parser.add_argument('--modes', nargs='+', default=['buffered', 'unbuffered'], choices=['buffered', 'unbuffered'])
+    parser.add_argument('--format', default='csv', choices=['csv', 'gaze'])
+    parser.add_argument('--json', help="also write the results to this json file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for rate in args.rates:
+            for mode in args.modes:
+                if mode == 'unbuffered' and args.format == 'gaze':
+                    continue
+                print(f"Now testing {rate} Hz, {mode} mode", file=sys.stderr)
+                results.append(run_load_test(rate, args.duration, mode, args.format, output_dir))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=1)
@@ -1,13 +1,20 @@
 import os
+import sys
 import csv
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib import image
-import pandas as pd
-import cv2
+from contextlib import closing
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import GazeSession, ParquetSession, is_session, is_parquet
+from OOP_gaze_reader import to_pixels
+from OOP_catalog import Catalog
+from OOP_density import gaussian_matrix, point_grid, density
+from OOP_heatmap_cache import HeatmapCache
+from OOP_render import display_frame, blend_heatmap, save_image
 
 class GazeHeatmap:
-    def __init__(self, input_path, image_name=None, display_width=1920, display_height=1080, alpha=0.6, n_gaussian_matrix=500, standard_deviation=33):
+    def __init__(self, input_path, image_name=None, display_width=1920, display_height=1080, alpha=0.6, n_gaussian_matrix=500, standard_deviation=33, grid_step=1, cache=True, renderer='opencv'):
         self.input_path = input_path
         self.image_name = image_name
         self.image_path = os.path.join('./Data_Collection/Img/Animals/', self.image_name)
@@ -17,44 +24,16 @@ class GazeHeatmap:
         self.output_name = os.path.join('./EM_Analysis/Result/heatmap/', self.image_name)
         self.n_gaussian_matrix = n_gaussian_matrix
         self.standard_deviation = standard_deviation
-        self.resize_image(self.image_path, self.display_width, self.display_height)
+        # Pixels per cell of the density grid, more than 1 for a quicker approximate map (see OOP_density.py)
+        self.grid_step = grid_step
+        # The density of the session is kept in a HeatmapCache (the default one for True), not for False
+        self.cache = HeatmapCache() if cache is True else (cache or None)
+        # 'opencv' composites the image with NumPy/OpenCV, 'matplotlib' draws a figure (for publication figures)
+        self.renderer = renderer
 
-    def resize_image(self, image_path, width, height):
-        image = cv2.imread(image_path)
-        if image is None:
-            print("Failed to load image. Please check the image path.")
-            return
-        # Check if image is already 1920x1080
-        if image.shape[1] == self.display_width and image.shape[0] == self.display_height:
-            pass
-        else:
-            # Resize the image
-            resized_image = cv2.resize(image, (self.display_width, self.display_height))
-            cv2.imwrite(image_path, resized_image)
-            print("Image resized to 1920x1080 and saved with correct color.")
-        
     def draw_display(self):
-        screen = np.zeros((self.display_height, self.display_width, 3), dtype='float32')
-        if self.image_path is not None:
-            if not os.path.isfile(self.image_path):
-                raise Exception(f"ERROR in draw_display: imagefile not found at '{self.image_path}'")
-            # Load image with matplotlib's image module
-            img = image.imread(self.image_path)
-            # Ensure the image is in the correct format
-            if img.dtype == np.float32:
-                # Normalize if the image is in float format (common for .png)
-                img = np.clip(img, 0, 1)
-            elif img.dtype == np.uint8:
-                # Convert to float and normalize if the image is in byte format (common for .jpg)
-                img = img.astype('float32') / 255
-
-            # width and height of the image
-            w, h = img.shape[1], img.shape[0]
-            # x and y position of the image on the display
-            x = self.display_width // 2 - w // 2
-            y = self.display_height // 2 - h // 2
-            # draw the image on the screen
-            screen[y:y + h, x:x + w, :] += img[:,:,:3]  # Use only RGB channels
+        # RGB floats of the stimulus on the display, from the decoded frame of the stimulus cache
+        screen = display_frame(self.image_path, self.display_width, self.display_height)[:, :, ::-1].astype('float32') / 255
         dpi = 100.0
         figsize = (self.display_width / dpi, self.display_height / dpi)
         fig = plt.figure(figsize=figsize, dpi=dpi, frameon=False)
@@ -67,57 +46,81 @@ class GazeHeatmap:
 
 
     def gaussian(self, x, sx, y=None, sy=None):
-        if y is None:
-            y = x
-        if sy is None:
-            sy = sx
-        xo = x // 2
-        yo = y // 2
-        M = np.zeros([y, x], dtype=float)
-        for i in range(x):
-            for j in range(y):
-                M[j, i] = np.exp(-1.0 * (((float(i) - xo) ** 2 / (2 * sx ** 2)) + ((float(j) - yo) ** 2 / (2 * sy ** 2))))
-        return M
+        return gaussian_matrix(x, sx, y, sy)
 
-    def draw_heatmap(self):
-        fig, ax = self.draw_display()
+    def density(self, grid=None):
+        # Sum of a Gaussian on every gaze point, from the weight of the points on every pixel (self.gaze_data by default)
+        if grid is None:
+            x, y, weights = np.array(self.gaze_data, dtype='float64').reshape(-1, 3).T
+            grid = point_grid(x, y, self.display_width, self.display_height, weights)
         gwh = self.n_gaussian_matrix
         gsdwh = gwh // 6 if (self.standard_deviation is None) else self.standard_deviation
-        gaus = self.gaussian(gwh, gsdwh)
-        strt = gwh // 2
-        heatmapsize = self.display_height + 2 * strt, self.display_width + 2 * strt
-        heatmap = np.zeros(heatmapsize, dtype=float)
-        for i in range(len(self.gaze_data)):
-            x = strt + self.gaze_data[i][0] - gwh // 2
-            y = strt + self.gaze_data[i][1] - gwh // 2
-            if 0 > x or x > self.display_width or 0 > y or y > self.display_height:
-                continue
-            heatmap[y:y + gwh, x:x + gwh] += gaus * self.gaze_data[i][2]
-        heatmap = heatmap[strt:self.display_height + strt, strt:self.display_width + strt]
+        return density(grid, gwh, gsdwh, self.grid_step)
+
+    def density_params(self):
+        # Everything the density depends on besides the session and the stimulus, the key of the cache
+        return {'n_gaussian_matrix': self.n_gaussian_matrix, 'standard_deviation': self.standard_deviation,
+                'grid_step': self.grid_step, 'display': [self.display_width, self.display_height]}
+
+    def draw_heatmap(self, grid=None, heatmap=None):
+        # From the density heatmap if given, else from the grid or self.gaze_data
+        # Return the BGR image, or the closed matplotlib figure with the matplotlib renderer
+        heatmap = self.density(grid) if heatmap is None else heatmap.copy()
         lowbound = np.mean(heatmap[heatmap > 0])
-        heatmap[heatmap < lowbound] = np.NaN
+        heatmap[heatmap < lowbound] = np.nan
+        if self.renderer == 'opencv':
+            result = blend_heatmap(display_frame(self.image_path, self.display_width, self.display_height), heatmap, self.alpha)
+            if self.output_name is not None:
+                save_image(self.output_name, result)
+            return result
+        fig, ax = self.draw_display()
         ax.imshow(heatmap, cmap='jet', alpha=self.alpha)
         ax.invert_yaxis()
         if self.output_name is not None:
             fig.savefig(self.output_name)
+        # Figures are kept by pyplot until they are closed
+        plt.close(fig)
         return fig
 
-    def to_pixel(self, coord):
-        coord = eval(coord)
-        if len(coord)!= 2 or coord[0] == None or coord[1] == None: return (None, None)
-        return (coord[0] * self.display_width, coord[1] * self.display_height)
+    def load_session_gaze(self):
+        # Binary sessions are memory-mapped, only the rows of this stimulus are read
+        session = GazeSession(self.input_path)
+        condition = session['stimuli'] == session.code('stimuli', self.image_name)
+        x, y = session.points("{}_gaze".format(session.attrs['eye_to_use']))
+        return x[condition], y[condition]
+
+    def load_parquet_gaze(self):
+        # Only the row group of this stimulus and the two coordinate columns are read
+        session = ParquetSession(self.input_path)
+        return session.points("{}_gaze".format(session.attrs['eye_to_use']), group=self.image_name)
+
+    def load_csv_gaze(self):
+        # Only the rows of this stimulus are read, from the row ranges in the catalog
+        with closing(Catalog()) as catalog:
+            catalog.update_file(self.input_path)
+            df = catalog.read_rows(self.image_name, ['gaze_x', 'gaze_y'], files=[self.input_path])
+        return df['gaze_x'].to_numpy(), df['gaze_y'].to_numpy()
 
     def run(self):
-        df = pd.read_csv(self.input_path)
-        # Create a condition to filter the DataFrame
-        condition = df['stimuli'] == self.image_name
-        gaze_cor_name = "{}_gaze_point_on_display_area".format(df.loc[condition, 'eye_to_use'].iloc[0])
-        df.loc[condition, 'pixel_gaze_point'] = df.loc[condition, gaze_cor_name].apply(self.to_pixel)
-        gaze_data_list = df.loc[condition, 'pixel_gaze_point'].tolist()
-        # Filter out (None, None) entries
-        filtered_gaze_data_list = [cor for cor in gaze_data_list if cor != (None, None)]
-        self.gaze_data = [(int(cor[0]), int(cor[1]), 1) for cor in filtered_gaze_data_list]
-        self.draw_heatmap()
+        if self.cache is not None:
+            # No gaze to read if the density is in the cache
+            heatmap = self.cache.load(self.input_path, self.image_name, self.density_params())
+            if heatmap is not None:
+                self.draw_heatmap(heatmap=heatmap)
+                return
+        if is_session(self.input_path):
+            x, y = self.load_session_gaze()
+        elif is_parquet(self.input_path):
+            x, y = self.load_parquet_gaze()
+        else:
+            x, y = self.load_csv_gaze()
+        # Missing points are left out
+        pixel_x, pixel_y = to_pixels(x, y, self.display_width, self.display_height)
+        self.gaze_data = [(int(px), int(py), 1) for px, py in zip(pixel_x.tolist(), pixel_y.tolist())]
+        heatmap = self.density()
+        if self.cache is not None:
+            self.cache.save(self.input_path, self.image_name, self.density_params(), heatmap)
+        self.draw_heatmap(heatmap=heatmap)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import os
+import sys
 import csv
 import numpy as np
 import matplotlib.pyplot as plt
@@ -8,25 +9,45 @@ import cv2
 import math
 import plotly
 from collections import Counter
+from contextlib import closing
 import plotly.graph_objects as go
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import GazeSession, ParquetSession, is_session, is_parquet
+from OOP_catalog import Catalog
+
 class GazePiechart:
-    def __init__(self, input_path, image_name):
+    def __init__(self, input_path, image_name, classifier='IVT', show=True):
         self.input_path = input_path
+        # Name of the classifier used by preprocess.py, the states are read from its {classifier}_state column
+        self.classifier = classifier
+        self.state_column = f'{classifier}_state'
         self.image_name = image_name
         self.image_path = os.path.join('./Data_Collection/Img/Animals/', self.image_name)
         self.output_name = os.path.join('./EM_Analysis/Result/piechart/', self.image_name)
+        # Open the chart in the web browser, False for batch exports
+        self.show = show
     
     def run(self):
-        df = pd.read_csv(self.input_path)
-        # Create a condition to filter the DataFrame
-        condition = df['stimuli'] == self.image_name
-        selected_data = df[condition]
-        CNT = Counter(selected_data['eye_state'])
+        if is_session(self.input_path):
+            # Binary sessions are memory-mapped, only the rows of this stimulus are decoded
+            session = GazeSession(self.input_path)
+            condition = session['stimuli'] == session.code('stimuli', self.image_name)
+            CNT = Counter(session.labels(self.state_column)[condition])
+        elif is_parquet(self.input_path):
+            # Only the row group of this stimulus and the state column are read
+            states = ParquetSession(self.input_path).read([self.state_column], group=self.image_name)[self.state_column]
+            CNT = Counter(states.astype(object))
+        else:
+            # The state counts of every epoch are in the catalog, no need to read the file
+            with closing(Catalog()) as catalog:
+                catalog.update_file(self.input_path)
+                CNT = Counter(catalog.state_counts(self.image_name, [self.input_path], self.classifier))
         labels = list(CNT.keys())
         values = list(CNT.values())
         fig = go.Figure(data=[go.Pie(labels=labels, values=values, hole=.3, textinfo='label+percent', insidetextorientation='radial')])
-        fig.show()
+        if self.show:
+            fig.show()
         fig.write_image(self.output_name)
         
         
@@ -1,62 +1,58 @@
 import os
+import sys
 import csv
-import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib import image
 import pandas as pd
-import cv2
 import math
+from contextlib import closing
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import GazeSession, ParquetSession, is_session, is_parquet
+from OOP_gaze_reader import to_pixels
+from OOP_catalog import Catalog
+from OOP_render import display_frame, blend_circle, draw_dashed_line, draw_label, colormap_color, save_image
+from preprocess import EyeMovement
+
+# Function to calculate distance between two points
+def distance(p1, p2):
+    return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
+
+
+# Function to get a point on the line at a certain distance from a point
+def point_on_line(start, end, distance_from_start):
+    line_length = distance(start, end)
+    if line_length == 0:
+        return start
+    ratio = distance_from_start / line_length
+    return start[0] + ratio * (end[0] - start[0]), start[1] + ratio * (end[1] - start[1])
+
 
 class GazeScanpath:
-    def __init__(self, input_path, image_name, display_width=1920, display_height=1080, alpha=0.85, circle_size=20):
+    def __init__(self, input_path, image_name, display_width=1920, display_height=1080, alpha=0.85, circle_size=20, classifier='IVT', renderer='opencv'):
         self.input_path = input_path
+        # Name of the classifier used by preprocess.py, the fixations are read from its {classifier}_fixation_centroid column
+        self.centroid_column = f'{classifier}_fixation_centroid'
+        # and the fixation events from the events table of preprocess.py (EyeMovement.EVENTS_DIR) when it is there
+        self.events_path = GazeScanpath.events_file(input_path, classifier)
         self.image_name = image_name
         self.image_path = os.path.join('./Data_Collection/Img/Animals/', self.image_name)
         self.display_width = display_width
         self.display_height = display_height
         self.alpha = alpha
         self.circle_size = circle_size
+        # 'opencv' composites the image with NumPy/OpenCV, 'matplotlib' draws a figure (for publication figures)
+        self.renderer = renderer
         self.output_name = os.path.join('./EM_Analysis/Result/scanpath/', self.image_name)
-        self.resize_image(self.image_path, self.display_width, self.display_height)
         self.gaze_data = None
         self.max_duration = None
 
-    def resize_image(self, image_path, width, height):
-        image = cv2.imread(image_path)
-        if image is None:
-            print("Failed to load image. Please check the image path.")
-            return
-        # Check if image is already 1920x1080
-        if image.shape[1] == self.display_width and image.shape[0] == self.display_height:
-            pass
-        else:
-            # Resize the image
-            resized_image = cv2.resize(image, (self.display_width, self.display_height))
-            cv2.imwrite(image_path, resized_image)
-            print("Image resized to 1920x1080 and saved with correct color.")
-            
+    @staticmethod
+    def events_file(input_path, classifier):
+        return os.path.join(EyeMovement.EVENTS_DIR, EyeMovement.events_name(os.path.basename(input_path), classifier))
+
     def draw_display(self):
-        screen = np.zeros((self.display_height, self.display_width, 3), dtype='float32')
-        if self.image_path is not None:
-            if not os.path.isfile(self.image_path):
-                raise Exception(f"ERROR in draw_display: imagefile not found at '{self.image_path}'")
-            # Load image with matplotlib's image module
-            img = image.imread(self.image_path)
-            # Ensure the image is in the correct format
-            if img.dtype == np.float32:
-                # Normalize if the image is in float format (common for .png)
-                img = np.clip(img, 0, 1)
-            elif img.dtype == np.uint8:
-                # Convert to float and normalize if the image is in byte format (common for .jpg)
-                img = img.astype('float32') / 255
-
-            # width and height of the image
-            w, h = img.shape[1], img.shape[0]
-            # x and y position of the image on the display
-            x = self.display_width // 2 - w // 2
-            y = self.display_height // 2 - h // 2
-            # draw the image on the screen
-            screen[y:y + h, x:x + w, :] += img[:,:,:3]  # Use only RGB channels
+        # RGB floats of the stimulus on the display, from the decoded frame of the stimulus cache
+        screen = display_frame(self.image_path, self.display_width, self.display_height)[:, :, ::-1].astype('float32') / 255
         dpi = 100.0
         figsize = (self.display_width / dpi, self.display_height / dpi)
         fig = plt.figure(figsize=figsize, dpi=dpi, frameon=False)
@@ -67,24 +63,33 @@ class GazeScanpath:
         ax.imshow(screen)
         return fig, ax            
             
+    def draw_scanpath_opencv(self):
+        img = display_frame(self.image_path, self.display_width, self.display_height)
+        for i in range(len(self.gaze_data) - 1):
+            start = (self.gaze_data[i][0], self.gaze_data[i][1])
+            end = (self.gaze_data[i + 1][0], self.gaze_data[i + 1][1])
+            # Yellow dashed line from circle edge to circle edge
+            draw_dashed_line(img, point_on_line(start, end, self.circle_size), point_on_line(end, start, self.circle_size), (0, 255, 255))
+        for i in range(len(self.gaze_data)):
+            x, y, duration = self.gaze_data[i]
+            color_intensity = min(duration / self.max_duration, 1)  # Normalizing duration
+            blend_circle(img, (x, y), self.circle_size, colormap_color(color_intensity), self.alpha)
+        # Labels above every circle, as matplotlib draws texts after patches
+        for i in range(len(self.gaze_data)):
+            draw_label(img, str(i + 1), self.gaze_data[i][:2], self.circle_size * 0.6)
+        if self.output_name is not None:
+            save_image(self.output_name, img)
+        return img
+
     def draw_scanpath(self):
+        # Return the BGR image, or the closed matplotlib figure with the matplotlib renderer
+        if self.renderer == 'opencv':
+            return self.draw_scanpath_opencv()
         fig, ax = self.draw_display()
 
         # Create a colormap instance
         jet_colormap = plt.cm.jet
 
-        # Function to calculate distance between two points
-        def distance(p1, p2):
-            return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
-
-        # Function to get a point on the line at a certain distance from a point
-        def point_on_line(start, end, distance_from_start):
-            line_length = distance(start, end)
-            if line_length == 0:
-                return start
-            ratio = distance_from_start / line_length
-            return start[0] + ratio * (end[0] - start[0]), start[1] + ratio * (end[1] - start[1])
-
         # Now draw the lines and circles
         for i in range(len(self.gaze_data) - 1):
             start = (self.gaze_data[i][0], self.gaze_data[i][1])
@@ -110,21 +115,53 @@ class GazeScanpath:
         ax.invert_yaxis()
         if self.output_name is not None:
             fig.savefig(self.output_name)
+        # Figures are kept by pyplot until they are closed
+        plt.close(fig)
         return fig
 
 
     
-    def to_pixel(self, coord):
-        coord = eval(coord)
-        if len(coord)!= 2 or coord[0] == None or coord[1] == None: return (None, None)
-        return (coord[0] * self.display_width, coord[1] * self.display_height)
-    
+    def load_session_fixation_centers(self):
+        # Binary sessions are memory-mapped, only the rows of this stimulus are read
+        session = GazeSession(self.input_path)
+        condition = session['stimuli'] == session.code('stimuli', self.image_name)
+        x, y = session.points(self.centroid_column)
+        return x[condition], y[condition]
+
+    def load_parquet_fixation_centers(self):
+        # Only the row group of this stimulus and the two centroid columns are read
+        return ParquetSession(self.input_path).points(self.centroid_column, group=self.image_name)
+
+    def load_csv_fixation_centers(self):
+        # Only the rows of this stimulus are read, from the row ranges in the catalog
+        columns = [f'{self.centroid_column}_x', f'{self.centroid_column}_y']
+        with closing(Catalog()) as catalog:
+            catalog.update_file(self.input_path)
+            df = catalog.read_rows(self.image_name, columns, files=[self.input_path])
+        return df[columns[0]].to_numpy(), df[columns[1]].to_numpy()
+
+    def load_fixation_events(self):
+        # One row per fixation, the duration is the number of samples as in the centroid column
+        events = pd.read_csv(self.events_path)
+        events = events[(events['type'] == 'Fixation') & (events['stimulus'] == self.image_name)]
+        x = events['centroid_x'].to_numpy() * self.display_width
+        y = events['centroid_y'].to_numpy() * self.display_height
+        return list(zip(x.tolist(), y.tolist(), events['n_samples'].tolist()))
+
     def run(self):
-        df = pd.read_csv(self.input_path)
-        condition = df['stimuli'] == self.image_name
-        selected_data = df[condition]
-        fixation_center_list = selected_data['IVT_fixation_centroid'].apply(self.to_pixel).tolist()
-        filtered_fixation_center_list = [coord for coord in fixation_center_list if coord != (None, None)]
+        if os.path.isfile(self.events_path):
+            self.gaze_data = self.load_fixation_events()
+            self.draw_fixations()
+            return
+        if is_session(self.input_path):
+            x, y = self.load_session_fixation_centers()
+        elif is_parquet(self.input_path):
+            x, y = self.load_parquet_fixation_centers()
+        else:
+            x, y = self.load_csv_fixation_centers()
+        # Samples outside the fixations are left out
+        pixel_x, pixel_y = to_pixels(x, y, self.display_width, self.display_height)
+        filtered_fixation_center_list = list(zip(pixel_x.tolist(), pixel_y.tolist()))
         clean_fixation_center_list = []
         idx = 0
         while idx < len(filtered_fixation_center_list)-1:
@@ -138,6 +175,13 @@ class GazeScanpath:
                 clean_fixation_center_list.append((*filtered_fixation_center_list[idx], 1))
             idx += 1
         self.gaze_data = clean_fixation_center_list
+        self.draw_fixations()
+
+    def draw_fixations(self):
+        # A stimulus without fixations (e.g. the eyes were lost the whole time) has no scanpath
+        if not self.gaze_data:
+            print(f"No fixations on {self.image_name} in {os.path.basename(self.input_path)}, no scanpath drawn")
+            return
         self.max_duration = max(self.gaze_data, key=lambda x:x[-1])[-1]
         self.draw_scanpath()
 
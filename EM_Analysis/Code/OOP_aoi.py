@@ -0,0 +1,146 @@
+"""
+Please import AOISet class and aoi_metrics function from this script.
+Areas of interest (AOI) are defined per stimulus in Data_Collection/Img/aoi.json, in the normalized display coordinates
+of the gaze points ([0, 1] from the left and from the top), as polygons or rectangles [left, top, right, bottom]:
+    {"807715.jpg": [{"name": "head", "polygon": [[0.55, 0.15], [0.80, 0.15], [0.78, 0.55], [0.57, 0.55]]},
+                    {"name": "body", "rect": [0.45, 0.55, 0.90, 1.0]}]}
+The rest of the display is the background AOI, and an AOI listed later is drawn over the ones before it.
+
+Every AOI set is rasterized once into a label mask of the display (0 for the background, i for the i-th AOI),
+so the AOI of a gaze point or fixation centroid is one array lookup.
+aoi_metrics reads the fixations of the events tables of preprocess.py and computes in one pass, per session, stimulus and AOI:
+dwell time (sum of the fixation durations), fixation count and first-fixation latency (from the stimulus onset),
+and per stimulus the matrix of transitions between the AOIs of consecutive fixations.
+A fixation that starts on the onset sample began on the previous stimulus and was cut at its end. It counts for the dwell time,
+the fixation count and the transitions, but not for the first-fixation latency, which is NaN if the AOI has no other fixation;
+the carried_over column flags the AOI it falls on.
+
+Run this script to write EM_Analysis/Result/aoi/metrics.csv and EM_Analysis/Result/aoi/transitions/<stimulus>.csv:
+    python EM_Analysis/Code/OOP_aoi.py [--classifier IVT]
+"""
+import os
+import json
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+import cv2
+
+AOI_PATH = './Data_Collection/Img/aoi.json'
+EVENTS_DIR = './Data_Collection/Data/Events/'
+RESULT_DIR = './EM_Analysis/Result/aoi/'
+BACKGROUND = 'background'
+
+
+class AOISet:
+    def __init__(self, aois, display_width=1920, display_height=1080):
+        # aois: list of {"name": ..., "polygon": [[x, y], ...]} or {"name": ..., "rect": [left, top, right, bottom]}
+        self.names = [BACKGROUND] + [aoi['name'] for aoi in aois]
+        self.display_width = display_width
+        self.display_height = display_height
+        self.mask = self.rasterize(aois)
+
+    def rasterize(self, aois, shift=4):
+        mask = np.zeros((self.display_height, self.display_width), dtype='int16')
+        scale = np.array([self.display_width, self.display_height]) * (1 << shift)
+        for label, aoi in enumerate(aois, 1):
+            if 'rect' in aoi:
+                left, top, right, bottom = aoi['rect']
+                polygon = [[left, top], [right, top], [right, bottom], [left, bottom]]
+            else:
+                polygon = aoi['polygon']
+            points = np.rint(np.array(polygon, dtype='float64') * scale).astype('int32')
+            cv2.fillPoly(mask, [points], label, shift=shift)
+        return mask
+
+    def label(self, x, y):
+        # AOI index of every point (normalized display coordinates), -1 for missing points and points off the display
+        x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+        labels = np.full(x.shape, -1, dtype='int16')
+        with np.errstate(invalid='ignore'):
+            pixel_x, pixel_y = np.floor(x * self.display_width), np.floor(y * self.display_height)
+            inside = (pixel_x >= 0) & (pixel_x < self.display_width) & (pixel_y >= 0) & (pixel_y < self.display_height)
+        labels[inside] = self.mask[pixel_y[inside].astype('int64'), pixel_x[inside].astype('int64')]
+        return labels
+
+
+def load_aoi_sets(path=AOI_PATH, display_width=1920, display_height=1080):
+    # stimulus -> AOISet of every stimulus in the AOI file
+    with open(path) as file:
+        definitions = json.load(file)
+    return {stimulus: AOISet(aois, display_width, display_height) for stimulus, aois in definitions.items()}
+
+
+def load_fixations(events_dir=EVENTS_DIR, classifier='IVT'):
+    # Fixations of every session with the onset of their stimulus, in order of time within each session
+    frames = []
+    for path in sorted(glob.glob(os.path.join(events_dir, f'*_{classifier}.csv'))):
+        events = pd.read_csv(path)
+        events['session'] = os.path.basename(path)[:-len(f'_{classifier}.csv')]
+        frames.append(events)
+    if not frames:
+        return pd.DataFrame(columns=['session', 'stimulus', 'start_time', 'duration_ms', 'centroid_x', 'centroid_y', 'onset'])
+    events = pd.concat(frames, ignore_index=True)
+    events['start_time'] = pd.to_datetime(events['start_time'])
+    # Events are split at every stimulus change, so the first event of a stimulus starts at its onset
+    events['onset'] = events.groupby(['session', 'stimulus'])['start_time'].transform('min')
+    return events[events['type'] == 'Fixation'].sort_values(['session', 'start_index'], kind='stable').reset_index(drop=True)
+
+
+def aoi_metrics(aoi_sets, fixations):
+    """
+    aoi_sets: stimulus -> AOISet, fixations: DataFrame of load_fixations
+    Return the metrics (one row per session, stimulus and AOI with at least one fixation)
+    and stimulus -> DataFrame of the number of transitions from the AOI of every row to the AOI of every column.
+    """
+    fixations = fixations[fixations['stimulus'].isin(aoi_sets)].copy()
+    labels = np.full(len(fixations), -1, dtype='int16')
+    for stimulus, rows in fixations.groupby('stimulus').indices.items():
+        labels[rows] = aoi_sets[stimulus].label(fixations['centroid_x'].to_numpy()[rows], fixations['centroid_y'].to_numpy()[rows])
+    fixations['label'] = labels
+    fixations = fixations[fixations['label'] >= 0]
+    fixations['aoi'] = [aoi_sets[stimulus].names[label] for stimulus, label in zip(fixations['stimulus'], fixations['label'])]
+    # Fixations carried over from the previous stimulus have no latency
+    fixations['carried_over'] = fixations['start_time'] == fixations['onset']
+    fixations['latency_start'] = fixations['start_time'].where(~fixations['carried_over'])
+
+    if fixations.empty:
+        metrics = pd.DataFrame(columns=['session', 'stimulus', 'aoi', 'dwell_time_ms', 'fixation_count', 'first_fixation_latency_ms',
+                                        'carried_over'])
+    else:
+        grouped = fixations.groupby(['session', 'stimulus', 'aoi'], sort=True)
+        metrics = grouped.agg(dwell_time_ms=('duration_ms', 'sum'), fixation_count=('duration_ms', 'size'),
+                              first_fixation=('latency_start', 'min'), onset=('onset', 'first'),
+                              carried_over=('carried_over', 'any')).reset_index()
+        metrics.insert(5, 'first_fixation_latency_ms',
+                       (metrics.pop('first_fixation') - metrics.pop('onset')).dt.total_seconds() * 1000)
+
+    # Consecutive fixations of the same session and stimulus
+    same = ((fixations['session'].to_numpy()[1:] == fixations['session'].to_numpy()[:-1])
+            & (fixations['stimulus'].to_numpy()[1:] == fixations['stimulus'].to_numpy()[:-1]))
+    source, target = fixations['label'].to_numpy()[:-1][same], fixations['label'].to_numpy()[1:][same]
+    stimuli = fixations['stimulus'].to_numpy()[:-1][same]
+    transitions = {}
+    for stimulus, aoi_set in aoi_sets.items():
+        n = len(aoi_set.names)
+        counts = np.zeros((n, n), dtype='int64')
+        selected = stimuli == stimulus
+        np.add.at(counts, (source[selected], target[selected]), 1)
+        transitions[stimulus] = pd.DataFrame(counts, index=aoi_set.names, columns=aoi_set.names)
+    return metrics, transitions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dwell time, fixation count, first-fixation latency and transitions of the AOIs.")
+    parser.add_argument('--classifier', default='IVT', help="classifier of the events tables, as in preprocess.py")
+    parser.add_argument('--aoi', default=AOI_PATH, help="json file of the AOIs of every stimulus")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.aoi):
+        raise SystemExit(f"No AOI definitions at '{args.aoi}', see the top of this script for the format.")
+    metrics, transitions = aoi_metrics(load_aoi_sets(args.aoi), load_fixations(classifier=args.classifier))
+    os.makedirs(os.path.join(RESULT_DIR, 'transitions'), exist_ok=True)
+    metrics.to_csv(os.path.join(RESULT_DIR, 'metrics.csv'), index=False)
+    for stimulus, matrix in transitions.items():
+        matrix.to_csv(os.path.join(RESULT_DIR, 'transitions', f'{os.path.splitext(stimulus)[0]}.csv'))
+    print(f"{len(metrics)} rows of AOI metrics for {metrics['session'].nunique()} sessions and {len(transitions)} stimuli")
@@ -0,0 +1,276 @@
+"""
+Please import Catalog class from this script.
+The catalog is a sqlite file (Data_Collection/Data/catalog.sqlite) that indexes the Processed sessions:
+for every session its eye_to_use and number of rows, and for every stimulus epoch (run of rows with the same stimuli value)
+its row range, the byte offset of its first row in a csv file, its number of valid samples and the count of every eye state.
+Listing the stimuli or reading the rows of one stimulus across sessions is then an index lookup instead of a full read of every file.
+    catalog = Catalog()
+    catalog.update()
+    df = catalog.read_rows('807715.jpg', ['left_gaze_x', 'left_gaze_y', 'IVT_state'])
+
+Run this script to index the Processed folder and print a summary:
+    python EM_Analysis/Code/OOP_catalog.py
+"""
+import os
+import sys
+import sqlite3
+from contextlib import closing
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import (GazeSession, ParquetSession, is_session, is_parquet, session_name, timestamps_to_ns,
+                             POINT_COLUMNS, GAZE_SUFFIX, PARQUET_SUFFIX)
+from OOP_gaze_reader import parse_points
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    file TEXT PRIMARY KEY,
+    session TEXT,
+    format TEXT,
+    eye_to_use TEXT,
+    n_rows INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS epochs (
+    id INTEGER PRIMARY KEY,
+    file TEXT,
+    stimulus TEXT,
+    start_row INTEGER,
+    end_row INTEGER,
+    byte_offset INTEGER,
+    valid_samples INTEGER
+);
+CREATE INDEX IF NOT EXISTS epochs_stimulus ON epochs (stimulus);
+CREATE INDEX IF NOT EXISTS epochs_file ON epochs (file);
+CREATE TABLE IF NOT EXISTS state_counts (
+    epoch INTEGER,
+    classifier TEXT,
+    state TEXT,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS state_counts_epoch ON state_counts (epoch);
+"""
+
+
+def file_signature(path):
+    # .gaze sessions are folders, their size is the size of all their files and their mtime the latest one
+    paths = [path] if os.path.isfile(path) else [os.path.join(path, f) for f in os.listdir(path)]
+    return sum(os.path.getsize(p) for p in paths), max(os.stat(p).st_mtime_ns for p in paths)
+
+
+def latest_formats(sessions):
+    # A recording can be in Processed as .csv, .gaze and .parquet: keep one row of sessions() per session,
+    # the most recently written file, so a format converted from an older output never counts twice or wins over it
+    latest = {}
+    for s in sessions:
+        if s['session'] not in latest or s['mtime_ns'] > latest[s['session']]['mtime_ns']:
+            latest[s['session']] = s
+    return [latest[name] for name in sorted(latest)]
+
+
+def csv_row_offsets(path):
+    # Byte offset of every data row of a csv file; the gaze points are quoted but never span lines
+    data = np.memmap(path, dtype='uint8', mode='r') if os.path.getsize(path) else np.zeros(0, dtype='uint8')
+    line_starts = np.flatnonzero(data == ord('\n')) + 1
+    return line_starts[line_starts < len(data)]
+
+
+def load_index_columns(path):
+    # stimuli, validity of the chosen eye and the *_state columns of a Processed session, and its eye_to_use
+    if is_session(path):
+        session = GazeSession(path)
+        eye = session.attrs.get('eye_to_use')
+        columns = {name: session.labels(name) for name in session.columns if name == 'stimuli' or name.endswith('_state')}
+        validity = np.asarray(session[f'{eye}_gaze_point_validity']) if eye else None
+    elif is_parquet(path):
+        session = ParquetSession(path)
+        eye = session.attrs.get('eye_to_use')
+        names = [name for name in session.columns if name == 'stimuli' or name.endswith('_state')]
+        if eye:
+            names.append(f'{eye}_gaze_point_validity')
+        df = session.read(names)
+        validity = df.pop(f'{eye}_gaze_point_validity').to_numpy() if eye else None
+        columns = {name: df[name].astype(object).to_numpy() for name in df.columns}
+    else:
+        df = pd.read_csv(path, usecols=lambda name: name in ('stimuli', 'eye_to_use') or name.endswith(('_state', '_gaze_point_validity')))
+        eye = df['eye_to_use'].iloc[0] if 'eye_to_use' in df.columns and len(df) else None
+        validity = df[f'{eye}_gaze_point_validity'].to_numpy() if eye else None
+        columns = {name: df[name].to_numpy(dtype=object) for name in df.columns if name == 'stimuli' or name.endswith('_state')}
+    return columns, validity, eye
+
+
+def read_range(path, start, end, columns, byte_offset=None):
+    """
+    Rows [start, end) of a Processed session as a DataFrame of typed columns, the layout of the .gaze and .parquet files:
+    a csv point column is returned as its _x and _y columns, e.g. left_gaze_x from left_gaze_point_on_display_area,
+    and the csv timestamps as int64 nanoseconds.
+    """
+    if is_session(path):
+        session = GazeSession(path)
+        data = {}
+        for name in columns:
+            values = session[name][start:end]
+            if name in session.categories:
+                values = np.array(session.categories[name] + [None], dtype=object)[values]
+            data[name] = np.asarray(values)
+        return pd.DataFrame(data)
+    if is_parquet(path):
+        df = ParquetSession(path).read_rows(start, end, columns)
+        # Same types as the other formats: text as object columns instead of Categorical
+        return df.astype({name: object for name in df.columns if isinstance(df[name].dtype, pd.CategoricalDtype)})
+
+    with open(path, newline='') as file:
+        header = pd.read_csv(file, nrows=0).columns.tolist()
+    prefixes = {value: key for key, value in POINT_COLUMNS.items()}
+    # csv column of every requested column
+    sources = {name: prefixes[name[:-2]] if name[-2:] in ('_x', '_y') and name[:-2] in prefixes else name for name in columns}
+    with open(path, 'rb') as file:
+        if byte_offset is None:
+            byte_offset = int(csv_row_offsets(path)[start]) if end > start else 0
+        file.seek(byte_offset)
+        df = pd.read_csv(file, header=None, names=header, usecols=sorted(set(sources.values())), nrows=end - start)
+    points = {source: parse_points(df[source]) for name, source in sources.items() if source != name}
+    data = {}
+    for name, source in sources.items():
+        if source in points:
+            data[name] = points[source][0] if name.endswith('_x') else points[source][1]
+        elif source == 'timestamp':
+            data[name] = timestamps_to_ns(df[source])
+        else:
+            data[name] = df[source].to_numpy()
+    return pd.DataFrame(data)
+
+
+class Catalog:
+    PATH = './Data_Collection/Data/catalog.sqlite'
+    PROCESSED_DIR = './Data_Collection/Data/Processed/'
+
+    def __init__(self, path=PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory=PROCESSED_DIR):
+        # Index the new and changed sessions of the folder and forget the ones that are gone; return how many were indexed
+        files = [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+                 if f.endswith(('.csv', GAZE_SUFFIX, PARQUET_SUFFIX))]
+        indexed = sum(self.update_file(path) for path in files)
+        known = {os.path.abspath(path) for path in files}
+        prefix = os.path.join(os.path.abspath(directory), '')
+        with self.connection:
+            for row in self.connection.execute("SELECT file FROM sessions").fetchall():
+                if row['file'].startswith(prefix) and row['file'] not in known:
+                    self._forget(row['file'])
+        return indexed
+
+    def update_file(self, path):
+        # Index a session if it is new or changed since it was indexed, return whether it was indexed
+        path = os.path.abspath(path)
+        size, mtime_ns = file_signature(path)
+        row = self.connection.execute("SELECT size, mtime_ns FROM sessions WHERE file = ?", (path,)).fetchone()
+        if row is not None and (row['size'], row['mtime_ns']) == (size, mtime_ns):
+            return False
+        self.index_file(path, size, mtime_ns)
+        return True
+
+    def index_file(self, path, size, mtime_ns):
+        columns, validity, eye = load_index_columns(path)
+        stimuli = pd.Series(columns.pop('stimuli'), dtype=object)
+        n_rows = len(stimuli)
+        offsets = csv_row_offsets(path) if not (is_session(path) or is_parquet(path)) else None
+
+        # Epochs: runs of rows with the same stimulus, rows without a stimulus are not indexed
+        codes, _ = pd.factorize(stimuli)
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1]))) if n_rows else np.array([], dtype=int)
+        ends = np.append(starts[1:], n_rows)
+        with self.connection:
+            self._forget(path)
+            self.connection.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (path, session_name(path), os.path.splitext(path)[1][1:], eye, n_rows, size, mtime_ns))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if codes[start] < 0:
+                    continue
+                valid = int(np.count_nonzero(validity[start:end])) if validity is not None else None
+                cursor = self.connection.execute(
+                    "INSERT INTO epochs (file, stimulus, start_row, end_row, byte_offset, valid_samples) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, stimuli.iloc[start], start, end, int(offsets[start]) if offsets is not None else None, valid))
+                for name, states in columns.items():
+                    counts = pd.Series(states[start:end], dtype=object).value_counts()
+                    self.connection.executemany(
+                        "INSERT INTO state_counts VALUES (?, ?, ?, ?)",
+                        [(cursor.lastrowid, name[:-len('_state')], state, int(count)) for state, count in counts.items()])
+
+    def _forget(self, path):
+        self.connection.execute("DELETE FROM state_counts WHERE epoch IN (SELECT id FROM epochs WHERE file = ?)", (path,))
+        self.connection.execute("DELETE FROM epochs WHERE file = ?", (path,))
+        self.connection.execute("DELETE FROM sessions WHERE file = ?", (path,))
+
+    def sessions(self):
+        return [dict(row) for row in self.connection.execute("SELECT * FROM sessions ORDER BY session, file")]
+
+    def session(self, path):
+        row = self.connection.execute("SELECT * FROM sessions WHERE file = ?", (os.path.abspath(path),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def _where(self, stimulus=None, files=None):
+        conditions, params = [], []
+        if stimulus is not None:
+            conditions.append("epochs.stimulus = ?")
+            params.append(stimulus)
+        if files is not None:
+            files = [os.path.abspath(f) for f in files]
+            conditions.append(f"epochs.file IN ({', '.join('?' * len(files))})")
+            params.extend(files)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def stimuli(self, files=None):
+        # Stimuli in the order they were first shown
+        where, params = self._where(files=files)
+        query = f"SELECT stimulus, MIN(id) AS first FROM epochs{where} GROUP BY stimulus ORDER BY first"
+        return [row['stimulus'] for row in self.connection.execute(query, params)]
+
+    def epochs(self, stimulus=None, files=None):
+        where, params = self._where(stimulus, files)
+        query = f"SELECT epochs.*, sessions.session, sessions.eye_to_use FROM epochs JOIN sessions USING (file){where} ORDER BY sessions.session, epochs.start_row"
+        return [dict(row) for row in self.connection.execute(query, params)]
+
+    def state_counts(self, stimulus=None, files=None, classifier='IVT'):
+        # Number of samples of every eye state, summed over the matching epochs
+        where, params = self._where(stimulus, files)
+        where += (" AND" if where else " WHERE") + " state_counts.classifier = ?"
+        query = (f"SELECT state, SUM(count) AS count FROM state_counts JOIN epochs ON epochs.id = state_counts.epoch{where} "
+                 f"GROUP BY state ORDER BY count DESC")
+        return {row['state']: row['count'] for row in self.connection.execute(query, params + [classifier])}
+
+    def read_rows(self, stimulus, columns, files=None):
+        """
+        Rows of every epoch of this stimulus, in every indexed session or in these files, with session and row columns.
+        columns are typed column names, see read_range; 'gaze_x'/'gaze_y' are the gaze point of the eye_to_use of each session.
+        """
+        frames = []
+        for epoch in self.epochs(stimulus, files):
+            names = [f"{epoch['eye_to_use']}_{name}" if name in ('gaze_x', 'gaze_y') else name for name in columns]
+            df = read_range(epoch['file'], epoch['start_row'], epoch['end_row'], names, epoch['byte_offset'])
+            df.columns = columns
+            df.insert(0, 'row', np.arange(epoch['start_row'], epoch['end_row']))
+            df.insert(0, 'session', epoch['session'])
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=['session', 'row'] + list(columns))
+        return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    with closing(Catalog()) as catalog:
+        print(f"{catalog.update()} sessions indexed")
+        for session in catalog.sessions():
+            print(f"{os.path.basename(session['file'])}: {session['n_rows']} rows, {session['eye_to_use']} eye, "
+                  f"{len(catalog.stimuli([session['file']]))} stimuli")
+        print(f"IVT states over all sessions: {catalog.state_counts()}")
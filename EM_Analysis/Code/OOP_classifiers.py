@@ -0,0 +1,342 @@
+"""
+Please import the classifier classes from this script and pass one to EyeMovement:
+    em = EyeMovement(filename, classifier=IDTClassifier(dispersion_threshold=1.0))
+
+Every classifier labels the samples that are not already Blink/Error after the gap handling of EyeMovement,
+and shares the same post-processing: fixations shorter than min_fixation_samples become Error,
+fixation centroids are the mean of their points, and [Saccade, Error, Saccade] becomes [Saccade, Saccade, Saccade].
+    IVTClassifier   velocity threshold, optionally on median filtered coordinates (the default of EyeMovement)
+    IDTClassifier   dispersion threshold over a sliding window, O(n) with monotonic min/max deques
+    IVVTClassifier  two velocity thresholds: saccade, smooth pursuit and fixation
+    IVDTClassifier  velocity threshold for saccades, then dispersion windows split fixation from smooth pursuit
+The states are written to the {name}_state and {name}_fixation_centroid columns, e.g. IDT_state,
+and events returns one row per fixation, saccade, blink, ... for the events table of EyeMovement.
+"""
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def run_sums(values, starts, lengths):
+    # Sum of values over every run [start, start + length), each with numpy's pairwise summation,
+    # so it is bit-identical to values[start:start + length].sum() (and to pandas Series.sum). Runs are few, one per fixation
+    return np.array([values[start:start + length].sum() for start, length in zip(starts.tolist(), lengths.tolist())], dtype='float64')
+
+
+def run_means(values, starts, lengths):
+    # Mean of every run skipping NaN, bit-identical to Series.mean
+    return run_sums(np.nan_to_num(values, nan=0.0), starts, lengths) / run_sums(np.isfinite(values).astype('float64'), starts, lengths)
+
+
+def run_indices(starts, lengths):
+    # Indices of every sample in the runs [start, start + length), in order
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+
+def find_runs(mask):
+    # Start and end (exclusive) of every run of True values
+    edges = np.diff(np.concatenate(([0], mask.astype('int8'), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+class EyeMovementClassifier:
+    name = None
+
+    def __init__(self, min_fixation_samples=6):
+        self.min_fixation_samples = min_fixation_samples  # Fixation is at least 100ms at 60 Hz
+        self.geometry = None
+        # Samples changed by smooth in the last run
+        self.smoothed = None
+        # Start and end (exclusive) of the fixations of the last run
+        self.fixations = None
+
+    def run(self, x, y, labels, geometry):
+        """
+        x, y: float arrays of gaze points on the display area, NaN if missing
+        labels: 'Blink'/'Error' for the gaps found by EyeMovement, None for the samples to classify
+        geometry: dict with screen_width, screen_height, distance (mm) and sampling_rate (Hz)
+        Return the state and the fixation centroid (x, y) or (None, None) of every sample, as object arrays.
+        """
+        self.geometry = geometry
+        states = np.array(labels, dtype=object)
+        self.classify(x, y, states)
+        centroids = self.fixation_centroids(x, y, states)
+        self.smoothed = self.smooth(states)
+        return states, centroids
+
+    def classify(self, x, y, states):
+        # Set the state of every sample that is still None, in place
+        raise NotImplementedError
+
+    def params(self):
+        # Everything that changes the output, e.g. to decide whether a session has to be processed again
+        return {'name': self.name, 'min_fixation_samples': self.min_fixation_samples}
+
+    def lookahead(self):
+        # Number of samples after a saccade that decide the states before it, used to cut a recording into chunks
+        return 1
+
+    def to_mm(self, x, y):
+        return x * self.geometry['screen_width'], y * self.geometry['screen_height']
+
+    def degree_to_mm(self, degree):
+        # Distance on the screen seen under this visual angle
+        return self.geometry['distance'] * np.tan(np.deg2rad(degree))
+
+    def mm_to_degree(self, mm):
+        return np.rad2deg(np.arctan(mm / self.geometry['distance']))
+
+    def velocity(self, x, y):
+        # Visual angle per second from every point to the next one, NaN for the last point and missing points
+        x, y = self.to_mm(x, y)
+        d = np.sqrt((x[1:] - x[:-1]) ** 2 + (y[1:] - y[:-1]) ** 2)
+        v = np.full(len(x), np.nan)
+        v[:-1] = np.rad2deg(np.arctan(d / self.geometry['distance'])) * self.geometry['sampling_rate']
+        return v
+
+    def fixation_runs(self, states):
+        return find_runs(states == 'Fixation')
+
+    def fixation_centroids(self, x, y, states):
+        # Fixations shorter than min_fixation_samples become error states
+        starts, ends = self.fixation_runs(states)
+        lengths = ends - starts
+        short = lengths < self.min_fixation_samples
+        states[run_indices(starts[short], lengths[short])] = 'Error'
+        starts, lengths = starts[~short], lengths[~short]
+
+        # Same result as Series.mean on every fixation: NaN is skipped, and the sums use numpy's pairwise summation
+        x_center, y_center = run_means(x, starts, lengths), run_means(y, starts, lengths)
+        self.fixations = (starts, starts + lengths)
+        centers = np.fromiter(zip(x_center, y_center), dtype=object, count=len(starts))
+        centroids = np.empty(len(states), dtype=object)
+        centroids[:] = [(None, None)]
+        centroids[run_indices(starts, lengths)] = np.repeat(centers, lengths)
+        return centroids
+
+    def events(self, x, y, states, breaks=None):
+        """
+        One event per run of samples with the same state after run, two fixations next to each other stay two events,
+        and a run is also split at breaks (e.g. the first sample of every stimulus).
+        Return a dict of arrays, NaN where a value does not apply to the type of the event:
+            type, start, end (exclusive)
+            centroid_x, centroid_y  centroid of the fixations
+            dispersion              (max x - min x) + (max y - min y) of the fixations, in degree
+            amplitude               angle from the first point of the saccades to the point after them, in degree
+            peak_velocity           highest velocity of the saccades, in degree per second
+        """
+        n = len(states)
+        change = np.ones(n + 1, dtype=bool)
+        change[1:n] = states[1:] != states[:-1]
+        change[self.fixations[0]] = True
+        change[self.fixations[1]] = True
+        if breaks is not None:
+            change[breaks] = True
+        bounds = np.flatnonzero(change)
+        starts, ends = bounds[:-1], bounds[1:]
+        types = states[starts]
+        fixation, saccade = types == 'Fixation', types == 'Saccade'
+
+        events = {'type': types, 'start': starts, 'end': ends}
+        for name in ('centroid_x', 'centroid_y', 'dispersion', 'amplitude', 'peak_velocity'):
+            events[name] = np.full(len(starts), np.nan)
+        if len(starts) == 0:
+            return events
+        # Same centroids as fixation_centroids for the fixations that are not split
+        events['centroid_x'][fixation] = run_means(x, starts[fixation], (ends - starts)[fixation])
+        events['centroid_y'][fixation] = run_means(y, starts[fixation], (ends - starts)[fixation])
+        xs, ys = self.to_mm(x, y)
+        spread = (np.fmax.reduceat(xs, starts) - np.fmin.reduceat(xs, starts)
+                  + np.fmax.reduceat(ys, starts) - np.fmin.reduceat(ys, starts))
+        events['dispersion'][fixation] = self.mm_to_degree(spread[fixation])
+        last = np.minimum(ends, n - 1)
+        distance = np.sqrt((xs[last] - xs[starts]) ** 2 + (ys[last] - ys[starts]) ** 2)
+        events['amplitude'][saccade] = self.mm_to_degree(distance[saccade])
+        events['peak_velocity'][saccade] = np.fmax.reduceat(self.velocity(x, y), starts)[saccade]
+        return events
+
+    def smooth(self, states):
+        # For 3 cosecutive eye states, change [Saccade, Error, Saccade] to [Saccade, Saccade, Saccade]
+        # A changed state can never complete another pattern, so all of them are found on the states before the change
+        is_saccade, is_error = states == 'Saccade', states == 'Error'
+        middle = np.zeros(len(states), dtype=bool)
+        middle[1:-1] = is_saccade[:-2] & is_error[1:-1] & is_saccade[2:]
+        states[middle] = 'Saccade'
+        return middle
+
+
+class IVTClassifier(EyeMovementClassifier):
+    """
+    Calculate the velocity between each consecutive point,
+    if the velocity is greater than the threshold, then it is a saccade, the rest of the points are fixations.
+    filter_window (odd number of samples) applies a median filter to the coordinates first, for noisy recordings.
+    """
+    name = 'IVT'
+
+    def __init__(self, saccade_threshold=30, min_fixation_samples=6, filter_window=None):
+        super().__init__(min_fixation_samples)
+        self.saccade_threshold = saccade_threshold  # degree per second
+        self.filter_window = filter_window
+
+    def params(self):
+        return {**super().params(), 'saccade_threshold': self.saccade_threshold, 'filter_window': self.filter_window}
+
+    def lookahead(self):
+        if self.filter_window:
+            # The filtered value of the first sample of a chunk would depend on the previous chunk too
+            raise ValueError("The median filter is not supported in chunked mode.")
+        return super().lookahead()
+
+    def median_filter(self, values):
+        half = self.filter_window // 2
+        padded = np.pad(values, half, mode='edge')
+        filtered = np.median(sliding_window_view(padded, self.filter_window), axis=1)
+        # Windows reaching into a gap keep the raw value
+        return np.where(np.isnan(filtered), values, filtered)
+
+    def classify(self, x, y, states):
+        if self.filter_window:
+            x, y = self.median_filter(x), self.median_filter(y)
+        unlabelled = np.equal(states, None)
+        saccade = unlabelled & (self.velocity(x, y) >= self.saccade_threshold)
+        states[saccade] = 'Saccade'
+        states[unlabelled & ~saccade] = 'Fixation'
+
+
+class IDTClassifier(EyeMovementClassifier):
+    """
+    A window of min_fixation_samples points is a fixation if its dispersion, (max x - min x) + (max y - min y),
+    is at most dispersion_threshold (degree), and it grows while the dispersion stays below the threshold.
+    Otherwise the window slides by one point. Points outside every fixation are saccades.
+    The window extremes are kept in monotonic deques, so every point is added and removed once.
+    """
+    name = 'IDT'
+    OTHER_STATE = 'Saccade'  # state of the points outside the fixation windows
+
+    def __init__(self, dispersion_threshold=1.0, min_fixation_samples=6):
+        super().__init__(min_fixation_samples)
+        self.dispersion_threshold = dispersion_threshold
+        self.windows = None
+
+    def params(self):
+        return {**super().params(), 'dispersion_threshold': self.dispersion_threshold}
+
+    def lookahead(self):
+        # The window tested at the last start before a saccade reaches min_fixation_samples points further
+        return self.min_fixation_samples
+
+    def classify(self, x, y, states):
+        xs, ys = self.to_mm(x, y)
+        candidates = np.equal(states, None) & np.isfinite(xs) & np.isfinite(ys)
+        threshold = self.degree_to_mm(self.dispersion_threshold)
+        self.windows = []
+        xs, ys = xs.tolist(), ys.tolist()
+        # Fixation windows never span samples that are already labelled
+        for start, end in zip(*find_runs(candidates)):
+            self.windows.extend(self.dispersion_windows(xs, ys, start, end, threshold))
+        states[np.equal(states, None)] = self.OTHER_STATE
+        if self.windows:
+            starts, ends = np.array(self.windows).T
+            states[run_indices(starts, ends - starts)] = 'Fixation'
+
+    def dispersion_windows(self, xs, ys, first, last, threshold):
+        windows = []
+        size = self.min_fixation_samples
+        max_x, min_x, max_y, min_y = deque(), deque(), deque(), deque()
+
+        def add(i):
+            x, y = xs[i], ys[i]
+            while max_x and xs[max_x[-1]] <= x:
+                max_x.pop()
+            max_x.append(i)
+            while min_x and xs[min_x[-1]] >= x:
+                min_x.pop()
+            min_x.append(i)
+            while max_y and ys[max_y[-1]] <= y:
+                max_y.pop()
+            max_y.append(i)
+            while min_y and ys[min_y[-1]] >= y:
+                min_y.pop()
+            min_y.append(i)
+
+        # The window is [start, end)
+        start = end = first
+        while start + size <= last:
+            while end < start + size:
+                add(end)
+                end += 1
+            if xs[max_x[0]] - xs[min_x[0]] + ys[max_y[0]] - ys[min_y[0]] <= threshold:
+                # Grow the fixation while the next point keeps the dispersion below the threshold
+                while end < last:
+                    x, y = xs[end], ys[end]
+                    dispersion = (max(xs[max_x[0]], x) - min(xs[min_x[0]], x)
+                                  + max(ys[max_y[0]], y) - min(ys[min_y[0]], y))
+                    if dispersion > threshold:
+                        break
+                    add(end)
+                    end += 1
+                windows.append((start, end))
+                start = end
+                max_x.clear(), min_x.clear(), max_y.clear(), min_y.clear()
+            else:
+                # Slide the window by one point
+                for extremes in (max_x, min_x, max_y, min_y):
+                    if extremes[0] == start:
+                        extremes.popleft()
+                start += 1
+        return windows
+
+    def fixation_runs(self, states):
+        # Two fixation windows next to each other are still two fixations
+        if not self.windows:
+            return np.array([], dtype=int), np.array([], dtype=int)
+        return tuple(np.array(self.windows).T)
+
+
+class IVVTClassifier(EyeMovementClassifier):
+    """
+    Velocity above saccade_threshold is a saccade, between pursuit_threshold and saccade_threshold a smooth pursuit,
+    below pursuit_threshold a fixation (degree per second).
+    """
+    name = 'IVVT'
+
+    def __init__(self, saccade_threshold=30, pursuit_threshold=10, min_fixation_samples=6):
+        super().__init__(min_fixation_samples)
+        self.saccade_threshold = saccade_threshold
+        self.pursuit_threshold = pursuit_threshold
+
+    def params(self):
+        return {**super().params(), 'saccade_threshold': self.saccade_threshold, 'pursuit_threshold': self.pursuit_threshold}
+
+    def classify(self, x, y, states):
+        unlabelled = np.equal(states, None)
+        v = self.velocity(x, y)
+        saccade = unlabelled & (v >= self.saccade_threshold)
+        pursuit = unlabelled & (v >= self.pursuit_threshold) & ~saccade
+        states[saccade] = 'Saccade'
+        states[pursuit] = 'Smooth Pursuit'
+        states[unlabelled & ~saccade & ~pursuit] = 'Fixation'
+
+
+class IVDTClassifier(IDTClassifier):
+    """
+    Saccades are found with the velocity threshold, then the dispersion windows of IDTClassifier
+    split the remaining points into fixations and smooth pursuits.
+    """
+    name = 'IVDT'
+    OTHER_STATE = 'Smooth Pursuit'
+
+    def __init__(self, saccade_threshold=30, dispersion_threshold=1.0, min_fixation_samples=6):
+        super().__init__(dispersion_threshold, min_fixation_samples)
+        self.saccade_threshold = saccade_threshold
+
+    def params(self):
+        return {**super().params(), 'saccade_threshold': self.saccade_threshold}
+
+    def classify(self, x, y, states):
+        states[np.equal(states, None) & (self.velocity(x, y) >= self.saccade_threshold)] = 'Saccade'
+        super().classify(x, y, states)
+
+
+CLASSIFIERS = {cls.name: cls for cls in (IVTClassifier, IDTClassifier, IVVTClassifier, IVDTClassifier)}
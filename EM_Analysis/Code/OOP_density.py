@@ -0,0 +1,86 @@
+"""
+Please import the functions from this script to compute gaze density maps, as drawn by GazeHeatmap.
+
+GazeHeatmap used to add a 2D Gaussian of n x n values to the display once per gaze sample.
+The same map is computed here in two steps:
+    point_grid  the weight of the samples on every pixel, a (height + 1, width + 1) histogram of the display
+    density     the grid convolved with the Gaussian, one axis after the other (the 2D Gaussian is the product of two 1D ones)
+The convolutions are products with banded matrices, only over the rows and columns of the grid that have samples,
+so their cost depends on the number of distinct pixels and not on the number of samples.
+With grid_step > 1 the grid is pooled in blocks of grid_step x grid_step pixels, convolved with a kernel as many times smaller,
+and the result is upsampled to the display, for quick previews of large maps.
+    grid = point_grid(pixel_x, pixel_y, 1920, 1080)
+    heatmap = density(grid, 500, 33)
+"""
+from functools import cache
+import numpy as np
+import cv2
+
+
+@cache
+def gaussian_kernel(size, sigma):
+    # exp(-(k - size // 2)^2 / (2 sigma^2)) for k in [0, size), the center is the same as GazeHeatmap.gaussian
+    kernel = np.exp(-((np.arange(size) - size // 2) ** 2) / (2 * float(sigma) ** 2))
+    kernel.flags.writeable = False
+    return kernel
+
+
+def gaussian_matrix(x, sx, y=None, sy=None):
+    # The y x x matrix of GazeHeatmap.gaussian
+    if y is None:
+        y = x
+    if sy is None:
+        sy = sx
+    xo, yo = x // 2, y // 2
+    i, j = np.arange(x, dtype=float), np.arange(y, dtype=float)[:, None]
+    return np.exp(-1.0 * (((i - xo) ** 2 / (2 * sx ** 2)) + ((j - yo) ** 2 / (2 * sy ** 2))))
+
+
+def point_grid(pixel_x, pixel_y, width, height, weights=None):
+    # Sum of the weights (1 per sample by default) on every pixel; int() of a pixel rounds toward zero,
+    # and the pixels from 0 to width and from 0 to height are kept, as in GazeHeatmap.draw_heatmap
+    pixel_x = np.trunc(np.asarray(pixel_x, dtype='float64')).astype('int64')
+    pixel_y = np.trunc(np.asarray(pixel_y, dtype='float64')).astype('int64')
+    inside = (pixel_x >= 0) & (pixel_x <= width) & (pixel_y >= 0) & (pixel_y <= height)
+    if weights is not None:
+        weights = np.asarray(weights, dtype='float64')[inside]
+    grid = np.bincount(pixel_y[inside] * (width + 1) + pixel_x[inside], weights=weights, minlength=(height + 1) * (width + 1))
+    return grid.astype('float64').reshape(height + 1, width + 1)
+
+
+def band(positions, size, kernel):
+    # matrix[i, c] = kernel[c - positions[i] + len(kernel) // 2], 0 outside the kernel
+    k = np.arange(size)[None, :] - positions[:, None] + len(kernel) // 2
+    inside = (k >= 0) & (k < len(kernel))
+    return np.where(inside, kernel[np.clip(k, 0, len(kernel) - 1)], 0.0)
+
+
+def convolve(grid, kernel_x, kernel_y, width, height):
+    # (height, width) map of the Gaussians of every pixel of the grid, clipped to the display
+    rows = np.flatnonzero(grid.any(axis=1))
+    columns = np.flatnonzero(grid.any(axis=0))
+    if len(rows) == 0:
+        return np.zeros((height, width))
+    weights = grid[np.ix_(rows, columns)]
+    return band(rows, height, kernel_y).T @ (weights @ band(columns, width, kernel_x))
+
+
+def density(grid, n_gaussian_matrix, standard_deviation, grid_step=1):
+    """
+    grid: (height + 1, width + 1) weights of point_grid
+    Return the (height, width) density of GazeHeatmap: a Gaussian of n_gaussian_matrix values and standard_deviation
+    on every pixel of the grid, weighted by the grid.
+    """
+    height, width = grid.shape[0] - 1, grid.shape[1] - 1
+    if grid_step == 1:
+        kernel = gaussian_kernel(n_gaussian_matrix, standard_deviation)
+        return convolve(grid, kernel, kernel, width, height)
+
+    # Sum of every block of grid_step x grid_step pixels, then the density of the blocks upsampled to the display
+    # (the last row and column of the grid, on the edge of the display, go to the last block)
+    rows, columns = -(-height // grid_step), -(-width // grid_step)
+    pooled = np.add.reduceat(grid, np.arange(rows) * grid_step, axis=0)
+    pooled = np.add.reduceat(pooled, np.arange(columns) * grid_step, axis=1)
+    kernel = gaussian_kernel(max(n_gaussian_matrix // grid_step, 1), standard_deviation / grid_step)
+    coarse = convolve(pooled, kernel, kernel, columns, rows)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR)
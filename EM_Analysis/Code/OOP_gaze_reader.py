@@ -0,0 +1,94 @@
+"""
+Please import the functions from this script to read the point columns of the Synced and Processed csv files.
+Points are written as "(x, y)", "(None, None)" or "(nan, nan)" when missing, and the fixation centroids
+as "(np.float64(x), np.float64(y))". Instead of one literal_eval or eval per row, a whole column is joined
+into one string and parsed by numpy in a single call.
+
+Run this script to compare it with the row by row converters on your files:
+    python EM_Analysis/Code/OOP_gaze_reader.py [csv files]
+"""
+import os
+import sys
+import ast
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import parse_point_column, POINT_COLUMNS
+
+# Everything around the two numbers of a point
+POINT_WRAPPERS = ['np.float64(', 'np.float32(', '(', ')']
+
+
+def parse_points(values, dtype='float32'):
+    """Split a column of "(x, y)" strings into x and y arrays, NaN where the point is missing."""
+    values = pd.Series(values, dtype=object)
+    if len(values) == 0:
+        return np.array([], dtype=dtype), np.array([], dtype=dtype)
+    text = ','.join(values.fillna('nan, nan').astype(str).tolist())
+    for wrapper in POINT_WRAPPERS:
+        text = text.replace(wrapper, '')
+    text = text.replace('None', 'nan')
+    try:
+        with warnings.catch_warnings():
+            # numpy only warns when it stops at text that is not a number
+            warnings.simplefilter('error')
+            numbers = np.fromstring(text, sep=',')
+    except (ValueError, DeprecationWarning):
+        numbers = None
+    if numbers is None or len(numbers) != 2 * len(values):
+        # A row that is not a pair of numbers: the slower parser handles it row by row
+        x, y = parse_point_column(values)
+    else:
+        x, y = numbers[0::2], numbers[1::2]
+    return x.astype(dtype), y.astype(dtype)
+
+
+def to_pixels(x, y, width, height):
+    # Pixel coordinates on the display of the points that are not missing
+    valid = ~(np.isnan(x) | np.isnan(y))
+    return x[valid].astype('float64') * width, y[valid].astype('float64') * height
+
+
+def point_tuples(x, y):
+    # Object array of (x, y) tuples, (None, None) where the point is missing, the layout EyeMovement works on
+    missing = (np.isnan(x) | np.isnan(y)).tolist()
+    points = [(None, None) if m else p for m, p in zip(missing, zip(x.tolist(), y.tolist()))]
+    return np.fromiter(points, dtype=object, count=len(points))
+
+
+def _literal_eval_point(value):
+    # The converter preprocess.py used before
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return (None, None)
+
+
+def benchmark(file_path):
+    df = pd.read_csv(file_path)
+    for column in POINT_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        start = time.perf_counter()
+        values.map(_literal_eval_point)
+        literal_time = time.perf_counter() - start
+        start = time.perf_counter()
+        # The visualizers used eval, which needs np for the centroids
+        values.dropna().map(lambda value: eval(value, {'np': np}))
+        eval_time = time.perf_counter() - start
+        start = time.perf_counter()
+        parse_points(values)
+        parse_time = time.perf_counter() - start
+        print(f"{os.path.basename(file_path)} {column} ({len(values)} rows): literal_eval {literal_time:.3f} s, "
+              f"eval {eval_time:.3f} s, parse_points {parse_time:.3f} s ({literal_time / parse_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or [os.path.join('./Data_Collection/Data/Processed/', f)
+                             for f in sorted(os.listdir('./Data_Collection/Data/Processed/')) if f.endswith('.csv')]
+    for path in paths:
+        benchmark(path)
@@ -0,0 +1,200 @@
+"""
+Please import GroupHeatmap class from this script.
+Group heatmaps add up the gaze of every Processed session for each stimulus.
+
+The contribution of a session to a stimulus is the number of gaze samples on every pixel of the display
+(the grid of OOP_density.point_grid), and the group map is the density of the sum of the grids,
+which is the same map as the sum of the maps of every session.
+A session stored in several formats (.csv, .gaze, .parquet) counts once, from its most recently written file.
+Contributions are stored per session in Data_Collection/Data/GroupHeatmaps/<stimulus>/<session>.npz
+next to the sum over all sessions, so a new session only adds its own contribution to the sum,
+and a changed or removed session only adds up the stored contributions again, no gaze is read twice.
+With normalize every participant weighs the same: each contribution is divided by its number of samples.
+    group = GroupHeatmap()
+    group.update(jobs=8)
+    group.draw('807715.jpg', normalize=True)
+
+Run this script to update the contributions and draw the group heatmap of every stimulus:
+    python EM_Analysis/Code/OOP_group_heatmap.py [--jobs 8] [--normalize] [--stimuli 807715.jpg ...]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_reader import to_pixels
+from OOP_catalog import Catalog, read_range, latest_formats
+from OOP_HeatMap import GazeHeatmap
+from OOP_density import point_grid
+
+
+def pixel_counts(x, y, width, height):
+    # Number of valid samples on every pixel, as the flat indices and values of the nonzero cells of point_grid
+    grid = point_grid(*to_pixels(x, y, width, height), width, height).ravel()
+    index = np.flatnonzero(grid)
+    return index.astype('uint32'), grid[index].astype('uint32')
+
+
+def session_contributions(path, eye, epochs, width, height, store_dir):
+    # Runs in a worker process: save the contribution of one session to each of its stimuli, return the number of samples
+    counts = {}
+    for stimulus in sorted({epoch['stimulus'] for epoch in epochs}):
+        pieces = [read_range(path, epoch['start_row'], epoch['end_row'], [f'{eye}_gaze_x', f'{eye}_gaze_y'], epoch['byte_offset'])
+                  for epoch in epochs if epoch['stimulus'] == stimulus]
+        x = np.concatenate([df[f'{eye}_gaze_x'].to_numpy(dtype='float64') for df in pieces])
+        y = np.concatenate([df[f'{eye}_gaze_y'].to_numpy(dtype='float64') for df in pieces])
+        index, count = pixel_counts(x, y, width, height)
+        os.makedirs(os.path.join(store_dir, stimulus), exist_ok=True)
+        np.savez(GroupHeatmap.contribution_path(store_dir, stimulus, path), index=index, count=count)
+        counts[stimulus] = int(count.sum())
+    return counts
+
+
+class GroupHeatmap:
+    STORE_DIR = './Data_Collection/Data/GroupHeatmaps/'
+    OUTPUT_DIR = './EM_Analysis/Result/group_heatmap/'
+
+    def __init__(self, display_width=1920, display_height=1080, store_dir=STORE_DIR, catalog_path=Catalog.PATH):
+        self.display_width = display_width
+        self.display_height = display_height
+        self.store_dir = store_dir
+        self.catalog_path = catalog_path
+        self.manifest_path = os.path.join(store_dir, 'manifest.json')
+        self.manifest = self.load_manifest()
+
+    @staticmethod
+    def contribution_path(store_dir, stimulus, path):
+        return os.path.join(store_dir, stimulus, os.path.basename(path) + '.npz')
+
+    def load_manifest(self):
+        # file -> signature and number of samples of each stimulus; a display of another size starts a new store
+        display = [self.display_width, self.display_height]
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+            if manifest['display'] == display:
+                return manifest
+            shutil.rmtree(self.store_dir)
+        return {'display': display, 'sessions': {}}
+
+    def save_manifest(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.manifest_path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file, indent=1, sort_keys=True)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def update(self, directory=Catalog.PROCESSED_DIR, jobs=None):
+        """
+        Add the contributions of the new sessions of the folder, and take out the changed and removed ones.
+        Return the number of sessions that were read.
+        """
+        with closing(Catalog(self.catalog_path)) as catalog:
+            catalog.update(directory)
+            prefix = os.path.join(os.path.abspath(directory), '')
+            # One file per recording, even if it was converted to another format next to its csv
+            sessions = {s['file']: s for s in latest_formats(s for s in catalog.sessions() if s['file'].startswith(prefix))}
+            epochs = {path: catalog.epochs(files=[path]) for path in sessions}
+        known = self.manifest['sessions']
+        stale = [path for path, s in sessions.items()
+                 if path not in known or known[path]['signature'] != [s['size'], s['mtime_ns']]]
+        removed = [path for path in known if path not in sessions or path in stale]
+
+        # Stimuli whose sum is made again from the stored contributions
+        rebuild = set()
+        for path in removed:
+            for stimulus in known[path]['stimuli']:
+                rebuild.add(stimulus)
+                if os.path.exists(GroupHeatmap.contribution_path(self.store_dir, stimulus, path)):
+                    os.remove(GroupHeatmap.contribution_path(self.store_dir, stimulus, path))
+            del known[path]
+        added = {}
+        for path in stale:
+            if sessions[path]['eye_to_use'] is None:
+                # No valid gaze in the session
+                known[path] = {'signature': [sessions[path]['size'], sessions[path]['mtime_ns']], 'stimuli': {}}
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(session_contributions, path, sessions[path]['eye_to_use'], epochs[path],
+                                   self.display_width, self.display_height, self.store_dir): path
+                       for path in stale if sessions[path]['eye_to_use'] is not None}
+            for future in as_completed(futures):
+                path = futures[future]
+                known[path] = {'signature': [sessions[path]['size'], sessions[path]['mtime_ns']], 'stimuli': future.result()}
+                added[path] = known[path]['stimuli']
+
+        # Every sum records its sessions, so a sum saved before an interrupted run never counts a session twice
+        for stimulus in rebuild | {stimulus for counts in added.values() for stimulus in counts}:
+            sessions = {path for path, s in known.items() if stimulus in s['stimuli']}
+            total, normalized, included = self.load_sum(stimulus)
+            if stimulus in rebuild or not included <= sessions:
+                total, normalized = self.add_up(stimulus, sessions)
+            else:
+                new_total, new_normalized = self.add_up(stimulus, sessions - included)
+                total, normalized = total + new_total, normalized + new_normalized
+            self.save_sum(stimulus, total, normalized, sessions)
+        self.save_manifest()
+        return len(added)
+
+    def add_up(self, stimulus, paths):
+        # Sum of the contributions of these sessions, and sum of the contributions divided by their number of samples
+        size = (self.display_height + 1) * (self.display_width + 1)
+        total, normalized = np.zeros(size), np.zeros(size)
+        for path in sorted(paths):
+            with np.load(GroupHeatmap.contribution_path(self.store_dir, stimulus, path)) as contribution:
+                index, count = contribution['index'], contribution['count'].astype('float64')
+            total[index] += count
+            if count.sum() > 0:
+                normalized[index] += count / count.sum()
+        return total, normalized
+
+    def load_sum(self, stimulus):
+        # The two sums of add_up and the sessions they include
+        path = os.path.join(self.store_dir, stimulus, 'sum.npz')
+        if not os.path.exists(path):
+            size = (self.display_height + 1) * (self.display_width + 1)
+            return np.zeros(size), np.zeros(size), set()
+        with np.load(path) as group:
+            return group['total'], group['normalized'], set(group['sessions'].tolist())
+
+    def save_sum(self, stimulus, total, normalized, sessions):
+        os.makedirs(os.path.join(self.store_dir, stimulus), exist_ok=True)
+        path = os.path.join(self.store_dir, stimulus, 'sum.npz')
+        # np.savez adds .npz to a name without it
+        np.savez_compressed(path + '.tmp.npz', total=total, normalized=normalized, sessions=np.array(sorted(sessions), dtype=str))
+        os.replace(path + '.tmp.npz', path)
+
+    def stimuli(self):
+        return sorted({stimulus for s in self.manifest['sessions'].values() for stimulus in s['stimuli']})
+
+    def participants(self, stimulus):
+        return sum(stimulus in s['stimuli'] for s in self.manifest['sessions'].values())
+
+    def weights(self, stimulus, normalize=False):
+        # Weight of every pixel of the (height + 1, width + 1) grid
+        total, normalized, _ = self.load_sum(stimulus)
+        return (normalized if normalize else total).reshape(self.display_height + 1, self.display_width + 1)
+
+    def draw(self, stimulus, normalize=False, **heatmap_args):
+        # Group heatmap of one stimulus, drawn by GazeHeatmap from the summed grid
+        heatmap = GazeHeatmap(None, stimulus, display_width=self.display_width, display_height=self.display_height, **heatmap_args)
+        heatmap.output_name = os.path.join(GroupHeatmap.OUTPUT_DIR, 'normalized' if normalize else 'total', stimulus)
+        os.makedirs(os.path.dirname(heatmap.output_name), exist_ok=True)
+        return heatmap.draw_heatmap(self.weights(stimulus, normalize))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the group heatmap of every stimulus over all Processed sessions.")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--normalize', action='store_true', help="every participant weighs the same")
+    parser.add_argument('--stimuli', nargs='+', default=None, help="only draw these stimuli")
+    args = parser.parse_args()
+
+    group = GroupHeatmap()
+    print(f"{group.update(jobs=args.jobs)} sessions added")
+    for stimulus in args.stimuli or [s for s in group.stimuli() if s.endswith('.jpg')]:
+        group.draw(stimulus, normalize=args.normalize)
+        print(f"{stimulus}: {group.participants(stimulus)} participants")
@@ -0,0 +1,93 @@
+"""
+Please import HeatmapCache class from this script.
+The density of a heatmap (before the threshold and the colormap) is kept in an on-disk cache, one compressed .npz file
+per session, stimulus and parameters of the density (n_gaussian_matrix, standard_deviation, grid_step, display size).
+Drawing a heatmap again with another alpha or output file then reads one array instead of the gaze of the session.
+    cache = HeatmapCache()
+    heatmap = GazeHeatmap(path, '807715.jpg', cache=cache)
+
+The file name has a hash of the key and a hash of the size and modification time of the session,
+so a changed Processed file is a cache miss, and its old entries are removed when the new one is saved.
+The cache is kept under max_bytes by removing the least recently used entries; a hit updates the modification time of its file.
+"""
+import os
+import glob
+import json
+import hashlib
+import threading
+import numpy as np
+
+from OOP_catalog import file_signature
+
+
+class HeatmapCache:
+    CACHE_DIR = './Data_Collection/Data/HeatmapCache/'
+    MAX_BYTES = 2 << 30
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, input_path, stimulus, params):
+        # <key hash>_<session hash>.npz, the key is the session, the stimulus and the parameters
+        key = json.dumps([os.path.abspath(input_path), stimulus, params], sort_keys=True)
+        key_digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        signature = hashlib.sha1(json.dumps(file_signature(input_path)).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key_digest}_{signature}.npz")
+
+    def load(self, input_path, stimulus, params):
+        # The density, or None if it is not in the cache
+        path = self.path(input_path, stimulus, params)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as entry:
+                density = entry['density']
+        except (ValueError, OSError, KeyError):
+            return None  # damaged cache file, compute the density again
+        os.utime(path)
+        return density
+
+    def save(self, input_path, stimulus, params, density):
+        path = self.path(input_path, stimulus, params)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary file first so that readers never see a half-written entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.savez_compressed(file, density=density)
+        os.replace(tmp_path, path)
+        # Entries of an older version of the session
+        for old in glob.glob(os.path.join(self.cache_dir, os.path.basename(path).split('_')[0] + '_*.npz')):
+            if old != path:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+        self.evict()
+
+    def entries(self):
+        # (modification time, size, path) of every entry, least recently used first
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npz')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
@@ -0,0 +1,253 @@
+"""
+Please import OnlineEyeMovement class from this script.
+This class labels gaze samples while they are recorded, with the same rules as EyeMovement.run in preprocess.py:
+gap interpolation, blink detection, I-VT, fixation centroids and the Saccade-Error-Saccade cleanup.
+
+Samples go through a chain of small stages, each keeping only the state it needs:
+    gap        the current run of missing samples (held only while it could still be interpolated)
+    velocity   one sample, waiting for the next point
+    fixation   the current fixation run, until it ends and its centroid is known
+    smoothing  one sample, waiting for the next state
+    events     the current event, until the state changes
+Finished fixation/saccade/blink/error events are passed to on_event as soon as they are known.
+
+The eye with more valid samples is chosen at the end, like EyeMovement.decide_eye_to_use,
+so both eyes are classified side by side.
+"""
+import numpy as np
+from math import sqrt
+from preprocess import EyeMovement
+from OOP_classifiers import run_means
+
+
+class OnlineIVT:
+    MAX_INTERPOLATION_GAP = 4  # same as EyeMovement.interpolate_coordinates
+
+    def __init__(self, on_event=None, keep_samples=True):
+        self.on_event = on_event
+        # keep_samples=True stores the state and centroid of every sample, to compare with the offline output
+        self.keep_samples = keep_samples
+        self.states = []
+        self.centroids = []
+        self.events = []
+        self.n_samples = 0
+
+        # gap stage
+        self.gap = []
+        self.last_valid = None
+        # velocity stage
+        self.pending = None
+        # fixation stage
+        self.fixation = []
+        # smoothing stage
+        self.held = None
+        self.previous_state = None
+        # event stage
+        self.event = None
+
+        self.stages = [self._gap_stage, self._velocity_stage, self._fixation_stage, self._smoothing_stage, self._event_stage]
+        self.finishers = [self._gap_finish, self._velocity_finish, self._fixation_finish, self._smoothing_finish, self._event_finish]
+
+    def push(self, timestamp, validity, x, y):
+        # A sample is [index, timestamp, x, y, state, centroid]; missing samples have no coordinates
+        if validity == 0:
+            x, y = np.nan, np.nan
+        self._forward(0, [[self.n_samples, timestamp, x, y, None, None]])
+        self.n_samples += 1
+
+    def finish(self):
+        # End of the recording: flush every stage in order
+        for level, finisher in enumerate(self.finishers):
+            self._forward(level + 1, finisher())
+
+    def _forward(self, level, samples):
+        if level == len(self.stages):
+            return
+        for sample in samples:
+            self._forward(level + 1, self.stages[level](sample))
+
+    # Interpolate gaps of at most 4 frames, mark longer gaps as Blink and unrecoverable ones as Error
+    def _gap_stage(self, sample):
+        if sample[2] != sample[2]:  # missing sample
+            if self.gap is None:
+                # Already known to be a blink
+                sample[4] = 'Blink'
+                return [sample]
+            self.gap.append(sample)
+            if len(self.gap) >= max(self.MAX_INTERPOLATION_GAP + 1, EyeMovement.BLINK_THRESHOLD):
+                released = self._label_gap('Blink')
+                self.gap = None
+                return released
+            return []
+
+        released = []
+        if self.gap is None:
+            self.gap = []
+        elif self.gap:
+            if len(self.gap) <= self.MAX_INTERPOLATION_GAP and self.last_valid is not None:
+                x1, y1 = self.last_valid
+                x2, y2 = sample[2], sample[3]
+                n_missing = len(self.gap)
+                for j, missing in enumerate(self.gap):
+                    alpha = (j + 1) / (n_missing + 1)
+                    missing[2] = x1 + alpha * (x2 - x1)
+                    missing[3] = y1 + alpha * (y2 - y1)
+                released = self.gap
+            else:
+                released = self._label_gap('Blink' if len(self.gap) >= EyeMovement.BLINK_THRESHOLD else 'Error')
+            self.gap = []
+        self.last_valid = (sample[2], sample[3])
+        released.append(sample)
+        return released
+
+    def _label_gap(self, state):
+        for missing in self.gap:
+            missing[4] = state
+        return self.gap
+
+    def _gap_finish(self):
+        # A gap at the end of the recording cannot be interpolated
+        if not self.gap:
+            return []
+        return self._label_gap('Blink' if len(self.gap) >= EyeMovement.BLINK_THRESHOLD else 'Error')
+
+    # Saccade if the velocity to the next point is above the threshold, otherwise Fixation
+    def _velocity_stage(self, sample):
+        pending, self.pending = self.pending, sample
+        if pending is None:
+            return []
+        if pending[4] is None:
+            if pending[2] == pending[2] and sample[2] == sample[2]:
+                x1, y1 = pending[2] * EyeMovement.SCREEN_SIZE_W, pending[3] * EyeMovement.SCREEN_SIZE_H
+                x2, y2 = sample[2] * EyeMovement.SCREEN_SIZE_W, sample[3] * EyeMovement.SCREEN_SIZE_H
+                d = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+                v = np.rad2deg(np.arctan(d / EyeMovement.SCREEN_TO_EYE_DIST)) * EyeMovement.SAMPLING_RATE
+                if v >= EyeMovement.IVT_SACCADE_THRESHOLD:
+                    pending[4] = 'Saccade'
+            if pending[4] is None:
+                pending[4] = 'Fixation'
+        return [pending]
+
+    def _velocity_finish(self):
+        pending, self.pending = self.pending, None
+        if pending is None:
+            return []
+        if pending[4] is None:
+            pending[4] = 'Fixation'
+        return [pending]
+
+    # Fixations need at least 6 frames, their centroid is the mean of the points
+    def _fixation_stage(self, sample):
+        if sample[4] == 'Fixation':
+            self.fixation.append(sample)
+            return []
+        released = self._fixation_finish()
+        released.append(sample)
+        return released
+
+    def _fixation_finish(self):
+        run, self.fixation = self.fixation, []
+        if len(run) >= EyeMovement.IVT_FIXATION_THRESHOLD:
+            # The helper of the offline classifiers, so the centroid cannot drift from the one of EyeMovement.run
+            points = np.array([(s[2], s[3]) for s in run], dtype='float64')
+            starts, lengths = np.array([0]), np.array([len(run)])
+            centroid = (float(run_means(points[:, 0], starts, lengths)[0]), float(run_means(points[:, 1], starts, lengths)[0]))
+            for s in run:
+                s[5] = centroid
+        else:
+            for s in run:
+                s[4] = 'Error'
+        return run
+
+    # [Saccade, Error, Saccade] -> [Saccade, Saccade, Saccade]
+    def _smoothing_stage(self, sample):
+        held, self.held = self.held, sample
+        if held is None:
+            return []
+        state = held[4]
+        if state == 'Error' and self.previous_state == 'Saccade' and sample[4] == 'Saccade':
+            held[4] = 'Saccade'
+        self.previous_state = state
+        return [held]
+
+    def _smoothing_finish(self):
+        held, self.held = self.held, None
+        return [held] if held is not None else []
+
+    # Group consecutive samples with the same state into events
+    def _event_stage(self, sample):
+        if self.keep_samples:
+            self.states.append(sample[4])
+            self.centroids.append(sample[5] if sample[5] is not None else (None, None))
+        if self.event is not None and self.event['type'] != sample[4]:
+            self._emit_event()
+        if self.event is None:
+            self.event = {
+                'type': sample[4],
+                'start_index': sample[0],
+                'start_time': sample[1],
+                'centroid': sample[5],
+            }
+        self.event['end_index'] = sample[0] + 1
+        self.event['end_time'] = sample[1]
+        return []
+
+    def _event_finish(self):
+        if self.event is not None:
+            self._emit_event()
+        return []
+
+    def _emit_event(self):
+        event, self.event = self.event, None
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+
+class OnlineEyeMovement:
+    def __init__(self, on_event=None, keep_samples=True):
+        # on_event(eye, event) is called for both eyes, the final choice is only known at the end
+        self.eyes = {
+            eye: OnlineIVT(None if on_event is None else (lambda event, eye=eye: on_event(eye, event)), keep_samples)
+            for eye in ('left', 'right')
+        }
+        self.valid_counts = {'left': 0, 'right': 0}
+
+    @property
+    def eye_to_use(self):
+        # Same rule as EyeMovement.decide_eye_to_use
+        return 'left' if self.valid_counts['left'] > self.valid_counts['right'] else 'right'
+
+    def push(self, timestamp, left_validity, left_point, right_validity, right_point):
+        self.valid_counts['left'] += left_validity
+        self.valid_counts['right'] += right_validity
+        self.eyes['left'].push(timestamp, left_validity, *left_point)
+        self.eyes['right'].push(timestamp, right_validity, *right_point)
+
+    def push_batch(self, batch):
+        # batch is a numpy structured array from GazeRingBuffer.drain or a GazeSession
+        columns = [batch[name].tolist() for name in (
+            'timestamp', 'left_gaze_point_validity', 'left_gaze_x', 'left_gaze_y',
+            'right_gaze_point_validity', 'right_gaze_x', 'right_gaze_y')]
+        for timestamp, lv, lx, ly, rv, rx, ry in zip(*columns):
+            self.push(timestamp, lv, (lx, ly), rv, (rx, ry))
+
+    def finish(self):
+        for classifier in self.eyes.values():
+            classifier.finish()
+
+    @property
+    def classifier(self):
+        return self.eyes[self.eye_to_use]
+
+    @property
+    def states(self):
+        return self.classifier.states
+
+    @property
+    def centroids(self):
+        return self.classifier.centroids
+
+    @property
+    def events(self):
+        return self.classifier.events
@@ -0,0 +1,123 @@
+"""
+Please import the functions from this script to draw heatmaps and scanpaths with NumPy and OpenCV.
+The images are composited on the uint8 display instead of through a matplotlib figure:
+    colormap_lut   256 colors of a matplotlib colormap ('jet'), computed from its segment data without matplotlib
+    blend_heatmap  colors of a density map blended over the display, NaN is transparent (as ax.imshow(cmap='jet', alpha))
+    blend_circle, draw_dashed_line, draw_label  anti-aliased scanpath shapes at sub-pixel positions
+Sizes in points (line dashes, font size) are converted to pixels at the 100 dpi of the matplotlib figures.
+The stimuli are read through the frame cache of OOP_stimulus_cache.py: every image is decoded and resized once per display size,
+the frames are memory-mapped and shared by the worker processes, and the source images are never modified.
+"""
+import os
+import sys
+from functools import cache
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_stimulus_cache import load_frame
+
+DPI = 100.0
+# Segment data of matplotlib's colormaps: (x, value at x from the left, value at x from the right) of every channel
+SEGMENTS = {
+    'jet': {
+        'red': ((0.0, 0, 0), (0.35, 0, 0), (0.66, 1, 1), (0.89, 1, 1), (1.0, 0.5, 0.5)),
+        'green': ((0.0, 0, 0), (0.125, 0, 0), (0.375, 1, 1), (0.64, 1, 1), (0.91, 0, 0), (1.0, 0, 0)),
+        'blue': ((0.0, 0.5, 0.5), (0.11, 1, 1), (0.34, 1, 1), (0.65, 0, 0), (1.0, 0, 0)),
+    },
+}
+# Dashes of matplotlib's '--' line style, in points per point of line width
+DASH_PATTERN = (3.7, 1.6)
+# Height of the digits of matplotlib's default font per point of font size, and of cv2.FONT_HERSHEY_SIMPLEX at scale 1 in pixels
+DIGIT_HEIGHT = 0.73
+HERSHEY_DIGIT_HEIGHT = 20
+
+
+def points_to_pixels(points):
+    return points * DPI / 72
+
+
+@cache
+def colormap_lut(name='jet', n=256):
+    # (n, 3) float32 BGR colors in [0, 1], color i is the colormap at i / (n - 1)
+    x = np.linspace(0, 1, n)
+    channels = [np.interp(x, [s[0] for s in SEGMENTS[name][c]], [s[1] for s in SEGMENTS[name][c]]) for c in ('blue', 'green', 'red')]
+    lut = np.stack(channels, axis=1).astype('float32')
+    lut.flags.writeable = False
+    return lut
+
+
+def colormap_color(value, name='jet'):
+    # BGR color in [0, 255] of a value in [0, 1]
+    lut = colormap_lut(name)
+    return tuple(float(c) * 255 for c in lut[min(int(value * len(lut)), len(lut) - 1)])
+
+
+def display_frame(image_path, width, height):
+    # The image resized to the display of width x height, as a new BGR uint8 array
+    frame = load_frame(image_path, (width, height), mmap=True)
+    if frame is None:
+        raise Exception(f"ERROR in display_frame: imagefile not found at '{image_path}'")
+    return np.array(frame)
+
+
+def blend_heatmap(screen, heatmap, alpha, name='jet'):
+    # Colors of the finite values of heatmap, from the lowest to the highest one, blended over the screen
+    visible = np.isfinite(heatmap)
+    if not visible.any():
+        return screen.copy()
+    low, high = heatmap[visible].min(), heatmap[visible].max()
+    lut = colormap_lut(name)
+    scaled = (heatmap[visible] - low) / (high - low) if high > low else np.zeros(np.count_nonzero(visible))
+    colors = lut[np.minimum((scaled * len(lut)).astype('int64'), len(lut) - 1)] * 255
+    result = screen.copy()
+    result[visible] = np.rint(alpha * colors + (1 - alpha) * screen[visible]).astype('uint8')
+    return result
+
+
+def blend_circle(img, center, radius, color, alpha, shift=4):
+    # Filled anti-aliased circle blended over img in place, only the pixels around the circle are copied
+    x, y = center
+    x0, y0 = max(int(x - radius) - 2, 0), max(int(y - radius) - 2, 0)
+    x1, y1 = min(int(x + radius) + 3, img.shape[1]), min(int(y + radius) + 3, img.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+    roi = img[y0:y1, x0:x1]
+    overlay = roi.copy()
+    scale = 1 << shift
+    cv2.circle(overlay, (int(round((x - x0) * scale)), int(round((y - y0) * scale))), int(round(radius * scale)),
+               color, thickness=-1, lineType=cv2.LINE_AA, shift=shift)
+    cv2.addWeighted(overlay, alpha, roi, 1 - alpha, 0, dst=roi)
+
+
+def draw_dashed_line(img, start, end, color, linewidth=1, shift=4):
+    # Line with the dashes of matplotlib's '--' style, linewidth in points
+    length = np.hypot(end[0] - start[0], end[1] - start[1])
+    if length == 0:
+        return
+    dash, gap = (points_to_pixels(d * linewidth) for d in DASH_PATTERN)
+    direction = ((end[0] - start[0]) / length, (end[1] - start[1]) / length)
+    thickness = max(int(round(points_to_pixels(linewidth))), 1)
+    scale = 1 << shift
+    for offset in np.arange(0, length, dash + gap):
+        stop = min(offset + dash, length)
+        a = (start[0] + direction[0] * offset, start[1] + direction[1] * offset)
+        b = (start[0] + direction[0] * stop, start[1] + direction[1] * stop)
+        cv2.line(img, (int(round(a[0] * scale)), int(round(a[1] * scale))), (int(round(b[0] * scale)), int(round(b[1] * scale))),
+                 color, thickness, lineType=cv2.LINE_AA, shift=shift)
+
+
+def draw_label(img, text, center, fontsize, color=(0, 0, 0)):
+    # Text centered on center, fontsize in points, with digits as high as matplotlib's
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    height = DIGIT_HEIGHT * points_to_pixels(fontsize)
+    scale = height / HERSHEY_DIGIT_HEIGHT
+    (w, _), _ = cv2.getTextSize(text, font, scale, 1)
+    origin = (int(round(center[0] - w / 2)), int(round(center[1] + height / 2)))
+    cv2.putText(img, text, origin, font, scale, color, 1, lineType=cv2.LINE_AA)
+
+
+def save_image(path, img):
+    # PNG, JPEG, ... from the extension of path
+    if not cv2.imwrite(path, img):
+        raise Exception(f"ERROR in save_image: could not write '{path}'")
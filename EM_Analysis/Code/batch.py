@@ -0,0 +1,239 @@
+"""
+Step 2 and step 3 for the whole archive.
+This code runs integrate.py and preprocess.py over every session on a process pool, and only processes what is stale.
+
+A manifest per stage (Data_Collection/Data/Manifests/<stage>.json) records for every session the content hash of its input files
+and the hash of the parameters its output was produced with, and for preprocess the events table written with it.
+A session is processed again when an input or a parameter changed, or when its output or events table is missing.
+The Processed file only has the states of one classifier, so the events tables of the other classifiers are removed with it.
+Outputs are written to a temporary folder and renamed into place,
+so an interrupted run never leaves a half-written file in Synced or Processed.
+
+Usage:
+    python EM_Analysis/Code/batch.py [--stages integrate preprocess] [--jobs 8] [--force] [--dry-run]
+                                     [--classifier IDT] [--classifier-args '{"dispersion_threshold": 1.5}']
+                                     [--chunk-size 100000] [--format parquet]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import session_name, GAZE_SUFFIX
+from integrate import DataIntegration
+from preprocess import EyeMovement
+from OOP_classifiers import CLASSIFIERS
+
+MANIFEST_DIR = './Data_Collection/Data/Manifests/'
+# Temporary outputs, on the same file system as Synced and Processed so that the final rename is atomic
+TEMP_DIR = './Data_Collection/Data/.tmp/'
+STAGES = ['integrate', 'preprocess']
+
+
+def stage_jobs(stage):
+    # session -> (file name, input paths)
+    jobs = {}
+    if stage == 'integrate':
+        stimuli = {session_name(f): f for f in os.listdir(DataIntegration.STIMULI_DATA_DIR) if f.endswith('.csv')}
+        # sorted: a .gaze recording replaces a .csv recording of the same session, like get_matched_files
+        for f in sorted(os.listdir(DataIntegration.EM_DATA_DIR)):
+            if f.endswith(('.csv', GAZE_SUFFIX)) and session_name(f) in stimuli:
+                jobs[session_name(f)] = (f, [os.path.join(DataIntegration.EM_DATA_DIR, f),
+                                             os.path.join(DataIntegration.STIMULI_DATA_DIR, stimuli[session_name(f)])])
+    else:
+        for f in sorted(os.listdir(EyeMovement.INPUT_DIR)):
+            if f.endswith(('.csv', GAZE_SUFFIX)):
+                jobs[session_name(f)] = (f, [os.path.join(EyeMovement.INPUT_DIR, f)])
+    return jobs
+
+
+def stage_params(stage, classifier):
+    if stage == 'integrate':
+        return {
+            'durations': [DataIntegration.FIXATION_CROSS_DURATION, DataIntegration.STIMULUS_DURATION, DataIntegration.GREY_DURATION],
+            'phases': DataIntegration.PHASES,
+        }
+    return {
+        'classifier': classifier.params(),
+        'blink_threshold': EyeMovement.BLINK_THRESHOLD,
+        'geometry': EyeMovement.geometry(),
+    }
+
+
+def target_dir(stage):
+    return DataIntegration.TARGET_DIR if stage == 'integrate' else EyeMovement.TARGET_DIR
+
+
+def output_name(stage, file_name, output_format=None):
+    return file_name if stage == 'integrate' else EyeMovement.output_name(file_name, output_format)
+
+
+def events_name(stage, file_name, classifier):
+    # Events table written next to the output, None for integrate
+    return None if stage == 'integrate' else EyeMovement.events_name(file_name, classifier.name)
+
+
+def file_hash(path):
+    # .gaze sessions are folders: hash the name and content of every file in it
+    digest = hashlib.sha256()
+    paths = [path] if os.path.isfile(path) else [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    for file_path in paths:
+        digest.update(os.path.basename(file_path).encode())
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    # Size and modification time of every file, to skip hashing inputs that did not change since the last run
+    paths = [path] if os.path.isfile(path) else [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    return [[os.path.basename(p), os.path.getsize(p), os.stat(p).st_mtime_ns] for p in paths]
+
+
+def input_hashes(paths, entry):
+    known = entry.get('inputs', {}) if entry else {}
+    hashes = {}
+    for path in paths:
+        signature = file_signature(path)
+        if path in known and known[path]['signature'] == signature:
+            hashes[path] = known[path]
+        else:
+            hashes[path] = {'signature': signature, 'sha256': file_hash(path)}
+    return hashes
+
+
+def load_manifest(stage):
+    path = os.path.join(MANIFEST_DIR, f'{stage}.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(stage, manifest):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = os.path.join(MANIFEST_DIR, f'{stage}.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def publish(source, destination):
+    # Move a finished output into place; a .gaze folder cannot replace a folder, so the old one is moved away first
+    if os.path.isdir(destination):
+        old = tempfile.mkdtemp(dir=TEMP_DIR)
+        os.replace(destination, os.path.join(old, os.path.basename(destination)))
+        os.replace(source, destination)
+        shutil.rmtree(old)
+    else:
+        os.replace(source, destination)
+
+
+def run_task(stage, file_name, classifier, chunk_size=None, output_format=None):
+    # Runs in a worker process
+    start = time.perf_counter()
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=TEMP_DIR)
+    try:
+        if stage == 'integrate':
+            task = DataIntegration(file_name)
+        else:
+            task = EyeMovement(file_name, classifier=classifier, chunk_size=chunk_size, output_format=output_format)
+        task.target_dir = work_dir
+        if stage != 'integrate':
+            task.events_dir = work_dir
+        task.run()
+        output = output_name(stage, file_name, output_format)
+        publish(os.path.join(work_dir, output), os.path.join(target_dir(stage), output))
+        if stage != 'integrate':
+            # The events table is published with the samples
+            events = EyeMovement.events_name(file_name, task.classifier.name)
+            os.makedirs(EyeMovement.EVENTS_DIR, exist_ok=True)
+            publish(os.path.join(work_dir, events), os.path.join(EyeMovement.EVENTS_DIR, events))
+            # The events of another classifier were made from the states that were just replaced
+            for name in CLASSIFIERS:
+                old = os.path.join(EyeMovement.EVENTS_DIR, EyeMovement.events_name(file_name, name))
+                if name != task.classifier.name and os.path.exists(old):
+                    os.remove(old)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return time.perf_counter() - start
+
+
+def run_stage(stage, classifier, jobs, force=False, dry_run=False, chunk_size=None, output_format=None):
+    manifest = load_manifest(stage)
+    params = stage_params(stage, classifier)
+    params_hash = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    # Find the stale sessions
+    all_jobs = stage_jobs(stage)
+    stale = {}
+    for session, (file_name, inputs) in all_jobs.items():
+        entry = manifest.get(session)
+        hashes = input_hashes(inputs, entry)
+        output = output_name(stage, file_name, output_format)
+        events = events_name(stage, file_name, classifier)
+        up_to_date = (entry is not None and entry['params'] == params_hash and entry['output'] == output
+                      and entry.get('events') == events
+                      and {p: h['sha256'] for p, h in entry['inputs'].items()} == {p: h['sha256'] for p, h in hashes.items()}
+                      and os.path.exists(os.path.join(target_dir(stage), output))
+                      and (events is None or os.path.exists(os.path.join(EyeMovement.EVENTS_DIR, events))))
+        if force or not up_to_date:
+            stale[session] = (file_name, hashes)
+    print(f"{stage}: {len(stale)} of {len(all_jobs)} sessions to process")
+    if dry_run or not stale:
+        return 0
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_task, stage, file_name, classifier, chunk_size, output_format): session for session, (file_name, _) in stale.items()}
+        for future in as_completed(futures):
+            session = futures[future]
+            file_name, hashes = stale[session]
+            try:
+                seconds = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"  {file_name} failed: {error!r}")
+                continue
+            # Saved after every session, so an interrupted run keeps what is already done
+            manifest[session] = {'output': output_name(stage, file_name, output_format),
+                                 'events': events_name(stage, file_name, classifier), 'inputs': hashes,
+                                 'params': params_hash, 'parameters': params}
+            save_manifest(stage, manifest)
+            print(f"  {file_name} done in {seconds:.1f} s")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run integrate.py and preprocess.py in parallel on the stale sessions.")
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--classifier', default='IVT', choices=list(CLASSIFIERS))
+    parser.add_argument('--classifier-args', default='{}', help="json object of classifier parameters")
+    # The chunked output is identical, so it is not part of the preprocess parameters
+    parser.add_argument('--chunk-size', type=int, default=None, help="preprocess the csv files this many rows at a time")
+    parser.add_argument('--format', default=None, choices=['parquet'], help="preprocess output format, the format of the input by default")
+    parser.add_argument('--force', action='store_true', help="process every session again")
+    parser.add_argument('--dry-run', action='store_true', help="only list how many sessions are stale")
+    args = parser.parse_args()
+
+    classifier_args = json.loads(args.classifier_args)
+    if args.classifier == 'IVT' and not classifier_args:
+        classifier = EyeMovement.default_classifier()
+    else:
+        classifier = CLASSIFIERS[args.classifier](**classifier_args)
+
+    failed = 0
+    # The stages run one after the other, preprocess sees the Synced files that integrate has just written
+    for stage in STAGES:
+        if stage in args.stages:
+            failed += run_stage(stage, classifier, args.jobs, args.force, args.dry_run, args.chunk_size, args.format)
+    sys.exit(1 if failed else 0)
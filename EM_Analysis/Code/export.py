@@ -0,0 +1,131 @@
+"""
+Step 4 without the menu of visualize.py.
+This code renders the heatmap, scanpath and piechart of every session x stimulus on a process pool,
+and skips the outputs that are newer than their session (and its events table for the scanpath).
+A session in several formats (.csv, .gaze, .parquet) is rendered once, from its most recently written file.
+The results are saved in EM_Analysis/Result/heatmap/<session>/<stimulus>,
+and EM_Analysis/Result/<method>/<classifier>/<session>/<stimulus> for the scanpaths and piecharts, which depend on the classifier.
+
+Usage:
+    python EM_Analysis/Code/export.py [--sessions 'Data_Collection/Data/Processed/*'] [--stimuli '*.jpg']
+                                      [--methods heatmap scanpath piechart] [--jobs 8] [--force] [--dry-run]
+"""
+import os
+import sys
+import glob
+import time
+import fnmatch
+import argparse
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import session_name, GAZE_SUFFIX, PARQUET_SUFFIX
+from OOP_catalog import Catalog, file_signature, latest_formats
+from OOP_HeatMap import GazeHeatmap
+from OOP_Scanpath import GazeScanpath
+
+RESULT_DIR = './EM_Analysis/Result/'
+METHODS = ['heatmap', 'scanpath', 'piechart']
+# Methods drawn from the states or fixations of a classifier
+CLASSIFIER_METHODS = ['scanpath', 'piechart']
+
+
+def output_path(result_dir, method, session_path, stimulus, classifier):
+    folder = os.path.join(result_dir, method, classifier) if method in CLASSIFIER_METHODS else os.path.join(result_dir, method)
+    return os.path.join(folder, session_name(os.path.basename(session_path)), stimulus)
+
+
+def renderer(method, session_path, stimulus, classifier):
+    if method == 'heatmap':
+        return GazeHeatmap(session_path, stimulus)
+    if method == 'scanpath':
+        return GazeScanpath(session_path, stimulus, classifier=classifier)
+    # plotly is only needed for the piecharts
+    from OOP_Piechart import GazePiechart
+    return GazePiechart(session_path, stimulus, classifier=classifier, show=False)
+
+
+def input_mtime(method, session_path, classifier):
+    # Latest modification time of what the output is made from
+    mtime = file_signature(session_path)[1]
+    if method == 'scanpath':
+        events_path = GazeScanpath.events_file(session_path, classifier)
+        if os.path.exists(events_path):
+            mtime = max(mtime, os.stat(events_path).st_mtime_ns)
+    return mtime
+
+
+def render(method, session_path, stimulus, output, classifier):
+    # Runs in a worker process
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    task = renderer(method, session_path, stimulus, classifier)
+    task.output_name = output
+    task.run()
+    return time.perf_counter() - start
+
+
+def find_tasks(session_patterns, stimulus_patterns, methods, result_dir, classifier, force=False):
+    # (method, session, stimulus, output) of every output to render, and the number of outputs that are up to date
+    sessions = sorted({os.path.abspath(path) for pattern in session_patterns for path in glob.glob(pattern)
+                       if path.endswith(('.csv', GAZE_SUFFIX, PARQUET_SUFFIX))})
+    tasks, up_to_date = [], 0
+    with closing(Catalog()) as catalog:
+        for session_path in sessions:
+            catalog.update_file(session_path)
+        # The outputs are named after the session, so a session in several formats is rendered once, from its latest file
+        sessions = [s['file'] for s in latest_formats(catalog.session(path) for path in sessions)]
+        for session_path in sessions:
+            stimuli = [s for s in catalog.stimuli([session_path]) if any(fnmatch.fnmatch(s, p) for p in stimulus_patterns)]
+            for stimulus in stimuli:
+                for method in methods:
+                    output = output_path(result_dir, method, session_path, stimulus, classifier)
+                    if (not force and os.path.exists(output)
+                            and os.stat(output).st_mtime_ns >= input_mtime(method, session_path, classifier)):
+                        up_to_date += 1
+                        continue
+                    tasks.append((method, session_path, stimulus, output))
+    return tasks, up_to_date
+
+
+def export(session_patterns, stimulus_patterns, methods, jobs, result_dir=RESULT_DIR, classifier='IVT', force=False, dry_run=False):
+    tasks, up_to_date = find_tasks(session_patterns, stimulus_patterns, methods, result_dir, classifier, force)
+    print(f"{len(tasks)} outputs to render, {up_to_date} up to date")
+    if dry_run or not tasks:
+        return 0
+
+    start = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(render, method, session_path, stimulus, output, classifier): (method, session_path, stimulus)
+                   for method, session_path, stimulus, output in tasks}
+        for future in as_completed(futures):
+            method, session_path, stimulus = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                failed.append((method, session_path, stimulus, error))
+    seconds = time.perf_counter() - start
+
+    done = len(tasks) - len(failed)
+    print(f"{done} outputs rendered in {seconds:.1f} s ({done / seconds:.1f} per second), {len(failed)} failed")
+    for method, session_path, stimulus, error in failed:
+        print(f"  {method} {os.path.basename(session_path)} {stimulus}: {error!r}")
+    return len(failed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render every session x stimulus x method without the interactive menu.")
+    parser.add_argument('--sessions', nargs='+', default=[os.path.join(Catalog.PROCESSED_DIR, '*')], help="globs of Processed sessions")
+    parser.add_argument('--stimuli', nargs='+', default=['*.jpg'], help="globs of stimulus names")
+    parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--classifier', default='IVT', help="classifier of the eye states and fixations, as in preprocess.py")
+    parser.add_argument('--result-dir', default=RESULT_DIR)
+    parser.add_argument('--force', action='store_true', help="render every output again")
+    parser.add_argument('--dry-run', action='store_true', help="only count the outputs to render")
+    args = parser.parse_args()
+
+    failed = export(args.sessions, args.stimuli, args.methods, args.jobs, args.result_dir, args.classifier, args.force, args.dry_run)
+    sys.exit(1 if failed else 0)
@@ -4,25 +4,42 @@ Step 3.
 Please run this code after step 1 and step 2 in Data_Collection folder.
 This code will process the eye tracking data and identify the eye state for each frame.
 
-The result will be saved in the Data_Collection/Data/Processed folder.
+The result will be saved in the Data_Collection/Data/Processed folder,
+and one row per fixation, saccade, blink, ... in Data_Collection/Data/Events/<session>_<classifier>.csv.
+Very long recordings can be processed in chunks with bounded memory, with the same result:
+    python EM_Analysis/Code/preprocess.py --chunk-size 100000
+The result can be written as typed Parquet files instead, with one row group per stimulus (needs pyarrow):
+    python EM_Analysis/Code/preprocess.py --format parquet
 """
 
 import os
+import sys
+import warnings
 import pandas as pd
 import numpy as np
-from math import tan, pi, sqrt
+from math import tan, pi
 from functools import cache
-import ast
+from numpy.lib.stride_tricks import sliding_window_view
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data_Collection', 'Code'))
+from OOP_gaze_format import (GazeSession, write_session, write_parquet, is_session, session_name, timestamps_to_ns,
+                             POINT_COLUMNS, PARQUET_SUFFIX)
+from OOP_classifiers import IVTClassifier, CLASSIFIERS, run_indices, find_runs
+from OOP_gaze_reader import parse_points, point_tuples
 
 def get_matched_files():
-    files_input = os.listdir(EyeMovement.INPUT_DIR)
-    files_target = os.listdir(EyeMovement.TARGET_DIR)
+    files_input = {session_name(f): f for f in sorted(os.listdir(EyeMovement.INPUT_DIR))}
+    files_target = {session_name(f) for f in os.listdir(EyeMovement.TARGET_DIR)}
     # return the files that are in the input folder but not in the target folder
-    return list(set(files_input) - set(files_target))
-    
+    return [files_input[name] for name in files_input.keys() - files_target]
+
 class EyeMovement:
     INPUT_DIR = './Data_Collection/Data/Synced/'
     TARGET_DIR = './Data_Collection/Data/Processed/'
+    EVENTS_DIR = './Data_Collection/Data/Events/'
+    # run_chunked warns when it carries more rows than this many chunks
+    MAX_CARRY_CHUNKS = 4
 
     SCREEN_SIZE_W = 596.7  # mm
     PIXEL_PER_MM = SCREEN_SIZE_W / 1920
@@ -35,175 +52,339 @@ class EyeMovement:
     IVT_SACCADE_THRESHOLD = 30  # 30 degree per second
     IVT_FIXATION_THRESHOLD = 6  # Fixation is at least 100ms
 
-    def __init__(self, filename):
+    def __init__(self, filename, classifier=None, chunk_size=None, output_format=None):
         self.filename = filename
+        # output_format='parquet' writes <session>.parquet, otherwise the output has the format of the input
+        self.output_format = output_format
+        self.output_filename = EyeMovement.output_name(filename, output_format)
         self.filepath = os.path.join(EyeMovement.INPUT_DIR, filename)
-        self.data = self._load_data()
+        # chunk_size: number of csv rows read at a time by run_chunked, None reads the whole file at once
+        self.chunk_size = chunk_size
+        self.data = self._load_data() if chunk_size is None else None
         self.eye_to_use = None
         self.col = None
         self.validity_col = None
         self.states = []
         self.blink = []
+        # Float coordinates of the chosen eye and the gaps that were not interpolated, set by interpolate_coordinates
+        self.x = None
+        self.y = None
+        self.gaps = None
+        # Event detection algorithm, see OOP_classifiers.py; the default is the I-VT with the parameters above
+        self.classifier = classifier or EyeMovement.default_classifier()
+        self.target_dir = EyeMovement.TARGET_DIR
+        # Events table, set by classify
+        self.events = None
+        self.events_dir = EyeMovement.EVENTS_DIR
 
-    def _convert_to_tuple(self, value):
-        try:
-            return ast.literal_eval(value)
-        except (ValueError, SyntaxError):
-            # Handle the exception or return a default value
-            return (None, None)
+    def _parse_point_columns(self, data):
+        # "(x, y)" strings to (x, y) tuples, (None, None) for the missing points, parsed a whole column at a time
+        for column in ['left_gaze_point_on_display_area', 'right_gaze_point_on_display_area']:
+            data[column] = point_tuples(*parse_points(data[column], dtype='float64'))
+        return data
 
     def _load_data(self) -> pd.DataFrame:
-        converters = {
-            'left_gaze_point_on_display_area': self._convert_to_tuple,
-            'right_gaze_point_on_display_area': self._convert_to_tuple
-        }
-        return pd.read_csv(self.filepath, converters=converters)
+        if is_session(self.filename):
+            return self._load_session()
+        return self._parse_point_columns(pd.read_csv(self.filepath))
+
+    def _load_session(self) -> pd.DataFrame:
+        # Rebuild the csv layout from the memory-mapped columns, no string parsing needed
+        session = GazeSession(self.filepath)
+        data = {}
+        for name in session.columns:
+            prefix = name[:-2]
+            if name.endswith('_y') and prefix in POINT_COLUMNS.values():
+                continue
+            if name.endswith('_x') and prefix in POINT_COLUMNS.values():
+                csv_name = next(key for key, value in POINT_COLUMNS.items() if value == prefix)
+                data[csv_name] = point_tuples(*session.points(prefix))
+            elif name in session.categories:
+                data[name] = session.labels(name)
+            else:
+                data[name] = session[name]
+        return pd.DataFrame(data)
     
     def decide_eye_to_use(self):
-        left_valid = self.data['left_gaze_point_validity'].sum()
-        right_valid = self.data['right_gaze_point_validity'].sum()
+        if self.data is None:
+            # Chunked mode: a first pass over the two validity columns only
+            left_valid = right_valid = 0
+            columns = ['left_gaze_point_validity', 'right_gaze_point_validity']
+            for chunk in pd.read_csv(self.filepath, usecols=columns, chunksize=self.chunk_size):
+                left_valid += chunk['left_gaze_point_validity'].sum()
+                right_valid += chunk['right_gaze_point_validity'].sum()
+        else:
+            left_valid = self.data['left_gaze_point_validity'].sum()
+            right_valid = self.data['right_gaze_point_validity'].sum()
         self.eye_to_use = 'left' if left_valid > right_valid else 'right'
         self.col = f'{self.eye_to_use}_gaze_point_on_display_area'
         self.validity_col = f'{self.eye_to_use}_gaze_point_validity'
-        self.data['eye_to_use'] = self.eye_to_use
+        if self.data is not None:
+            self.data['eye_to_use'] = self.eye_to_use
+
+    def find_gaps(self):
+        # Start and end (exclusive) of every run of missing samples, computed once on the validity vector
+        return find_runs(self.data[self.validity_col].to_numpy() == 0)
+
+    def load_coordinates(self):
+        # Float x/y arrays of the gaze points of the chosen eye, missing points are NaN
+        points = np.array(self.data[self.col].tolist(), dtype='float64').reshape(-1, 2)
+        self.x, self.y = points[:, 0].copy(), points[:, 1].copy()
 
     def interpolate_coordinates(self):
-        idx = 0
-        while idx < len(self.data):
-            # If the current point is missing
-            if self.data.at[idx, self.validity_col] == 0:
-                start_idx = idx
-                while idx < len(self.data) and self.data.at[idx, self.validity_col] == 0:
-                    idx += 1
-                end_idx = idx
-                
-                # Check if the count of missing points is 4 or fewer
-                if 1 <= (end_idx - start_idx) <= 4:
-                    # Ensure that both bounding points are valid for interpolation
-                    if start_idx > 0 and end_idx < len(self.data):
-                        x1, y1 = self.data.at[start_idx - 1, self.col]
-                        x2, y2 = self.data.at[end_idx, self.col]
-                        
-                        # Linear interpolation for each missing point
-                        for j in range(start_idx, end_idx):
-                            alpha = (j - start_idx + 1) / (end_idx - start_idx + 1)
-                            x = x1 + alpha * (x2 - x1)
-                            y = y1 + alpha * (y2 - y1)
-                            self.data.at[j, self.col] = (x, y)
-                            # set validity to 2 to indicate that the point is interpolated
-                            self.data.at[j, self.validity_col] = 2
-            else:
-                idx += 1
+        self.load_coordinates()
+        starts, ends = self.find_gaps()
+        lengths = ends - starts
+
+        # Gaps of 4 or fewer points are interpolated when both bounding points are valid
+        interpolate = (lengths <= 4) & (starts > 0) & (ends < len(self.data))
+        self.gaps = (starts[~interpolate], ends[~interpolate])
+        starts, ends, lengths = starts[interpolate], ends[interpolate], lengths[interpolate]
+        if len(starts) == 0:
+            return
+
+        # One row per missing point: its index, the bounding points of its gap and its position in the gap
+        idx = run_indices(starts, lengths)
+        alpha = (idx - np.repeat(starts, lengths) + 1) / np.repeat(lengths + 1, lengths)
+        x1, y1 = np.repeat(self.x[starts - 1], lengths), np.repeat(self.y[starts - 1], lengths)
+        x2, y2 = np.repeat(self.x[ends], lengths), np.repeat(self.y[ends], lengths)
+        self.x[idx] = x1 + alpha * (x2 - x1)
+        self.y[idx] = y1 + alpha * (y2 - y1)
+
+        points = self.data[self.col].to_numpy(dtype=object, copy=True)
+        points[idx] = np.fromiter(zip(self.x[idx].tolist(), self.y[idx].tolist()), dtype=object, count=len(idx))
+        self.data[self.col] = points
+        # set validity to 2 to indicate that the point is interpolated
+        validity = self.data[self.validity_col].to_numpy(copy=True)
+        validity[idx] = 2
+        self.data[self.validity_col] = validity
 
     def identify_blink(self):
-        idx = 0
-        total_rows = len(self.data)
-
-        while idx < total_rows:
-            # Check if the eye data is missing at the current index
-            if self.data.at[idx, self.validity_col] == 0:
-                blink_start_idx = idx
-                while (idx < total_rows and self.data.at[idx, self.validity_col] == 0):
-                    idx += 1
-                blink_end_idx = idx
-
-                # Check if the consecutive missing frames count as a blink or just error states
-                if blink_end_idx - blink_start_idx >= EyeMovement.BLINK_THRESHOLD:
-                    self.blink.extend(['Blink'] * (blink_end_idx - blink_start_idx))
-                else:
-                    self.blink.extend(['Error'] * (blink_end_idx - blink_start_idx))
-            else:
-                self.blink.append(None)
-                idx += 1
+        # The gaps left after interpolation are blinks if they are long enough, otherwise error states
+        starts, ends = self.gaps if self.gaps is not None else self.find_gaps()
+        blink = np.full(len(self.data), None, dtype=object)
+        lengths = ends - starts
+        labels = np.where(lengths >= EyeMovement.BLINK_THRESHOLD, 'Blink', 'Error').astype(object)
+        idx = run_indices(starts, lengths)
+        blink[idx] = np.repeat(labels, lengths)
+        self.blink = blink.tolist()
                 
-    def visual_angle_calculation(self, p1, p2):
-        # Convert to actual coordinates on monitor
-        x1, y1 = p1[0] * EyeMovement.SCREEN_SIZE_W, p1[1] * EyeMovement.SCREEN_SIZE_H
-        x2, y2 = p2[0] * EyeMovement.SCREEN_SIZE_W, p2[1] * EyeMovement.SCREEN_SIZE_H
-        d = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-        theta = np.arctan(d / EyeMovement.SCREEN_TO_EYE_DIST)
-        theta = np.rad2deg(theta)
-        return theta
-                
-    def IVT(self):
+    @staticmethod
+    def output_name(filename, output_format=None):
+        return session_name(filename) + PARQUET_SUFFIX if output_format == 'parquet' else filename
+
+    @staticmethod
+    def events_name(filename, classifier_name):
+        return f'{session_name(filename)}_{classifier_name}.csv'
+
+    @classmethod
+    def default_classifier(cls):
+        return IVTClassifier(cls.IVT_SACCADE_THRESHOLD, cls.IVT_FIXATION_THRESHOLD)
+
+    @classmethod
+    def geometry(cls):
+        return {
+            'screen_width': cls.SCREEN_SIZE_W,
+            'screen_height': cls.SCREEN_SIZE_H,
+            'distance': cls.SCREEN_TO_EYE_DIST,
+            'sampling_rate': cls.SAMPLING_RATE,
+        }
+
+    def classify(self):
+        # Label the samples that are not Blink/Error with the classifier, e.g. IVT_state and IVT_fixation_centroid
+        if self.x is None:
+            self.load_coordinates()
+        states, centroids = self.classifier.run(self.x, self.y, self.blink, EyeMovement.geometry())
+        self.states = states.tolist()
+        self.data[f'{self.classifier.name}_state'] = self.states
+        self.data[f'{self.classifier.name}_fixation_centroid'] = centroids
+        self.events = self.find_events(states)
+
+    def find_events(self, states):
+        # One row per fixation, saccade, blink, ... with the measures of OOP_classifiers.EyeMovementClassifier.events
+        # and every event belongs to one stimulus
+        stimuli = self.data['stimuli'].to_numpy() if 'stimuli' in self.data.columns else None
+        if stimuli is None:
+            breaks = None
+        else:
+            codes = pd.factorize(stimuli)[0]
+            breaks = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        events = self.classifier.events(self.x, self.y, states, breaks)
+        starts, ends = events.pop('start'), events.pop('end')
+        timestamps = self.data['timestamp'].to_numpy()
+        stimuli = None if stimuli is None else stimuli[starts]
+        return pd.DataFrame({
+            'type': events.pop('type'),
+            'start_index': starts,
+            'end_index': ends - 1,  # last sample of the event
+            'start_time': timestamps[starts],
+            'end_time': timestamps[ends - 1],
+            'n_samples': ends - starts,
+            'duration_ms': (ends - starts) * 1000 / EyeMovement.SAMPLING_RATE,
+            **events,
+            'stimulus': stimuli,
+        })
+
+    def add_events_to_csv(self):
+        os.makedirs(self.events_dir, exist_ok=True)
+        self.events.to_csv(os.path.join(self.events_dir, EyeMovement.events_name(self.filename, self.classifier.name)), index=False)
+
+    def add_state_to_csv(self):
+        if is_session(self.filename) or self.output_format == 'parquet':
+            self.add_state_to_session()
+            return
+        self.data.to_csv(os.path.join(self.target_dir, self.filename), index=False)
+
+    def add_state_to_session(self):
+        # Same content as the csv output, but with typed columns and eye_to_use stored once per session
+        columns = {}
+        for name in self.data.columns:
+            if name == 'eye_to_use':
+                continue
+            if name in POINT_COLUMNS:
+                points = [(np.nan, np.nan) if p[0] is None else p for p in self.data[name]]
+                x, y = np.array(points, dtype='float64').reshape(-1, 2).T
+                columns[f'{POINT_COLUMNS[name]}_x'], columns[f'{POINT_COLUMNS[name]}_y'] = x, y
+            elif name == 'timestamp' and not pd.api.types.is_integer_dtype(self.data[name]):
+                # Text timestamps of a csv input
+                columns[name] = timestamps_to_ns(self.data[name])
+            elif name.endswith('_validity'):
+                columns[name] = self.data[name].to_numpy(dtype='uint8')
+            else:
+                columns[name] = self.data[name].to_numpy()
+        path = os.path.join(self.target_dir, self.output_filename)
+        if self.output_format == 'parquet':
+            write_parquet(path, columns, {'eye_to_use': self.eye_to_use})
+        else:
+            write_session(path, columns, {'eye_to_use': self.eye_to_use})
+
+    def chunk_boundary(self, missing):
         """
-        Calculate the distance between each consecutive point, 
-        if the distance is greater than the threshold, then it is a saccade
-        The rest of the points are fixations, however, if the fixation is less than 6 frames, it should be considered as an error
-        identify saccade -> identify fixation -> compute center point -> add error state
+        Last row of self.data from which the rest of the recording gives the same result when it is processed on its own,
+        0 if there is none. missing: the rows of the chosen eye that were missing before interpolation.
+        Such a row is either
+            a sample that was valid and is a saccade before smoothing: no gap, fixation or smoothed pattern spans it,
+            and it stays a saccade as the first row of the next chunk, or
+            the middle of a gap of at least 2 * BLINK_THRESHOLD samples: both halves are blinks on their own.
+        The saccade must be followed by enough rows before the unresolved gap at the end of the chunk,
+        since its state and the states before it depend on them.
         """
-        self.IVT_states = self.blink[:]
-        
-        # identify saccade
-        col = f'{self.eye_to_use}_gaze_point_on_display_area'
-        for i in range(len(self.data) - 1):
-            if self.IVT_states[i]:  # Skip already identified states
-                continue
-            
-            p1 = self.data.at[i, col]
-            p2 = self.data.at[i+1, col]
-            # Ignore the point where value is missing
-            if p1[0] is None or p2[0] is None or p1[1] is None or p2[1] is None: continue
-        
-            # Calculate the velocity, 
-            v = self.visual_angle_calculation(p1, p2) * EyeMovement.SAMPLING_RATE # 60 Hz sampling rate
-            if v >= EyeMovement.IVT_SACCADE_THRESHOLD:
-                self.IVT_states[i] = 'Saccade'
-        
-        # identify fixation
-        for i, state in enumerate(self.IVT_states):
-            if not state:
-                self.IVT_states[i] = 'Fixation'
-
-        # add state to the dataframe
-        self.data['IVT_state'] = self.IVT_states
-        
-        # compute fixation centroid
-        fixation_start = None
-        self.data['IVT_fixation_centroid'] = [(None, None)] * len(self.data)
-        IVT_states = self.IVT_states + ['End']
-        
-        for i, state in enumerate(IVT_states):
-            if state == 'Fixation':
-                if fixation_start is None:
-                    fixation_start = i
-            # Fixation has ended, check if it was longer or equal to 6 frames
-            elif fixation_start is not None:
-                if i - fixation_start >= EyeMovement.IVT_FIXATION_THRESHOLD:
-                    fixation_points = self.data[col][fixation_start:i]
-                    x_center = fixation_points.apply(lambda p: p[0]).mean()
-                    y_center = fixation_points.apply(lambda p: p[1]).mean()
-                    center_point = (x_center, y_center)
-                    for j in range(fixation_start, i):
-                        self.data.at[j, 'IVT_fixation_centroid'] = center_point
-                fixation_start = None
-        
-        # add error state
-        for i in range(len(self.data)):
-            if self.data.at[i, 'IVT_state'] == 'Fixation' and self.data.at[i, 'IVT_fixation_centroid'] == (None, None):
-                self.data.at[i, 'IVT_state'] = 'Error'
-                
-        # For 3 cosecutive eye states, change [Saccade, Error, Saccade] to [Saccade, Saccade, Saccade]
-        for i in range(len(self.data)-2):
-            first_state = self.data.at[i, 'IVT_state']
-            second_state = self.data.at[i+1, 'IVT_state']
-            third_state = self.data.at[i+2, 'IVT_state']
-            if first_state == 'Saccade' and second_state == 'Error' and third_state == 'Saccade':
-                self.data.at[i+1, 'IVT_state'] = 'Saccade'
+        rows = len(self.data)
+        valid = np.flatnonzero(~missing)
+        # The rows after the last valid sample are a gap whose length is not known yet
+        settled = valid[-1] + 1 if len(valid) else 0
+        states = np.array(self.states, dtype=object)
+        saccade = (states == 'Saccade') & ~self.classifier.smoothed & ~missing
+        # Only the first sample of a saccade, so that no saccade event is split in two
+        saccade[1:] &= states[:-1] != 'Saccade'
+        saccade[max(settled - self.classifier.lookahead(), 0):] = False
 
-    def add_state_to_csv(self):
-        self.data.to_csv(os.path.join(EyeMovement.TARGET_DIR, self.filename), index=False)
+        half = EyeMovement.BLINK_THRESHOLD
+        blink = np.zeros(rows, dtype=bool)
+        if rows >= 2 * half:
+            blink[half:rows - half + 1] = sliding_window_view(missing, 2 * half).all(axis=1)
+        boundaries = np.flatnonzero(saccade | blink)
+        return boundaries[-1] if len(boundaries) else 0
+
+    def run_chunked(self):
+        # Process chunk_size rows at a time and append them to the output as soon as their states are final.
+        # The rows from the last chunk boundary on are kept as they were read and processed again with the next chunk,
+        # so the memory use is bounded by chunk_size plus the longest stretch without a saccade or a long blink.
+        # That bound depends on the data: a recording that never has one (e.g. the tracker lost the eyes for good, or a long
+        # smooth pursuit) is carried whole until its end. The rows are not cut anyway, since that would change the result,
+        # but a warning is given once the carried rows exceed MAX_CARRY_CHUNKS chunks.
+        if is_session(self.filename):
+            raise ValueError("Chunked mode reads csv files, .gaze sessions are memory-mapped already.")
+        if self.output_format == 'parquet':
+            raise ValueError("Chunked mode writes csv files.")
+        self.decide_eye_to_use()
+        rest = None
+        # Rows written so far and the events of every chunk
+        written = 0
+        events = []
+        warned = False
+        with open(os.path.join(self.target_dir, self.filename), 'w', newline='') as file:
+            for chunk in pd.read_csv(self.filepath, chunksize=self.chunk_size):
+                chunk = self._parse_point_columns(chunk)
+                raw = chunk if rest is None else pd.concat([rest, chunk], ignore_index=True)
+                self.process_chunk(raw)
+                boundary = self.chunk_boundary(raw[self.validity_col].to_numpy() == 0)
+                self.data.iloc[:boundary].to_csv(file, header=file.tell() == 0, index=False)
+                events.append(self.chunk_events(boundary, written))
+                written += boundary
+                rest = raw.iloc[boundary:].reset_index(drop=True)
+                if not warned and len(rest) > EyeMovement.MAX_CARRY_CHUNKS * self.chunk_size:
+                    warnings.warn(f"{self.filename}: {len(rest)} rows after row {written} have no chunk boundary yet "
+                                  f"and are kept in memory until one is found", RuntimeWarning)
+                    warned = True
+            if rest is not None:
+                # The end of the recording resolves every remaining row
+                self.process_chunk(rest)
+                self.data.to_csv(file, header=file.tell() == 0, index=False)
+                events.append(self.chunk_events(len(self.data), written))
+        self.events = EyeMovement.merge_events(events)
+        self.add_events_to_csv()
+
+    def chunk_events(self, boundary, offset):
+        # Events of the rows before the boundary, with their index in the whole recording; a blink may continue after it
+        events = self.events[self.events['start_index'] < boundary].copy()
+        if len(events) and events['end_index'].iloc[-1] >= boundary:
+            last = events.index[-1]
+            events.loc[last, 'end_index'] = boundary - 1
+            events.loc[last, 'end_time'] = self.data['timestamp'].iloc[boundary - 1]
+            events.loc[last, 'n_samples'] = boundary - events.loc[last, 'start_index']
+            events.loc[last, 'duration_ms'] = events.loc[last, 'n_samples'] * 1000 / EyeMovement.SAMPLING_RATE
+        events[['start_index', 'end_index']] += offset
+        return events
+
+    @staticmethod
+    def merge_events(events):
+        # Join the blinks that were cut at a chunk boundary: two events of the same type and stimulus next to each other,
+        # which only fixations can be otherwise
+        events = pd.concat(events, ignore_index=True)
+        stimulus = events['stimulus'].fillna('')
+        continued = ((events['type'] == events['type'].shift()) & (events['type'] != 'Fixation')
+                     & (stimulus == stimulus.shift())
+                     & (events['start_index'] == events['end_index'].shift() + 1))
+        if not continued.any():
+            return events
+        group = (~continued).cumsum()
+        merged = events.groupby(group).agg({name: 'first' for name in events.columns})
+        last = events.groupby(group)[['end_index', 'end_time']].last()
+        merged[['end_index', 'end_time']] = last
+        merged['n_samples'] = events.groupby(group)['n_samples'].sum()
+        merged['duration_ms'] = merged['n_samples'] * 1000 / EyeMovement.SAMPLING_RATE
+        return merged.reset_index(drop=True)
+
+    def process_chunk(self, raw):
+        self.data = raw.copy()
+        self.data['eye_to_use'] = self.eye_to_use
+        self.x = self.y = self.gaps = None
+        self.interpolate_coordinates()
+        self.identify_blink()
+        self.classify()
 
     def run(self):
+        if self.chunk_size is not None:
+            self.run_chunked()
+            return
         self.decide_eye_to_use()
         self.interpolate_coordinates()
         self.identify_blink()
-        self.IVT()
+        self.classify()
         self.add_state_to_csv()
+        self.add_events_to_csv()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Identify the eye state of every frame of the Synced files.")
+    parser.add_argument('--classifier', default='IVT', choices=list(CLASSIFIERS), help="event detection algorithm, with its default parameters")
+    parser.add_argument('--chunk-size', type=int, default=None, help="process the csv files this many rows at a time")
+    parser.add_argument('--format', default=None, choices=['parquet'], help="output format, the format of the input by default")
+    args = parser.parse_args()
+
     matched_files = get_matched_files()
     for filename in matched_files:
         print(f"Now processing file: {filename}\n")
-        em = EyeMovement(filename)
+        em = EyeMovement(filename, classifier=None if args.classifier == 'IVT' else CLASSIFIERS[args.classifier](),
+                         chunk_size=args.chunk_size, output_format=args.format)
         em.run()
\ No newline at end of file
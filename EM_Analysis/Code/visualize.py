@@ -8,6 +8,7 @@ import sys
 from OOP_Heatmap import GazeHeatmap
 from OOP_Scanpath import GazeScanpath
 from OOP_Piechart import GazePiechart
+from OOP_catalog import Catalog
 
 class Visualize:
     def __init__(self) -> None:
@@ -93,7 +94,12 @@ class Visualize:
         self.file_name = self.select_file()
         if self.file_name is None:
             return False
-        self.data = pd.read_csv(os.path.join(self.INPUT_DIR, self.file_name))
+        file_path = os.path.join(self.INPUT_DIR, self.file_name)
+        # The stimuli of every session are listed in the catalog, only new or changed files are read
+        catalog = Catalog()
+        catalog.update_file(file_path)
+        self.data = pd.DataFrame({'stimuli': catalog.stimuli([file_path])})
+        catalog.close()
         self.stimulus = self.select_stimulus(self.data)
         if self.stimulus is None:
             return False